@@ -1,5 +1,5 @@
 import abc
-from typing import Optional
+from typing import Optional, List, Tuple
 from value_object import UserName
 from entity import User
 from repository import UserRepository, IUserRepository
@@ -13,6 +13,10 @@ class IUserApplicationService(metaclass=abc.ABCMeta):
     def register(self, id: int, first_name: str, last_name: str):
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def register_many(self, users: List[Tuple[int, str, str]]):
+        raise NotImplementedError
+
     @abc.abstractmethod
     def get(self, id: int) -> Optional[User]:
         raise NotImplementedError
@@ -38,6 +42,24 @@ class UserApplicationService(IUserApplicationService):
             raise Exception(f"{user.user_name} はすでに存在しています")
         self.repository.save(user)
 
+    def register_many(self, users: List[Tuple[int, str, str]]):
+        """(id, first_name, last_name)のリストをまとめて登録する
+        重複の確認はバッチ内とデータストアに対して1回ずつ行い、1回の書き込みで保存する
+        """
+        new_users = [
+            User(id=id, user_name=UserName(first_name=first_name, last_name=last_name))
+            for id, first_name, last_name in users
+        ]
+        ids = set()
+        for user in new_users:
+            if user.id in ids:
+                raise Exception(f"id={user.id} が重複しています")
+            ids.add(user.id)
+        duplicated = self.service.duplicates(new_users)
+        if len(duplicated) > 0:
+            raise Exception(f"{duplicated[0].user_name} はすでに存在しています")
+        self.repository.save_many(new_users)
+
     def get(self, id: int) -> Optional[User]:
         """
         本が言うには、ドメインオブジェクト(User)のふるまいの呼び出しはアプリケーションサービスの役目であり、クライアントが自由に操作できてはいけないらしい。
@@ -67,9 +89,11 @@ class UserApplicationService(IUserApplicationService):
         if user is None:
             raise Exception(f"ユーザーが見つかりません (id={id})")
         if first_name is not None and last_name is not None:
-            user.user_name = UserName(first_name=first_name, last_name=last_name)
-            if (self.service.exists(user)):
-                raise Exception(f"{user.user_name} はすでに存在しています")
+            user_name = UserName(first_name=first_name, last_name=last_name)
+            # 重複を確認してから変更する (ユニットオブワークでは、findで返したオブジェクトが共有されているため)
+            if (self.service.exists(User(id=id, user_name=user_name))):
+                raise Exception(f"{user_name} はすでに存在しています")
+            user.change_name(user_name)
         self.repository.save(user)
     
     def delete(self, id: int):
@@ -100,6 +124,9 @@ if __name__ == "__main__":
     app.register(2, "foo", "bar")
     app.register(3, "hoge", "piyo")
 
+    # まとめて追加
+    app.register_many([(4, "alice", "smith"), (5, "bob", "jones")])
+
     # 取得
     print(app.get(1))  # id=1 user_name=UserName(first_name='kta', last_name='mido')
 
@@ -1,5 +1,6 @@
 import abc
-from typing import Optional
+from typing import Optional, List, Tuple
+from pydantic import BaseModel
 from value_object import UserName
 from entity import User
 from repository import UserRepository, IUserRepository
@@ -10,6 +11,10 @@ class IUserRegisterApplicationService(metaclass=abc.ABCMeta):
     def register(self, id: int, first_name: str, last_name: str):
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def register_many(self, users: List[Tuple[int, str, str]]):
+        raise NotImplementedError
+
 class IUserGetApplicationService(metaclass=abc.ABCMeta):
     @abc.abstractmethod
     def get(self, id: int) -> Optional[User]:
@@ -25,6 +30,20 @@ class IUserDeleteApplicationService(metaclass=abc.ABCMeta):
     def delete(self, id: int):
         raise NotImplementedError
 
+class UserPage(BaseModel):
+    """一覧の1ページ分。next_cursorを次のlistに渡すと続きを取得できる (最後のページならNone)"""
+    users: List[User]
+    next_cursor: Optional[int] = None
+
+class IUserListApplicationService(metaclass=abc.ABCMeta):
+    @abc.abstractmethod
+    def list(self, cursor: Optional[int] = None, limit: int = 100) -> UserPage:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def search(self, prefix: str, limit: int = 100) -> List[User]:
+        raise NotImplementedError
+
 class UserRegisterApplicationService(IUserRegisterApplicationService):
     def __init__(self, repository: IUserRepository, service: UserService):
         self.service = service
@@ -37,6 +56,24 @@ class UserRegisterApplicationService(IUserRegisterApplicationService):
             raise Exception(f"{user.user_name} はすでに存在しています")
         self.repository.save(user)
 
+    def register_many(self, users: List[Tuple[int, str, str]]):
+        """(id, first_name, last_name)のリストをまとめて登録する
+        重複の確認はバッチ内とデータストアに対して1回ずつ行い、1回の書き込みで保存する
+        """
+        new_users = [
+            User(id=id, user_name=UserName(first_name=first_name, last_name=last_name))
+            for id, first_name, last_name in users
+        ]
+        ids = set()
+        for user in new_users:
+            if user.id in ids:
+                raise Exception(f"id={user.id} が重複しています")
+            ids.add(user.id)
+        duplicated = self.service.duplicates(new_users)
+        if len(duplicated) > 0:
+            raise Exception(f"{duplicated[0].user_name} はすでに存在しています")
+        self.repository.save_many(new_users)
+
 class UserGetApplicationService(IUserGetApplicationService):
     def __init__(self, repository: IUserRepository, service: UserService):
         self.service = service
@@ -55,9 +92,11 @@ class UserUpdateApplicationService(IUserUpdateApplicationService):
         if user is None:
             raise Exception(f"ユーザーが見つかりません (id={id})")
         if first_name is not None and last_name is not None:
-            user.user_name = UserName(first_name=first_name, last_name=last_name)
-            if (self.service.exists(user)):
-                raise Exception(f"{user.user_name} はすでに存在しています")
+            user_name = UserName(first_name=first_name, last_name=last_name)
+            # 重複を確認してから変更する (ユニットオブワークでは、findで返したオブジェクトが共有されているため)
+            if (self.service.exists(User(id=id, user_name=user_name))):
+                raise Exception(f"{user_name} はすでに存在しています")
+            user.change_name(user_name)
         self.repository.save(user)
 
 class UserDeleteApplicationService(IUserDeleteApplicationService):
@@ -70,6 +109,32 @@ class UserDeleteApplicationService(IUserDeleteApplicationService):
             raise Exception(f"ユーザーが見つかりません (id={id})")
         self.repository.delete(user)
 
+class UserListApplicationService(IUserListApplicationService):
+    """ユーザーの一覧と名前の前方一致検索
+    リポジトリの並び順のインデックスを使うので、1ページの取得にかかる時間はユーザー数ではなくlimitに比例する
+    """
+    MAX_LIMIT = 1000
+
+    def __init__(self, repository: IUserRepository):
+        self.repository = repository
+
+    def _check_limit(self, limit: int):
+        if limit <= 0 or limit > self.MAX_LIMIT:
+            raise Exception(f"limitは1以上{self.MAX_LIMIT}以下にしてください (limit={limit})")
+
+    def list(self, cursor: Optional[int] = None, limit: int = 100) -> UserPage:
+        self._check_limit(limit)
+        # 1件多く取得して、次のページがあるかどうかを判定する
+        users = self.repository.list(cursor, limit + 1)
+        next_cursor = users[limit - 1].id if len(users) > limit else None
+        # リポジトリから読み込んだUserなので、バリデーションを省く
+        return UserPage.construct(users=users[:limit], next_cursor=next_cursor)
+
+    def search(self, prefix: str, limit: int = 100) -> List[User]:
+        """「姓 名」がprefixで始まるユーザーを名前の順に返す"""
+        self._check_limit(limit)
+        return self.repository.search_by_name_prefix(prefix, limit)
+
 
 
 if __name__ == "__main__":
@@ -92,6 +157,9 @@ if __name__ == "__main__":
     register_app.register(2, "hoge", "fuga")
     register_app.register(3, "foo", "bar")
 
+    # まとめて追加
+    register_app.register_many([(4, "alice", "smith"), (5, "bob", "jones")])
+
     # 取得
     get_app = UserGetApplicationService(repository, service)
     print(get_app.get(1))  # id=1 user_name=UserName(first_name='kta', last_name='mido')
@@ -100,6 +168,13 @@ if __name__ == "__main__":
     update_app = UserUpdateApplicationService(repository, service)
     update_app.update(1, "keita", "midorikawa")
 
+    # 一覧と検索
+    list_app = UserListApplicationService(repository)
+    page = list_app.list(limit=2)
+    print([user.id for user in page.users], page.next_cursor)  # [1, 2] 2
+    print([user.id for user in list_app.list(page.next_cursor, limit=2).users])  # [3, 4]
+    print([user.id for user in list_app.search("s")])  # [4] (smith alice)
+
     # 削除
     delete_app = UserDeleteApplicationService(repository)
     delete_app.delete(1)
\ No newline at end of file
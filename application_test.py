@@ -0,0 +1,550 @@
+import asyncio
+import io
+import json
+import os
+import tempfile
+import threading
+from entity import User
+from value_object import UserName
+from repository import UserRepository, StoreVersionConflict
+from domein_service import UserService
+from application import UserApplicationService
+from application_high_cohesion import UserRegisterApplicationService, UserListApplicationService
+from unit_of_work import UserUnitOfWork
+from async_repository import AsyncUserRepository, AsyncUserRepositoryAdapter
+from async_application import AsyncUserService, AsyncUserApplicationService
+from dependency_injector import providers
+from di_container import Container, ProductionContainer, create_production_container
+from import_budget import BUDGETS_MS, LAZY_MODULES, import_times
+from read_model import ProjectingUserRepository, UserQueryService
+from clean_architecture import UserBatchGetInteractor, UserBatchGetInputData, NdjsonUserPresenter
+
+
+class UserApplicationServiceTest:
+    """アプリケーションサービスのテストコード"""
+
+    def _repository(self) -> UserRepository:
+        return UserRepository(os.path.join(tempfile.mkdtemp(), "store.json"))
+
+    def test_register_many(self):
+        """まとめて登録したユーザーを取得できる"""
+        repository = self._repository()
+        app = UserApplicationService(repository, UserService(repository))
+        app.register_many([(1, "kta", "mido"), (2, "foo", "bar")])
+        assert str(app.get(1).user_name) == "kta mido"
+        assert str(app.get(2).user_name) == "foo bar"
+
+    def test_register_many_duplicated_in_batch(self):
+        """バッチ内で名前が重複していたら何も登録しない"""
+        repository = self._repository()
+        app = UserApplicationService(repository, UserService(repository))
+        try:
+            app.register_many([(1, "kta", "mido"), (2, "kta", "mido")])
+            raise AssertionError("重複しているのに登録できてしまった")
+        except AssertionError:
+            raise
+        except Exception as e:
+            assert "すでに存在しています" in str(e)
+        assert app.get(1) is None
+
+    def test_register_many_duplicated_in_store(self):
+        """すでに存在する名前が含まれていたら何も登録しない"""
+        repository = self._repository()
+        app = UserRegisterApplicationService(repository, UserService(repository))
+        app.register(1, "kta", "mido")
+        try:
+            app.register_many([(2, "foo", "bar"), (3, "kta", "mido")])
+            raise AssertionError("重複しているのに登録できてしまった")
+        except AssertionError:
+            raise
+        except Exception as e:
+            assert "すでに存在しています" in str(e)
+        assert repository.find(2) is None
+
+    def test_register_many_single_write(self):
+        """バッチ全体を1回の書き込みで保存する"""
+        repository = self._repository()
+        app = UserApplicationService(repository, UserService(repository))
+        writes = []
+        save = repository._save
+        repository._save = lambda schema: writes.append(1) or save(schema)
+        app.register_many([(i, f"foo{i}", "bar") for i in range(100)])
+        assert len(writes) == 1
+
+
+class UserUnitOfWorkTest:
+    """ユニットオブワークのテストコード"""
+
+    def _repository(self) -> UserRepository:
+        repository = UserRepository(os.path.join(tempfile.mkdtemp(), "store.json"))
+        repository.clear()
+        return repository
+
+    def _count_writes(self, repository: UserRepository) -> list:
+        writes = []
+        save = repository._save
+        repository._save = lambda schema: writes.append(1) or save(schema)
+        return writes
+
+    def test_commit_in_one_write(self):
+        """複数のユースケースの変更を1回の書き込みで保存する"""
+        repository = self._repository()
+        repository.save_many([
+            User(id=1, user_name=UserName(first_name="kta", last_name="mido")),
+            User(id=2, user_name=UserName(first_name="foo", last_name="bar")),
+        ])
+        writes = self._count_writes(repository)
+        with UserUnitOfWork(repository) as uow:
+            app = UserApplicationService(uow, UserService(uow))
+            app.register(3, "hoge", "piyo")
+            app.update(1, "keita", "midorikawa")
+            app.delete(2)
+            assert len(writes) == 0
+        assert len(writes) == 1
+        assert str(repository.find(1).user_name) == "keita midorikawa"
+        assert repository.find(2) is None
+        assert repository.find(3) is not None
+
+    def test_identity_map(self):
+        """同じidは何度findしても同じオブジェクトを返す"""
+        repository = self._repository()
+        repository.save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+        uow = UserUnitOfWork(repository)
+        user = uow.find(1)
+        assert uow.find(1) is user
+        assert uow.find_by_name(UserName(first_name="kta", last_name="mido")) is user
+
+    def test_pending_changes_are_visible(self):
+        """コミット前の変更はユニットオブワーク経由の検索に反映される"""
+        repository = self._repository()
+        repository.save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+        uow = UserUnitOfWork(repository)
+        user = uow.find(1)
+        user.change_name(UserName(first_name="keita", last_name="midorikawa"))
+        uow.save(user)
+        assert uow.find_by_name(UserName(first_name="kta", last_name="mido")) is None
+        assert uow.find_by_name(UserName(first_name="keita", last_name="midorikawa")) is user
+        uow.delete(user)
+        assert uow.find(1) is None
+
+    def test_rejected_update(self):
+        """名前の重複で失敗した更新は、アイデンティティマップのオブジェクトを変更しない"""
+        repository = self._repository()
+        repository.save_many([
+            User(id=1, user_name=UserName(first_name="a", last_name="b")),
+            User(id=2, user_name=UserName(first_name="c", last_name="d")),
+        ])
+        uow = UserUnitOfWork(repository)
+        app = UserApplicationService(uow, UserService(uow))
+        user = app.get(1)
+        try:
+            app.update(1, "c", "d")
+            assert False
+        except Exception as e:
+            assert "すでに存在しています" in str(e)
+        assert app.get(1) is user
+        assert str(user.user_name) == str(UserName(first_name="a", last_name="b"))
+        assert uow.find_by_name(UserName(first_name="a", last_name="b")) is user
+        assert uow.find_by_name(UserName(first_name="c", last_name="d")).id == 2
+        # saveしていない変更も、検索は現在の名前で判定する
+        user.change_name(UserName(first_name="e", last_name="f"))
+        assert uow.find_by_name(UserName(first_name="a", last_name="b")) is None
+
+    def test_rollback(self):
+        """rollbackすると何も書き込まない"""
+        repository = self._repository()
+        writes = self._count_writes(repository)
+        try:
+            with UserUnitOfWork(repository) as uow:
+                app = UserApplicationService(uow, UserService(uow))
+                app.register(1, "kta", "mido")
+                app.register(2, "kta", "mido")
+        except Exception as e:
+            assert "すでに存在しています" in str(e)
+        assert len(writes) == 0
+        assert repository.find(1) is None
+
+    def test_list_with_pending_changes(self):
+        """コミット前の保存・名前の変更・削除を、リポジトリのページと検索結果に重ねて返す"""
+        repository = self._repository()
+        repository.save_many([User(id=i, user_name=UserName(first_name=f"user{i}", last_name="mido")) for i in range(1, 6)])
+        with UserUnitOfWork(repository) as uow:
+            uow.delete(uow.find(2))
+            user = uow.find(3)
+            user.change_name(UserName(first_name="renamed", last_name="foo"))
+            uow.save(user)
+            uow.save(User(id=6, user_name=UserName(first_name="user0", last_name="mido")))
+            assert [user.id for user in uow.list(None, 3)] == [1, 3, 4]
+            assert [user.id for user in uow.list(4, 10)] == [5, 6]
+            assert [user.id for user in uow.search_by_name_prefix("mido user", 3)] == [6, 1, 4]
+            assert [user.id for user in uow.search_by_name_prefix("foo", 10)] == [3]
+        assert [user.id for user in repository.search_by_name_prefix("mido", 10)] == [6, 1, 4, 5]
+
+
+class UserListApplicationServiceTest:
+    """一覧・検索のユースケースのテストコード"""
+
+    def test_list_and_search(self):
+        """next_cursorでページをたどると全ユーザーを1回ずつ取得でき、最後のページのnext_cursorはNone"""
+        repository = UserRepository(os.path.join(tempfile.mkdtemp(), "store.json"))
+        repository.save_many([User(id=i, user_name=UserName(first_name=f"user{i}", last_name="mido")) for i in range(1, 11)])
+        app = UserListApplicationService(repository)
+        ids = []
+        page = app.list(limit=4)
+        ids += [user.id for user in page.users]
+        while page.next_cursor is not None:
+            page = app.list(page.next_cursor, limit=4)
+            ids += [user.id for user in page.users]
+        assert ids == list(range(1, 11))
+        assert app.list(limit=10).next_cursor is None
+        assert [user.id for user in app.search("mido user1", 5)] == [1, 10]
+        try:
+            app.list(limit=0)
+            assert False
+        except Exception as e:
+            assert "limit" in str(e)
+
+
+class AsyncUserApplicationServiceTest:
+    """非同期アプリケーションサービスのテストコード"""
+
+    def _store_path(self) -> str:
+        return os.path.join(tempfile.mkdtemp(), "store.json")
+
+    def test_use_cases(self):
+        """登録・取得・更新・削除が同期版と同じように動く"""
+        async def run():
+            repository = AsyncUserRepository(self._store_path())
+            app = AsyncUserApplicationService(repository, AsyncUserService(repository))
+            await app.register(1, "kta", "mido")
+            await app.register_many([(2, "foo", "bar"), (3, "hoge", "piyo")])
+            try:
+                await app.register(4, "foo", "bar")
+                raise AssertionError("重複しているのに登録できてしまった")
+            except AssertionError:
+                raise
+            except Exception as e:
+                assert "すでに存在しています" in str(e)
+            await app.update(1, "keita", "midorikawa")
+            await app.delete(3)
+            assert str((await app.get(1)).user_name) == "keita midorikawa"
+            assert await app.get(3) is None
+
+        asyncio.run(run())
+
+    def test_share_file_with_sync_repository(self):
+        """同期のリポジトリと同じファイルを読み書きできる"""
+        store_path = self._store_path()
+        UserRepository(store_path).save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+
+        async def run():
+            repository = AsyncUserRepository(store_path)
+            assert (await repository.find(1)) is not None
+            await repository.save(User(id=2, user_name=UserName(first_name="foo", last_name="bar")))
+
+        asyncio.run(run())
+        assert UserRepository(store_path).find(2) is not None
+
+    def test_version_conflict(self):
+        """読み込んだ後に別のリポジトリが書き込んでいたら、上書きせずにStoreVersionConflictを投げる"""
+        store_path = self._store_path()
+        UserRepository(store_path).save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+
+        async def run():
+            repository1 = AsyncUserRepository(store_path)
+            repository2 = AsyncUserRepository(store_path)
+            user1 = await repository1.find(1)
+            user2 = await repository2.find(1)
+            user2.change_name(UserName(first_name="foo", last_name="bar"))
+            await repository2.save(user2)
+            user1.change_name(UserName(first_name="keita", last_name="midorikawa"))
+            try:
+                await repository1.save(user1)
+                assert False
+            except StoreVersionConflict:
+                pass
+            # 読み直してから変更すれば書き込める
+            user1 = await repository1.find(1)
+            user1.change_name(UserName(first_name="keita", last_name="midorikawa"))
+            await repository1.save(user1)
+
+        asyncio.run(run())
+        assert UserRepository(store_path).find(1).user_name == UserName(first_name="keita", last_name="midorikawa")
+
+    def test_single_flight(self):
+        """同じidへの同時のgetは1回の読み込みを共有する"""
+        repository = UserRepository(self._store_path())
+        repository.save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+        finds = []
+        find = repository.find
+        repository.find = lambda id: finds.append(id) or find(id)
+
+        async def run():
+            adapter = AsyncUserRepositoryAdapter(repository)
+            app = AsyncUserApplicationService(adapter, AsyncUserService(adapter))
+            users = await asyncio.gather(*[app.get(1) for _ in range(20)])
+            assert all(user.id == 1 for user in users)
+            assert users[0] is not users[1]
+            await app.get(1)
+            adapter.close()
+
+        asyncio.run(run())
+        assert len(finds) == 2
+
+class InstrumentationTest:
+    """計測用のラッパーのテストコード"""
+
+    def _container(self, enabled: bool) -> Container:
+        container = Container()
+        container.config.from_dict({
+            "store_path": os.path.join(tempfile.mkdtemp(), "store.json"),
+            "instrumentation": {"enabled": enabled},
+        })
+        return container
+
+    def test_disabled(self):
+        """無効ならラップせずにそのまま返す"""
+        container = self._container(False)
+        assert isinstance(container.user_repository(), UserRepository)
+        assert isinstance(container.user_application(), UserApplicationService)
+
+    def test_record_metrics(self):
+        """ユースケースとリポジトリの呼び出し回数、ファイルの読み書きを記録する"""
+        container = self._container(True)
+        app = container.user_application()
+        app.register(1, "kta", "mido")
+        for _ in range(10):
+            app.get(1)
+        metrics = container.metrics()
+        assert metrics.histogram("call_duration_seconds", component="user_application", method="get").count == 10
+        assert metrics.histogram("call_duration_seconds", component="user_service", method="exists").count == 1
+        assert metrics.counter("store_written_bytes_total") > 0
+        text = metrics.to_prometheus()
+        assert 'ddd_call_duration_seconds_count{component="user_application",method="register"} 1' in text
+        assert "user_application.get n=10" in metrics.log_line()
+
+class ProductionContainerTest:
+    """本番用のコンテナのテストコード"""
+
+    def test_share_repository(self):
+        """サービスはすべて同じリポジトリを使い、初期化時にデータストアを読み込んでおく"""
+        store_path = os.path.join(tempfile.mkdtemp(), "store.json")
+        UserRepository(store_path).save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+        container = create_production_container({"store_path": store_path})
+        repository = container.user_repository()
+        assert repository._snapshot is not None
+        assert container.user_application().repository is repository
+        assert container.user_service().user_repository is repository
+        container.shutdown_resources()
+
+    def test_shutdown(self):
+        """既定のスコープは"process"で、shutdown_resourcesでリポジトリを閉じる"""
+        container = ProductionContainer()
+        container.config.from_dict({"store_path": os.path.join(tempfile.mkdtemp(), "store.json")})
+        assert container.config.repository_scope() == "process"
+        closed = []
+        repository = UserRepository(container.config.store_path())
+        repository.close = lambda: closed.append(True)
+        container.store_repository.override(repository)
+        container.init_resources()
+        container.user_application().register(1, "kta", "mido")
+        container.shutdown_resources()
+        assert closed == [True]
+
+    def test_shutdown_thread_scope(self):
+        """スレッドごとのリポジトリも、shutdown_resourcesですべて閉じる"""
+        store_path = os.path.join(tempfile.mkdtemp(), "store.json")
+        container = ProductionContainer()
+        container.config.from_dict({"store_path": store_path, "repository_scope": "thread"})
+        closed = []
+
+        def create_repository():
+            repository = UserRepository(store_path)
+            repository.close = lambda: closed.append(repository)
+            return repository
+
+        container.store_repository.override(providers.Factory(create_repository))
+        repositories = []
+
+        def get(thread: int):
+            app = container.user_application()
+            app.get(thread)
+            repositories.append(app.repository)
+
+        threads = [threading.Thread(target=get, args=(thread,)) for thread in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len({id(repository) for repository in repositories}) == 4
+        container.shutdown_resources()
+        assert sorted(map(id, closed)) == sorted(map(id, repositories))
+
+    def test_concurrent_register(self):
+        """プロセスで1つのリポジトリを複数のスレッドで共有しても、登録が競合せず、失敗した登録は保存されない"""
+        store_path = os.path.join(tempfile.mkdtemp(), "store.json")
+        container = create_production_container({"store_path": store_path})
+        registered = []
+        failures = []
+
+        def register(thread: int):
+            app = container.user_application()
+            for i in range(50):
+                # 同じ名前を複数のスレッドが登録しようとする
+                try:
+                    app.register(thread * 100 + i, f"name{i}", "user")
+                    registered.append(thread * 100 + i)
+                except Exception as e:
+                    failures.append((thread * 100 + i, str(e)))
+
+        threads = [threading.Thread(target=register, args=(thread,)) for thread in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        container.shutdown_resources()
+        assert all("すでに存在しています" in message for _, message in failures)
+        assert len(registered) == 50
+        stored = UserRepository(store_path).find_many(registered + [id for id, _ in failures])
+        assert sorted(user.id for user in stored) == sorted(registered)
+
+    def test_default_scope(self):
+        """Containerは既定で呼び出しごとにリポジトリを作る"""
+        container = Container()
+        container.config.from_dict({"store_path": os.path.join(tempfile.mkdtemp(), "store.json")})
+        assert container.user_repository() is not container.user_repository()
+
+class UserReadModelTest:
+    """リードモデルのテストコード"""
+
+    def test_follow_writes(self):
+        """ユースケースでの書き込みがリードモデルに反映される"""
+        repository = ProjectingUserRepository(UserRepository(os.path.join(tempfile.mkdtemp(), "store.json")))
+        app = UserApplicationService(repository, UserService(repository))
+        query = UserQueryService(repository.read_model)
+        app.register(1, "kta", "mido")
+        app.register_many([(2, "foo", "bar"), (3, "hoge", "piyo")])
+        app.update(1, "keita", "midorikawa")
+        app.delete(2)
+        assert query.get(1).user_name == "keita midorikawa"
+        assert query.get(2) is None
+        assert query.get_json(3) == '{"id": 3, "user_name": "hoge piyo"}'.encode()
+        # 同じオブジェクトを返す (コピーしない)
+        assert query.get(1) is query.get(1)
+
+    def test_failed_write_is_not_projected(self):
+        """書き込みに失敗したらリードモデルは変わらない"""
+        repository = ProjectingUserRepository(UserRepository(os.path.join(tempfile.mkdtemp(), "store.json")))
+        repository.save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+        try:
+            repository.save(User(id=2, user_name=UserName(first_name="kta", last_name="mido")))
+            assert False
+        except Exception:
+            pass
+        assert repository.read_model.get(2) is None
+
+    def test_rebuild(self):
+        """作成時に既存のデータストアからリードモデルを作る"""
+        store_path = os.path.join(tempfile.mkdtemp(), "store.json")
+        UserRepository(store_path).save_many([User(id=i, user_name=UserName(first_name=f"foo{i}", last_name="bar")) for i in range(10)])
+        repository = ProjectingUserRepository(UserRepository(store_path))
+        assert len(repository.read_model) == 10
+        assert repository.read_model.get(9).user_name == "foo9 bar"
+
+
+class UserBatchGetInteractorTest:
+    """まとめて取得するインタラクターのテストコード"""
+
+    def _repository(self, size: int) -> UserRepository:
+        repository = UserRepository(os.path.join(tempfile.mkdtemp(), "store.json"))
+        repository.save_many([User(id=i, user_name=UserName(first_name=f"foo{i}", last_name="bar")) for i in range(size)])
+        return repository
+
+    def test_ids_in_chunks(self):
+        """idsをchunk_size件ずつまとめて取得し、NDJSONで出力する"""
+        repository = self._repository(100)
+        calls = []
+        find_many = repository.find_many
+        repository.find_many = lambda ids: calls.append(len(ids)) or find_many(ids)
+        sink = io.BytesIO()
+        interactor = UserBatchGetInteractor(repository, NdjsonUserPresenter(sink), chunk_size=30)
+        interactor.handle(UserBatchGetInputData(ids=list(range(50, 120))))
+        lines = sink.getvalue().decode("utf-8").splitlines()
+        assert calls == [30, 30, 10]
+        assert [json.loads(line)["id"] for line in lines] == list(range(50, 100))
+        assert json.loads(lines[0]) == {"id": 50, "user_name": "foo50 bar"}
+
+    def test_stream_all_users(self):
+        """idsを省略すると全ユーザーを出力し、バッファの大きさごとに書き込む"""
+        repository = self._repository(1000)
+        presenter = NdjsonUserPresenter(io.BytesIO(), buffer_size=1024)
+        interactor = UserBatchGetInteractor(repository, presenter)
+        chunks = list(presenter.chunks(interactor._output_data(UserBatchGetInputData())))
+        assert all(len(chunk) < 1024 + 100 for chunk in chunks)
+        assert sum(chunk.count(b"\n") for chunk in chunks) == 1000
+
+
+class ImportBudgetTest:
+    """エントリーポイントのimportのテストコード"""
+
+    def test_lazy_modules(self):
+        """エントリーポイントをimportしただけでは、オプションのバックエンドや計測のモジュールを読み込まない"""
+        for module in BUDGETS_MS:
+            assert LAZY_MODULES.isdisjoint(import_times(module)), module
+
+
+if __name__ == "__main__":
+    test = UserApplicationServiceTest()
+
+    test.test_register_many()
+    test.test_register_many_duplicated_in_batch()
+    test.test_register_many_duplicated_in_store()
+    test.test_register_many_single_write()
+
+    test = UserUnitOfWorkTest()
+
+    test.test_commit_in_one_write()
+    test.test_identity_map()
+    test.test_pending_changes_are_visible()
+    test.test_rejected_update()
+    test.test_rollback()
+    test.test_list_with_pending_changes()
+
+    test = UserListApplicationServiceTest()
+
+    test.test_list_and_search()
+
+    test = AsyncUserApplicationServiceTest()
+
+    test.test_use_cases()
+    test.test_share_file_with_sync_repository()
+    test.test_version_conflict()
+    test.test_single_flight()
+
+    test = InstrumentationTest()
+
+    test.test_disabled()
+    test.test_record_metrics()
+
+    test = ProductionContainerTest()
+
+    test.test_share_repository()
+    test.test_shutdown()
+    test.test_shutdown_thread_scope()
+    test.test_concurrent_register()
+    test.test_default_scope()
+
+    test = UserReadModelTest()
+
+    test.test_follow_writes()
+    test.test_failed_write_is_not_projected()
+    test.test_rebuild()
+
+    test = UserBatchGetInteractorTest()
+
+    test.test_ids_in_chunks()
+    test.test_stream_all_users()
+
+    test = ImportBudgetTest()
+
+    test.test_lazy_modules()
@@ -0,0 +1,145 @@
+import abc
+import asyncio
+from typing import Optional, List, Tuple, Dict
+from value_object import UserName
+from entity import User
+from async_repository import IAsyncUserRepository, AsyncUserRepository
+
+class AsyncUserService:
+    """非同期リポジトリを使うドメインサービス (domein_service.UserServiceと同じルール)"""
+    def __init__(self, user_repository: IAsyncUserRepository):
+        self.user_repository = user_repository
+
+    async def exists(self, user: User) -> bool:
+        found = await self.user_repository.find_by_name(user.user_name)
+        return found is not None
+
+    async def duplicates(self, users: List[User]) -> List[User]:
+        found = await self.user_repository.find_many_by_name([user.user_name for user in users])
+        stored = {user.user_name for user in found}
+        seen = set()
+        duplicated = []
+        for user in users:
+            if user.user_name in seen or user.user_name in stored:
+                duplicated.append(user)
+            seen.add(user.user_name)
+        return duplicated
+
+class IAsyncUserApplicationService(metaclass=abc.ABCMeta):
+    """非同期アプリケーションサービスのインターフェース"""
+    @abc.abstractmethod
+    async def register(self, id: int, first_name: str, last_name: str):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def register_many(self, users: List[Tuple[int, str, str]]):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def get(self, id: int) -> Optional[User]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def update(self, id: int, first_name: Optional[str] = None, last_name: Optional[str] = None):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def delete(self, id: int):
+        raise NotImplementedError
+
+
+class AsyncUserApplicationService(IAsyncUserApplicationService):
+    """application.UserApplicationServiceの非同期版
+    同じidに対するgetが同時に呼ばれたときは、実行中の1回の読み込みを共有する (シングルフライト)
+    """
+    def __init__(self, repository: IAsyncUserRepository, service: AsyncUserService):
+        self.service = service
+        self.repository = repository
+        self._inflight: Dict[int, "asyncio.Future[Optional[User]]"] = {}
+
+    async def register(self, id: int, first_name: str, last_name: str):
+        user_name = UserName(first_name=first_name, last_name=last_name)
+        user = User(id=id, user_name=user_name)
+        if await self.service.exists(user):
+            raise Exception(f"{user.user_name} はすでに存在しています")
+        await self.repository.save(user)
+
+    async def register_many(self, users: List[Tuple[int, str, str]]):
+        new_users = [
+            User(id=id, user_name=UserName(first_name=first_name, last_name=last_name))
+            for id, first_name, last_name in users
+        ]
+        ids = set()
+        for user in new_users:
+            if user.id in ids:
+                raise Exception(f"id={user.id} が重複しています")
+            ids.add(user.id)
+        duplicated = await self.service.duplicates(new_users)
+        if len(duplicated) > 0:
+            raise Exception(f"{duplicated[0].user_name} はすでに存在しています")
+        await self.repository.save_many(new_users)
+
+    async def get(self, id: int) -> Optional[User]:
+        future = self._inflight.get(id)
+        if future is None:
+            future = asyncio.ensure_future(self.repository.find(id))
+            self._inflight[id] = future
+            future.add_done_callback(lambda done: self._forget(id, done))
+        # 1つの呼び出し元がキャンセルされても、他の呼び出し元の読み込みは続ける
+        user = await asyncio.shield(future)
+        # 呼び出し元ごとに別のオブジェクトを返し、同期版と同じく互いの変更が影響しないようにする
+        return user.copy() if user is not None else None
+
+    def _forget(self, id: int, future: "asyncio.Future[Optional[User]]"):
+        if self._inflight.get(id) is future:
+            del self._inflight[id]
+
+    async def update(self, id: int, first_name: Optional[str] = None, last_name: Optional[str] = None):
+        user = await self.repository.find(id)
+        if user is None:
+            raise Exception(f"ユーザーが見つかりません (id={id})")
+        if first_name is not None and last_name is not None:
+            user_name = UserName(first_name=first_name, last_name=last_name)
+            # 重複を確認してから変更する (application.UserApplicationService.updateと同じ)
+            if await self.service.exists(User(id=id, user_name=user_name)):
+                raise Exception(f"{user_name} はすでに存在しています")
+            user.change_name(user_name)
+        await self.repository.save(user)
+
+    async def delete(self, id: int):
+        user = await self.repository.find(id)
+        if user is None:
+            raise Exception(f"ユーザーが見つかりません (id={id})")
+        await self.repository.delete(user)
+
+
+
+if __name__ == "__main__":
+    async def main():
+        # リポジトリ
+        repository = AsyncUserRepository("store.json")
+
+        # ドメインサービス
+        service = AsyncUserService(repository)
+
+        # 初期化
+        await repository.clear()
+
+        # アプリケーション
+        app = AsyncUserApplicationService(repository, service)
+
+        # 追加
+        await app.register(1, "kta", "mido")
+        await app.register(2, "foo", "bar")
+
+        # 取得 (同時に呼ばれたgetは1回の読み込みを共有する)
+        users = await asyncio.gather(app.get(1), app.get(1), app.get(1))
+        print(users[0])  # id=1 user_name=UserName(first_name='kta', last_name='mido')
+
+        # 更新
+        await app.update(1, "keita", "midorikawa")
+
+        # 削除
+        await app.delete(2)
+
+    asyncio.run(main())
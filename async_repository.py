@@ -0,0 +1,271 @@
+import abc
+import asyncio
+import functools
+import itertools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, AsyncIterator
+from entity import User
+from value_object import UserName
+from repository import (
+    IUserRepository, UserStoreSchema, UserNameIndex, StoreStamp, StoreVersionConflict, read_stamp, store_lock, write_atomically
+)
+from codec import IStoreCodec, default_codec
+
+class IAsyncUserRepository(metaclass=abc.ABCMeta):
+    """非同期リポジトリのインターフェース
+    IUserRepositoryと同じ操作をコルーチンとして提供する
+    """
+    @abc.abstractmethod
+    async def save(self, user: User) -> User:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def delete(self, user: User):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def find_by_name(self, user_name: UserName) -> Optional[User]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def find(self, id: int) -> Optional[User]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def save_many(self, users: List[User]) -> List[User]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def delete_many(self, users: List[User]):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def find_many(self, ids: List[int]) -> List[User]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def find_many_by_name(self, user_names: List[UserName]) -> List[User]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def apply_changes(self, saved: List[User], deleted: List[User]):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def iter_users(self) -> AsyncIterator[User]:
+        raise NotImplementedError
+
+class AsyncUserRepositoryAdapter(IAsyncUserRepository):
+    """同期リポジトリを非同期リポジトリとして使うためのアダプター
+    同期リポジトリの呼び出しを上限付きのスレッドプールで実行し、イベントループをブロックしない。
+
+    スレッドセーフでないリポジトリは、呼び出しを1つずつ直列に実行する。
+    UserRepository・JournalUserRepository・SqliteUserRepositoryのようにスレッドセーフなものはthread_safe=Trueで並列に実行できる。
+    """
+    def __init__(self, repository: IUserRepository, max_workers: int = 4, thread_safe: bool = False):
+        self._repository = repository
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = None if thread_safe else threading.Lock()
+
+    def _call(self, func, *args):
+        if self._lock is None:
+            return func(*args)
+        with self._lock:
+            return func(*args)
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(self._call, func, *args))
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    async def save(self, user: User) -> User:
+        return await self._run(self._repository.save, user)
+
+    async def delete(self, user: User):
+        await self._run(self._repository.delete, user)
+
+    async def find_by_name(self, user_name: UserName) -> Optional[User]:
+        return await self._run(self._repository.find_by_name, user_name)
+
+    async def find(self, id: int) -> Optional[User]:
+        return await self._run(self._repository.find, id)
+
+    async def save_many(self, users: List[User]) -> List[User]:
+        return await self._run(self._repository.save_many, users)
+
+    async def delete_many(self, users: List[User]):
+        await self._run(self._repository.delete_many, users)
+
+    async def find_many(self, ids: List[int]) -> List[User]:
+        return await self._run(self._repository.find_many, ids)
+
+    async def find_many_by_name(self, user_names: List[UserName]) -> List[User]:
+        return await self._run(self._repository.find_many_by_name, user_names)
+
+    async def apply_changes(self, saved: List[User], deleted: List[User]):
+        await self._run(self._repository.apply_changes, saved, deleted)
+
+    async def iter_users(self, chunk_size: int = 1000) -> AsyncIterator[User]:
+        # 同期のイテレーターからchunk_size件ずつスレッドプールで取り出す
+        users = self._repository.iter_users()
+        while True:
+            chunk = await self._run(lambda: list(itertools.islice(users, chunk_size)))
+            if len(chunk) == 0:
+                return
+            for user in chunk:
+                yield user
+
+class AsyncUserRepository(IAsyncUserRepository):
+    """store.jsonを読み書きする非同期リポジトリ
+    UserRepositoryと同じ形式のファイルを扱い、パースしたユーザーをメモリ上に保持する。
+    標準ライブラリには非同期のファイルI/Oがないので、読み書きとパースだけをasyncio.to_threadで
+    別スレッドに逃がし、スナップショットの参照と更新はイベントループ上で行う。
+    読み込みと書き込みはasyncio.Lockで直列化するので、同時に呼ばれても読み込みは1回で済む。
+    プロセス間のロックとバージョンの確認はUserRepositoryと同じ手順で行う。
+    """
+    def __init__(self, store_path: str, codec: Optional[IStoreCodec] = None):
+        self._store_path = store_path
+        self._codec = codec or default_codec()
+        self._lock = asyncio.Lock()
+        self._users: Dict[int, User] = {}
+        self._names = UserNameIndex()
+        self._version = 1
+        self._stamp: Optional[StoreStamp] = None
+        self._loaded = False
+
+    def _read_stamp(self) -> Optional[StoreStamp]:
+        return read_stamp(self._store_path)
+
+    def _read(self) -> UserStoreSchema:
+        if os.path.exists(self._store_path):
+            return UserStoreSchema.parse_trusted_file(self._store_path, self._codec)
+        return UserStoreSchema(users=[])
+
+    def _write(self, schema: UserStoreSchema, base_stamp: Optional[StoreStamp]) -> Optional[StoreStamp]:
+        with store_lock(self._store_path):
+            if self._read_stamp() != base_stamp and self._read().id != schema.id - 1:
+                raise StoreVersionConflict(f"データストアが他のプロセスによって更新されました ({self._store_path})")
+            write_atomically(self._store_path, self._codec.encode(schema))
+            return self._read_stamp()
+
+    async def _current(self) -> Dict[int, User]:
+        """最新のユーザーを返す。ファイルが変更されていなければ読み込まない
+        self._lockを取得した状態で呼ぶこと
+        """
+        stamp = self._read_stamp()
+        if not self._loaded or stamp is None or stamp != self._stamp:
+            schema = await asyncio.to_thread(self._read)
+            self._users = {user.id: user for user in schema.users}
+            self._names = UserNameIndex(schema.users)
+            self._version = schema.id
+            self._stamp = stamp
+            self._loaded = True
+        return self._users
+
+    async def _writable(self) -> Dict[int, User]:
+        """変更を反映するユーザー。最後に読み込んだ状態を読み直さずに使う (UserRepository._writableと同じ)
+        その後に他のプロセスが書き込んでいれば、_commitがStoreVersionConflictを投げる。
+        self._lockを取得した状態で呼ぶこと
+        """
+        if self._loaded:
+            return self._users
+        return await self._current()
+
+    async def _commit(self):
+        """self._lockを取得した状態で呼ぶこと"""
+        # 検証済みのユーザーなので、バリデーションを省く (全件の検証でイベントループを止めないように)
+        schema = UserStoreSchema.construct(id=self._version + 1, users=list(self._users.values()))
+        try:
+            self._stamp = await asyncio.to_thread(self._write, schema, self._stamp)
+        except BaseException:
+            self._loaded = False
+            raise
+        self._version = schema.id
+
+    async def clear(self):
+        async with self._lock:
+            users = await self._current()
+            users.clear()
+            self._names.clear()
+            await self._commit()
+
+    async def save(self, user: User) -> User:
+        await self.apply_changes([user], [])
+        return user
+
+    async def delete(self, user: User):
+        await self.apply_changes([], [user])
+
+    async def find_by_name(self, user_name: UserName) -> Optional[User]:
+        found = await self.find_many_by_name([user_name])
+        return found[0] if len(found) > 0 else None
+
+    async def find(self, id: int) -> Optional[User]:
+        found = await self.find_many([id])
+        return found[0] if len(found) > 0 else None
+
+    async def save_many(self, users: List[User]) -> List[User]:
+        await self.apply_changes(users, [])
+        return users
+
+    async def delete_many(self, users: List[User]):
+        await self.apply_changes([], users)
+
+    async def find_many(self, ids: List[int]) -> List[User]:
+        async with self._lock:
+            users = await self._current()
+        found = [users.get(id) for id in ids]
+        return [user.copy() for user in found if user is not None]
+
+    async def find_many_by_name(self, user_names: List[UserName]) -> List[User]:
+        async with self._lock:
+            users = await self._current()
+            ids = [self._names.get(user_name) for user_name in set(user_names)]
+        found = [users.get(id) for id in ids if id is not None]
+        return [user.copy() for user in found if user is not None]
+
+    async def apply_changes(self, saved: List[User], deleted: List[User]):
+        async with self._lock:
+            users = await self._writable()
+            self._names.check(saved, deleted)
+            changed = False
+            for user in deleted:
+                removed = users.pop(user.id, None)
+                if removed is not None:
+                    self._names.remove(removed)
+                    changed = True
+            for user in saved:
+                self._names.put(user, users.pop(user.id, None))
+                users[user.id] = user.copy()
+                changed = True
+            if changed:
+                await self._commit()
+
+    async def iter_users(self) -> AsyncIterator[User]:
+        async with self._lock:
+            users = list((await self._current()).values())
+        for user in users:
+            yield user.copy()
+
+
+if __name__ == "__main__":
+    from repository import UserRepository
+
+    async def main():
+        # 同期リポジトリをスレッドプールで実行する
+        adapter = AsyncUserRepositoryAdapter(UserRepository("store.json"))
+        await adapter.save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+        print(await adapter.find(1))  # id=1 user_name=UserName(first_name='kta', last_name='mido')
+        adapter.close()
+
+        # 非同期のファイルリポジトリ
+        repository = AsyncUserRepository("store.json")
+        users = await asyncio.gather(*[repository.find(1) for _ in range(10)])
+        print(len(users))  # 10
+        await repository.delete(users[0])
+
+    asyncio.run(main())
@@ -0,0 +1,209 @@
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, List
+from entity import User
+from value_object import UserName
+from repository import UserRepository, UserStoreSchema
+from journal_repository import JournalUserRepository
+from store_reader import iter_users
+from binary_repository import BinaryUserRepository, json_to_binary
+from clean_architecture import UserData
+from read_model import ProjectingUserRepository, UserQueryService
+from user_transfer import import_users
+from codec import available_codecs
+
+
+def generate_store(store_path: str, size: int):
+    """size人のユーザーを持つデータストアを生成する (UserRepository._saveのCompactJsonCodecと同じ形式)"""
+    users = [
+        {"id": i, "user_name": {"first_name": f"first{i}", "last_name": f"last{i}"}}
+        for i in range(1, size + 1)
+    ]
+    with open(store_path, "w", encoding="utf-8") as writer:
+        json.dump({"id": 1, "users": users}, writer, ensure_ascii=False, separators=(",", ":"))
+
+
+def measure(func: Callable[[], object], repeat: int) -> float:
+    """funcをrepeat回実行したときの1回あたりの秒数"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def bench_snapshot(size: int, repeat: int = 20):
+    """findのたびにパースする場合と、スナップショットを使う場合を比較する"""
+    store_path = os.path.join(tempfile.mkdtemp(), "store.json")
+    generate_store(store_path, size)
+    repository = UserRepository(store_path)
+    target = size // 2
+
+    def find_with_parse():
+        # スナップショット導入前のfind: 毎回parse_fileでファイル全体をパース・検証して線形探索する
+        for user in UserStoreSchema.parse_file(store_path).users:
+            if user.id == target:
+                return user
+        return None
+
+    repository.find(target)  # スナップショットを温める
+    before = measure(find_with_parse, max(1, repeat // 10))
+    after = measure(lambda: repository.find(target), repeat * 100)
+    print(f"users={size:>7} find parse={before * 1000:10.3f}ms snapshot={after * 1000:8.4f}ms speedup={before / after:,.0f}x")
+
+
+def bench_journal_save(size: int, repeat: int = 20):
+    """store.jsonを書き直すsaveと、ジャーナルに追記するsaveを比較する"""
+    store_path = os.path.join(tempfile.mkdtemp(), "store.json")
+    generate_store(store_path, size)
+    repository = UserRepository(store_path)
+    journal = JournalUserRepository(tempfile.mkdtemp())
+    for user in repository._current().users.values():
+        journal.save(user)
+    user = User(id=size + 1, user_name=UserName(first_name="kta", last_name="mido"))
+
+    before = measure(lambda: repository.save(user), max(1, repeat // 10))
+    after = measure(lambda: journal.save(user), repeat * 10)
+    journal.close()
+    print(f"users={size:>7} save rewrite={before * 1000:10.3f}ms journal={after * 1000:8.4f}ms speedup={before / after:,.0f}x")
+
+
+def bench_stream(size: int):
+    """parse_fileで全件を読み込む場合と、ストリーミングで読む場合の最初の一致までの時間とピークメモリを比較する"""
+    store_path = os.path.join(tempfile.mkdtemp(), "store.json")
+    generate_store(store_path, size)
+    target = size // 10
+
+    def first_match_with_parse():
+        return next(user for user in UserStoreSchema.parse_file(store_path).users if user.id == target)
+
+    def first_match_with_stream():
+        return next(user for user in iter_users(store_path) if user.id == target)
+
+    def full_scan_with_stream():
+        return sum(1 for _ in iter_users(store_path))
+
+    for label, func in [("parse", first_match_with_parse), ("stream", first_match_with_stream), ("scan", full_scan_with_stream)]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"users={size:>7} {label:>6} time={elapsed * 1000:10.3f}ms peak={peak / 1024 / 1024:8.2f}MiB")
+
+def bench_binary(size: int):
+    """起動直後の1回目のfindにかかる時間とファイルサイズを、store.jsonとバイナリ形式で比較する"""
+    store_dir = tempfile.mkdtemp()
+    json_path = os.path.join(store_dir, "store.json")
+    binary_path = os.path.join(store_dir, "store.bin")
+    generate_store(json_path, size)
+    json_to_binary(json_path, binary_path)
+    target = size // 2
+
+    for label, path, repository in [
+        ("json", json_path, UserRepository(json_path)),
+        ("binary", binary_path, BinaryUserRepository(binary_path)),
+    ]:
+        start = time.perf_counter()
+        repository.find(target)
+        elapsed = time.perf_counter() - start
+        print(f"users={size:>7} {label:>6} cold find={elapsed * 1000:10.3f}ms size={os.path.getsize(path) / 1024 / 1024:8.2f}MiB")
+
+def bench_trusted_load(size: int):
+    """1件あたりのUserの生成コストを、バリデーションする場合と省く場合で比較する"""
+    records = [
+        {"id": i, "user_name": {"first_name": f"first{i}", "last_name": f"last{i}"}}
+        for i in range(1, size + 1)
+    ]
+    before = measure(lambda: [User.parse_obj(record) for record in records], 1)
+    after = measure(lambda: [User.from_trusted(record) for record in records], 1)
+    print(
+        f"users={size:>7} construct validate={before / size * 1e6:8.3f}us trusted={after / size * 1e6:8.3f}us "
+        f"speedup={before / after:,.1f}x"
+    )
+
+def bench_read_model(size: int, repeat: int = 10000):
+    """findしてUserDataに変換しJSONにする場合と、リードモデルのJSONを返す場合を比較する"""
+    store_path = os.path.join(tempfile.mkdtemp(), "store.json")
+    generate_store(store_path, size)
+    repository = ProjectingUserRepository(UserRepository(store_path))
+    query = UserQueryService(repository.read_model)
+    target = size // 2
+
+    def get_with_entity():
+        user = repository.find(target)
+        return UserData(id=user.id, user_name=str(user.user_name)).json().encode("utf-8")
+
+    before = measure(get_with_entity, repeat)
+    after = measure(lambda: query.get_json(target), repeat)
+    print(f"users={size:>7} get entity={before * 1e6:8.3f}us read_model={after * 1e6:8.3f}us speedup={before / after:,.0f}x")
+
+
+def bench_name_filter(size: int, repeat: int = 100):
+    """cache=Falseで存在しない名前を検索する場合に、名前のフィルターの有無を比較する (registerの重複確認を想定)"""
+    store_path = os.path.join(tempfile.mkdtemp(), "store.json")
+    generate_store(store_path, size)
+    names = [UserName(first_name=f"new{i}", last_name="user") for i in range(repeat)]
+    plain = UserRepository(store_path, cache=False)
+    filtered = UserRepository(store_path, cache=False, name_filter_expected_users=size)
+    filtered.find_by_name(names[0])
+    before = measure(lambda: [plain.find_by_name(name) for name in names[:10]], 1) / 10
+    after = measure(lambda: [filtered.find_by_name(name) for name in names], 1) / repeat
+    rate = filtered.name_filter_stats.false_positive_rate()
+    print(f"users={size:>7} find_by_name miss scan={before * 1e3:8.3f}ms filter={after * 1e6:8.3f}us false_positive_rate={rate:.3f}")
+
+
+def bench_import(size: int):
+    """NDJSONのインポートのスループットを、検証に使うプロセス数ごとに比較する"""
+    work_dir = tempfile.mkdtemp()
+    path = os.path.join(work_dir, "users.ndjson")
+    with open(path, "w", encoding="utf-8") as writer:
+        for i in range(1, size + 1):
+            writer.write(json.dumps({"id": i, "user_name": {"first_name": f"first{i}", "last_name": f"last{i}"}}) + "\n")
+    for workers in sorted({1, os.cpu_count() or 1}):
+        store_path = os.path.join(work_dir, f"store{workers}.json")
+        result = import_users(path, UserRepository(store_path), workers=workers)
+        print(f"users={size:>7} import workers={workers:>2} {result.records_per_second():12,.0f} records/s")
+
+
+def bench_list(size: int, repeat: int = 1000):
+    """1ページ (100件) の取得時間。インデックスを使うのでユーザー数にほぼ依存しない"""
+    store_path = os.path.join(tempfile.mkdtemp(), "store.json")
+    generate_store(store_path, size)
+    repository = UserRepository(store_path)
+    repository.list(None, 1)
+    page = measure(lambda: repository.list(size // 2, 100), repeat)
+    search = measure(lambda: repository.search_by_name_prefix("last5", 100), repeat)
+    print(f"users={size:>7} list page={page * 1e6:8.1f}us search_by_name_prefix={search * 1e6:8.1f}us")
+
+
+def bench_codecs(size: int, repeat: int = 5):
+    """コーデックごとのエンコード・デコードのスループットとファイルサイズ"""
+    store_path = os.path.join(tempfile.mkdtemp(), "store.json")
+    generate_store(store_path, size)
+    schema = UserRepository(store_path)._load()
+    for name, codec in available_codecs().items():
+        data = codec.encode(schema)
+        encode = measure(lambda: codec.encode(schema), repeat)
+        decode = measure(lambda: codec.decode(data), repeat)
+        print(f"users={size:>7} codec={name:>8} encode={size / encode:12,.0f} users/s "
+              f"decode={size / decode:12,.0f} users/s size={len(data) / 1024:9,.1f}KiB")
+
+
+if __name__ == "__main__":
+    sizes: List[int] = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000]
+    for size in sizes:
+        bench_snapshot(size)
+        bench_journal_save(size)
+        bench_stream(size)
+        bench_binary(size)
+        bench_trusted_load(size)
+        bench_read_model(size)
+        bench_name_filter(size)
+        bench_import(size)
+        bench_list(size)
+        bench_codecs(size)
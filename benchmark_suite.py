@@ -0,0 +1,174 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+from entity import User
+from repository import IUserRepository, UserRepository
+from journal_repository import JournalUserRepository
+from sqlite_repository import SqliteUserRepository
+from sharded_repository import ShardedUserRepository
+from binary_repository import BinaryUserRepository
+from domein_service import UserService
+from application import UserApplicationService
+from memory_repository import InMemoryUserRepository
+
+# バックエンドの名前と、作業ディレクトリからリポジトリを作る関数
+# 新しいリポジトリを追加したらここに登録すれば、同じ条件で比較できる
+BACKENDS: Dict[str, Callable[[str], IUserRepository]] = {
+    "json": lambda work_dir: UserRepository(os.path.join(work_dir, "store.json")),
+    "memory": lambda work_dir: InMemoryUserRepository(),
+    # store.jsonの前に置き、1秒ごとに変更を書き込む
+    "memory+json": lambda work_dir: InMemoryUserRepository(UserRepository(os.path.join(work_dir, "store.json")), flush_interval=1.0),
+    "journal": lambda work_dir: JournalUserRepository(os.path.join(work_dir, "store.journal")),
+    "sqlite": lambda work_dir: SqliteUserRepository(os.path.join(work_dir, "store.sqlite3")),
+    "sharded": lambda work_dir: ShardedUserRepository(os.path.join(work_dir, "store.shards")),
+    "binary": lambda work_dir: BinaryUserRepository(os.path.join(work_dir, "store.bin")),
+}
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+
+def synthetic_user(id: int) -> User:
+    return User.from_trusted({"id": id, "user_name": {"first_name": f"first{id}", "last_name": f"last{id}"}})
+
+
+def time_operation(func: Callable[[int], object], min_time: float, max_repeat: int) -> Dict[str, float]:
+    """func(i)をmin_time秒経つかmax_repeat回になるまで繰り返し、1回あたりの秒数を返す
+    iは0から始まる通し番号。毎回別のユーザーを操作するのに使う
+    """
+    samples: List[float] = []
+    start = time.perf_counter()
+    while len(samples) < max_repeat and (len(samples) == 0 or time.perf_counter() - start < min_time):
+        begin = time.perf_counter()
+        func(len(samples))
+        samples.append(time.perf_counter() - begin)
+    samples.sort()
+    return {
+        "repeat": len(samples),
+        "mean": sum(samples) / len(samples),
+        "median": samples[len(samples) // 2],
+        "min": samples[0],
+    }
+
+
+def run_backend(backend: str, size: int, min_time: float, max_repeat: int) -> List[dict]:
+    """size人のデータストアを作り、リポジトリとユースケースの各操作を計測する"""
+    work_dir = tempfile.mkdtemp()
+    repository = BACKENDS[backend](work_dir)
+    app = UserApplicationService(repository, UserService(repository))
+    results: List[dict] = []
+
+    def record(operation: str, func: Callable[[int], object], repeat: int = max_repeat) -> int:
+        """計測して結果を追加し、実行した回数を返す"""
+        result = {"backend": backend, "size": size, "operation": operation}
+        try:
+            result.update(time_operation(func, min_time, max(1, repeat)))
+        except Exception as e:
+            # 対応していない操作や失敗した操作は、エラーとして記録して続ける
+            result["error"] = str(e)
+        results.append(result)
+        return result.get("repeat", 0)
+
+    try:
+        start = time.perf_counter()
+        repository.save_many([synthetic_user(id) for id in range(1, size + 1)])
+        results.append({"backend": backend, "size": size, "operation": "populate", "repeat": 1,
+                        "mean": time.perf_counter() - start})
+
+        # 既存のユーザーを満遍なく参照する
+        step = max(1, size // max_repeat)
+        record("find", lambda i: repository.find(1 + i * step % size))
+        record("find_by_name", lambda i: repository.find_by_name(synthetic_user(1 + i * step % size).user_name))
+        # 計測中に追加したユーザーは次の計測で削除する
+        new_id = size + 1
+        saved = record("save", lambda i: repository.save(synthetic_user(new_id + i)))
+        record("delete", lambda i: repository.delete(synthetic_user(new_id + i)), saved)
+
+        # ユースケース
+        app_id = size + max_repeat + 1
+        registered = record("register", lambda i: app.register(app_id + i, f"first{app_id + i}", f"last{app_id + i}"))
+        record("get", lambda i: app.get(1 + i * step % size))
+        record("update", lambda i: app.update(app_id + i, f"renamed{app_id + i}", f"last{app_id + i}"), registered)
+        record("unregister", lambda i: app.delete(app_id + i), registered)
+    finally:
+        close = getattr(repository, "close", None)
+        if close is not None:
+            close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def run(backends: List[str], sizes: List[int], min_time: float = 0.5, max_repeat: int = 1000) -> dict:
+    report = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "min_time": min_time,
+            "max_repeat": max_repeat,
+        },
+        "results": [],
+    }
+    for size in sizes:
+        for backend in backends:
+            print(f"running backend={backend} size={size}", file=sys.stderr)
+            report["results"].extend(run_backend(backend, size, min_time, max_repeat))
+    return report
+
+
+def compare(base: dict, current: dict, threshold: float) -> List[str]:
+    """2回の結果を比較し、meanがthreshold倍を超えて遅くなった操作を返す"""
+    base_results = {(r["backend"], r["size"], r["operation"]): r for r in base["results"] if "mean" in r}
+    regressions: List[str] = []
+    for result in current["results"]:
+        key = (result["backend"], result["size"], result["operation"])
+        if key not in base_results or "mean" not in result:
+            continue
+        ratio = result["mean"] / base_results[key]["mean"]
+        line = f"{key[0]:>8} {key[1]:>8} {key[2]:>12} {base_results[key]['mean'] * 1000:12.4f}ms -> {result['mean'] * 1000:12.4f}ms ({ratio:5.2f}x)"
+        print(line)
+        if ratio > threshold:
+            regressions.append(line)
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="リポジトリとユースケースのベンチマーク")
+    parser.add_argument("--backends", nargs="+", choices=sorted(BACKENDS), default=sorted(BACKENDS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES)
+    parser.add_argument("--min-time", type=float, default=0.5, help="1つの操作を計測する最短の秒数")
+    parser.add_argument("--max-repeat", type=int, default=1000, help="1つの操作を計測する最大の回数")
+    parser.add_argument("--output", help="結果のJSONの出力先 (省略時は標準出力)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "CURRENT"), help="2つの結果のJSONを比較する")
+    parser.add_argument("--threshold", type=float, default=1.2, help="この倍率を超えて遅くなったら失敗にする")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as reader:
+            base = json.load(reader)
+        with open(args.compare[1]) as reader:
+            current = json.load(reader)
+        regressions = compare(base, current, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if len(regressions) > 0 else 0
+
+    report = run(args.backends, args.sizes, args.min_time, args.max_repeat)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as writer:
+            writer.write(output)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    # python benchmark_suite.py --sizes 1000 10000 --output before.json
+    # python benchmark_suite.py --compare before.json after.json
+    sys.exit(main())
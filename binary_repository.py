@@ -0,0 +1,305 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+from typing import Optional, List, Dict, Iterator, Iterable, Tuple
+from entity import User
+from value_object import UserName
+from repository import IUserRepository, UserNameIndex, UserOrderIndex, StoreStamp, read_stamp, store_lock
+from store_reader import iter_user_records
+
+# ファイルの構成
+# - ヘッダー: マジックナンバー, 形式のバージョン, 予約, データストアのバージョン, 件数, インデックスの位置
+# - レコード: id, first_nameのバイト数, last_nameのバイト数, first_name, last_name (UTF-8) を件数分
+# - インデックス: (id, レコードの位置) をidの昇順に件数分。二分探索で1件のレコードの位置を求める
+MAGIC = b"USRB"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHHQQQ")
+RECORD = struct.Struct("<qHH")
+INDEX_ENTRY = struct.Struct("<qQ")
+
+# (id, first_name, last_name)
+UserRecord = Tuple[int, str, str]
+
+def write_binary_store(path: str, records: Iterable[UserRecord], version: int = 1):
+    """レコードをバイナリ形式で書き出す。同じidが複数あれば後のものを使う"""
+    offsets: Dict[int, int] = {}
+    with open(path, "wb") as writer:
+        writer.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, version, 0, 0))
+        offset = HEADER.size
+        for id, first_name, last_name in records:
+            first = first_name.encode("utf-8")
+            last = last_name.encode("utf-8")
+            writer.write(RECORD.pack(id, len(first), len(last)))
+            writer.write(first)
+            writer.write(last)
+            offsets[id] = offset
+            offset += RECORD.size + len(first) + len(last)
+        index_offset = offset
+        for id in sorted(offsets):
+            writer.write(INDEX_ENTRY.pack(id, offsets[id]))
+        writer.seek(0)
+        writer.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, version, len(offsets), index_offset))
+        writer.flush()
+        os.fsync(writer.fileno())
+
+class BinaryStoreFile:
+    """バイナリ形式のデータストアをmmapで開いたもの
+    findはインデックスを二分探索して1件のレコードだけを読むので、ファイル全体をページキャッシュに載せずに済む
+    """
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, format_version, _, self.version, self.count, self._index_offset = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            self.close()
+            raise Exception(f"バイナリ形式のデータストアではありません ({path})")
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def _entry(self, i: int) -> Tuple[int, int]:
+        return INDEX_ENTRY.unpack_from(self._map, self._index_offset + i * INDEX_ENTRY.size)
+
+    def _read(self, offset: int) -> UserRecord:
+        id, first_size, last_size = RECORD.unpack_from(self._map, offset)
+        start = offset + RECORD.size
+        first_name = self._map[start:start + first_size].decode("utf-8")
+        last_name = self._map[start + first_size:start + first_size + last_size].decode("utf-8")
+        return (id, first_name, last_name)
+
+    def find(self, id: int) -> Optional[UserRecord]:
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            entry_id, offset = self._entry(middle)
+            if entry_id == id:
+                return self._read(offset)
+            if entry_id < id:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def page(self, cursor: Optional[int], limit: int) -> List[UserRecord]:
+        """idがcursorより大きいレコードを、idの昇順にlimit件返す。インデックスを二分探索して開始位置を求める"""
+        low, high = 0, self.count
+        if cursor is not None:
+            while low < high:
+                middle = (low + high) // 2
+                if self._entry(middle)[0] <= cursor:
+                    low = middle + 1
+                else:
+                    high = middle
+        return [self._read(self._entry(i)[1]) for i in range(low, min(low + limit, self.count))]
+
+    def __iter__(self) -> Iterator[UserRecord]:
+        """idの昇順に全レコードを返す"""
+        for i in range(self.count):
+            yield self._read(self._entry(i)[1])
+
+def to_user(record: UserRecord) -> User:
+    id, first_name, last_name = record
+    return User.construct(id=id, user_name=UserName.from_trusted(first_name, last_name))
+
+def to_record(user: User) -> UserRecord:
+    return (user.id, user.user_name.first_name, user.user_name.last_name)
+
+def json_to_binary(json_path: str, binary_path: str):
+    """store.json (UserStoreSchema) をバイナリ形式に変換する。1件ずつ読むのでメモリはほぼ一定"""
+    records = (
+        (record["id"], record["user_name"]["first_name"], record["user_name"]["last_name"])
+        for record in iter_user_records(json_path)
+    )
+    write_binary_store(binary_path, records)
+
+def binary_to_json(binary_path: str, json_path: str):
+    """バイナリ形式をstore.json (UserStoreSchema) の形式に変換する"""
+    store = BinaryStoreFile(binary_path)
+    try:
+        with open(json_path, "w", encoding="utf-8") as writer:
+            writer.write(f'{{"id": {store.version}, "users": [')
+            for i, (id, first_name, last_name) in enumerate(store):
+                record = {"id": id, "user_name": {"first_name": first_name, "last_name": last_name}}
+                writer.write((", " if i > 0 else "") + json.dumps(record, ensure_ascii=False))
+            writer.write("]}")
+    finally:
+        store.close()
+
+class BinaryUserRepository(IUserRepository):
+    """バイナリ形式のデータストアを使うリポジトリ
+    ファイルをmmapで開き、findはインデックスの二分探索で1件のレコードだけを読む。
+    起動直後でもファイル全体を読み込まないので、最初の検索から速い。
+
+    書き込みはロックを取ってから最新のファイルを読み直し、変更を反映したファイルを一時ファイルに書いて
+    リネームで置き換える。読み込み側はファイルが置き換わったら開き直す。
+    """
+    def __init__(self, store_path: str):
+        self._store_path = store_path
+        self._store: Optional[BinaryStoreFile] = None
+        self._stamp: Optional[StoreStamp] = None
+        self._names: Optional[UserNameIndex] = None
+        self._order: Optional[UserOrderIndex] = None
+
+    def _open(self) -> Optional[BinaryStoreFile]:
+        """最新のファイルを開いたものを返す。ファイルがなければNone"""
+        stamp = read_stamp(self._store_path)
+        if stamp != self._stamp or self._store is None:
+            if self._store is not None:
+                self._store.close()
+                self._store = None
+            if stamp is not None:
+                self._store = BinaryStoreFile(self._store_path)
+            self._stamp = stamp
+            self._names = None
+            self._order = None
+        return self._store
+
+    def _name_index(self, store: BinaryStoreFile) -> UserNameIndex:
+        """開いているファイルの名前のインデックス。ファイルごとに最初に名前で検索したときに作る"""
+        if self._names is None:
+            self._names = UserNameIndex(to_user(record) for record in store)
+        return self._names
+
+    def _order_index(self, store: BinaryStoreFile) -> UserOrderIndex:
+        """開いているファイルの名前の並び順のインデックス。ファイルごとに最初に前方一致で検索したときに作る
+        idの順のページはファイルのインデックスを使う
+        """
+        if self._order is None:
+            self._order = UserOrderIndex(to_user(record) for record in store)
+        return self._order
+
+    def _rewrite(self, saved: List[User], deleted: List[User], clear: bool = False):
+        with store_lock(self._store_path):
+            store = self._open()
+            records: Dict[int, UserRecord] = {}
+            version = 1
+            # データストアがないときやclearするときも、saved同士の名前の重複は確認する
+            names = UserNameIndex()
+            if store is not None:
+                if not clear:
+                    records = {record[0]: record for record in store}
+                    names = self._name_index(store)
+                version = store.version + 1
+            names.check(saved, deleted)
+            for user in deleted:
+                records.pop(user.id, None)
+            for user in saved:
+                records[user.id] = to_record(user)
+            directory = os.path.dirname(os.path.abspath(self._store_path))
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(self._store_path) + ".", suffix=".tmp")
+            os.close(fd)
+            try:
+                write_binary_store(temp_path, records.values(), version)
+                os.replace(temp_path, self._store_path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+
+    def close(self):
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+
+    def warm_up(self):
+        """ファイルを開いて名前のインデックスを作っておく"""
+        store = self._open()
+        if store is not None:
+            self._name_index(store)
+
+    def clear(self):
+        self._rewrite([], [], clear=True)
+
+    def save(self, user: User) -> User:
+        self._rewrite([user], [])
+        return user
+
+    def delete(self, user: User):
+        self._rewrite([], [user])
+
+    def find_by_name(self, user_name: UserName) -> Optional[User]:
+        found = self.find_many_by_name([user_name])
+        return found[0] if len(found) > 0 else None
+
+    def find(self, id: int) -> Optional[User]:
+        store = self._open()
+        record = store.find(id) if store is not None else None
+        return to_user(record) if record is not None else None
+
+    def save_many(self, users: List[User]) -> List[User]:
+        self._rewrite(users, [])
+        return users
+
+    def delete_many(self, users: List[User]):
+        self._rewrite([], users)
+
+    def find_many(self, ids: List[int]) -> List[User]:
+        store = self._open()
+        if store is None:
+            return []
+        records = [store.find(id) for id in ids]
+        return [to_user(record) for record in records if record is not None]
+
+    def find_many_by_name(self, user_names: List[UserName]) -> List[User]:
+        store = self._open()
+        if store is None:
+            return []
+        names = self._name_index(store)
+        ids = [names.get(user_name) for user_name in set(user_names)]
+        records = [store.find(id) for id in ids if id is not None]
+        return [to_user(record) for record in records if record is not None]
+
+    def apply_changes(self, saved: List[User], deleted: List[User]):
+        self._rewrite(saved, deleted)
+
+    def iter_users(self) -> Iterator[User]:
+        if read_stamp(self._store_path) is None:
+            return
+        # 走査中に書き込みでファイルが置き換わっても読み続けられるように、別にmmapで開く
+        store = BinaryStoreFile(self._store_path)
+        try:
+            for record in store:
+                yield to_user(record)
+        finally:
+            store.close()
+
+    def list(self, cursor: Optional[int] = None, limit: int = 100) -> List[User]:
+        store = self._open()
+        if store is None:
+            return []
+        return [to_user(record) for record in store.page(cursor, limit)]
+
+    def search_by_name_prefix(self, prefix: str, limit: int = 100) -> List[User]:
+        store = self._open()
+        if store is None:
+            return []
+        records = [store.find(id) for id in self._order_index(store).search(prefix, limit)]
+        return [to_user(record) for record in records if record is not None]
+
+
+if __name__ == "__main__":
+    # store.jsonをバイナリ形式に変換する
+    # python binary_repository.py store.json store.bin
+    import sys
+    if len(sys.argv) == 3:
+        if sys.argv[1].endswith(".json"):
+            json_to_binary(sys.argv[1], sys.argv[2])
+        else:
+            binary_to_json(sys.argv[1], sys.argv[2])
+        sys.exit(0)
+
+    # リポジトリ
+    repository = BinaryUserRepository("store.bin")
+
+    # 初期化
+    repository.clear()
+
+    # ユーザー追加処理
+    repository.save_many([User(id=i, user_name=UserName(first_name=f"foo{i}", last_name="bar")) for i in range(100)])
+
+    # インデックスを二分探索して1件だけ読む
+    print(repository.find(42))  # id=42 user_name=UserName(first_name='foo42', last_name='bar')
+    repository.close()
@@ -1,5 +1,8 @@
-from typing import List
-from pydantic import BaseModel
+import abc
+import json
+from typing import ClassVar, Optional, List, Dict, Set, Iterable
+from pydantic import BaseModel, PrivateAttr
+from repository import StoreStamp, StoreVersionConflict, read_stamp, store_lock, write_atomically
 
 class User(BaseModel):
     id: int
@@ -10,20 +13,234 @@ class User(BaseModel):
 
 
 class Circle(BaseModel):
+    MAX_MEMBERS: ClassVar[int] = 30
+
     id: int = 0
     members: List[User] = []
+    # メンバーのidの集合。参加済みかどうかの確認と人数の確認に使う (membersと同時に更新する)
+    _member_ids: Set[int] = PrivateAttr(default_factory=set)
+
+    def __init__(self, **data):
+        super().__init__(**data)
+        self._member_ids = {member.id for member in self.members}
+
+    @classmethod
+    def from_trusted(cls, record: dict) -> "Circle":
+        """データストアに保存した形式の辞書からバリデーションを省いて作る"""
+        circle = cls.construct(id=record["id"], members=[User.construct(**member) for member in record["members"]])
+        circle._member_ids = {member.id for member in circle.members}
+        return circle
 
     def is_full(self) -> bool:
-        return len(self.members) >= 30
+        return len(self._member_ids) >= self.MAX_MEMBERS
+
+    def is_member(self, user_id: int) -> bool:
+        return user_id in self._member_ids
+
+    def member_ids(self) -> Set[int]:
+        return set(self._member_ids)
 
-    def join(self, user: User):
+    def join(self, user: User, greet: bool = False):
         # ルール2. 引数で渡されたオブジェクトのメソッドへのアクセス
-        print(user.greet())
+        if greet:
+            print(user.greet())
         # ルール1. Circle自身のメソッドへのアクセス
+        if self.is_member(user.id):
+            raise Exception(f"すでにサークルのメンバーです (user_id={user.id})")
         if self.is_full():
-            raise Exception()
+            raise Exception(f"サークルの定員に達しています (circle_id={self.id})")
         # ルール4. Circleのインスタンス変数のメソッドへのアクセス
         self.members.append(user)
+        self._member_ids.add(user.id)
+
+    def join_many(self, users: List[User]):
+        """まとめて参加する。定員と重複は最初にまとめて確認し、1人でも参加できなければ誰も参加しない"""
+        new_ids = {user.id for user in users}
+        if len(new_ids) != len(users) or not new_ids.isdisjoint(self._member_ids):
+            raise Exception(f"すでにサークルのメンバーのユーザーが含まれています (circle_id={self.id})")
+        if len(self._member_ids) + len(new_ids) > self.MAX_MEMBERS:
+            raise Exception(f"サークルの定員に達しています (circle_id={self.id})")
+        self.members.extend(users)
+        self._member_ids |= new_ids
+
+    def leave(self, user: User):
+        if not self.is_member(user.id):
+            return
+        self.members = [member for member in self.members if member.id != user.id]
+        self._member_ids.discard(user.id)
+
+
+class CircleStoreSchema(BaseModel):
+    """サークルのデータストアの構造定義。idはデータストアのバージョン"""
+    id: int = 1
+    circles: List[Circle]
+
+
+class ICircleRepository(metaclass=abc.ABCMeta):
+    """サークルのリポジトリのインターフェース"""
+    @abc.abstractmethod
+    def save(self, circle: Circle) -> Circle:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def save_many(self, circles: List[Circle]) -> List[Circle]:
+        """まとめて保存する。1回の書き込みで永続化する"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete(self, circle: Circle):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def find(self, id: int) -> Optional[Circle]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def find_by_member(self, user_id: int) -> List[Circle]:
+        """ユーザーが参加しているサークルを返す"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def is_member(self, circle_id: int, user_id: int) -> bool:
+        raise NotImplementedError
+
+
+class CircleRepository(ICircleRepository):
+    """サークルをファイルに保存するリポジトリ
+    読み込んだサークルをidの辞書と、ユーザーのidから参加しているサークルのidを引く逆引きのインデックスで保持する。
+    find_by_memberとis_memberは全サークルを走査せずに、辞書の参照だけで済む。
+    逆引きのインデックスは保存・削除のたびに、変わったメンバーの分だけ更新する。
+    ロック・アトミックな書き込み・バージョンの確認はUserRepositoryと同じ手順で行う。
+    """
+    def __init__(self, store_path: str):
+        self._store_path = store_path
+        self._stamp: Optional[StoreStamp] = None
+        self._version = 1
+        self._circles: Dict[int, Circle] = {}
+        self._circles_by_user: Dict[int, Set[int]] = {}
+        self._loaded = False
+
+    def _load(self):
+        """ファイルが変更されていれば読み直して、インデックスを作り直す"""
+        stamp = read_stamp(self._store_path)
+        if stamp is not None and stamp == self._stamp:
+            return
+        self._circles = {}
+        self._circles_by_user = {}
+        self._version = 1
+        if stamp is not None:
+            with open(self._store_path, encoding="utf-8") as reader:
+                data = json.load(reader)
+            self._version = data["id"]
+            for record in data["circles"]:
+                self._index(Circle.from_trusted(record))
+        self._stamp = stamp
+        self._loaded = True
+
+    def _writable(self):
+        """変更を反映する前に呼ぶ。最後に読み込んだ状態を読み直さずに使う (UserRepository._writableと同じ)
+        その後に他のプロセスが書き込んでいれば、_commitがStoreVersionConflictを投げる
+        """
+        if not self._loaded:
+            self._load()
+
+    def _stored_version(self) -> int:
+        if read_stamp(self._store_path) is None:
+            return 1
+        with open(self._store_path, encoding="utf-8") as reader:
+            return json.load(reader)["id"]
+
+    def _index(self, circle: Circle):
+        previous = self._circles.get(circle.id)
+        old_ids = previous.member_ids() if previous is not None else set()
+        new_ids = circle.member_ids()
+        for user_id in old_ids - new_ids:
+            circles = self._circles_by_user.get(user_id)
+            if circles is not None:
+                circles.discard(circle.id)
+                if len(circles) == 0:
+                    del self._circles_by_user[user_id]
+        for user_id in new_ids - old_ids:
+            self._circles_by_user.setdefault(user_id, set()).add(circle.id)
+        self._circles[circle.id] = circle
+
+    def _unindex(self, circle_id: int):
+        previous = self._circles.pop(circle_id, None)
+        if previous is None:
+            return
+        for user_id in previous.member_ids():
+            circles = self._circles_by_user.get(user_id)
+            if circles is not None:
+                circles.discard(circle_id)
+                if len(circles) == 0:
+                    del self._circles_by_user[user_id]
+
+    def _commit(self):
+        try:
+            with store_lock(self._store_path):
+                # スタンプが変わっていなければバージョンも変わっていないので、パースせずに済む
+                if read_stamp(self._store_path) != self._stamp and self._stored_version() != self._version:
+                    raise StoreVersionConflict(f"データストアが他のプロセスによって更新されました ({self._store_path})")
+                schema = CircleStoreSchema.construct(id=self._version + 1, circles=list(self._circles.values()))
+                write_atomically(self._store_path, schema.json(ensure_ascii=False))
+                self._stamp = read_stamp(self._store_path)
+                self._version = schema.id
+        except BaseException:
+            # 失敗したらメモリ上の変更を捨てて、次回ファイルから読み直す
+            self._stamp = None
+            self._loaded = False
+            raise
+
+    def clear(self):
+        self._load()
+        self._circles = {}
+        self._circles_by_user = {}
+        self._commit()
+
+    def save(self, circle: Circle) -> Circle:
+        self.save_many([circle])
+        return circle
+
+    def save_many(self, circles: List[Circle]) -> List[Circle]:
+        self._writable()
+        for circle in circles:
+            # 呼び出し元が渡したオブジェクトを変更してもインデックスが壊れないようにコピーを保持する
+            self._index(self._copy(circle))
+        self._commit()
+        return circles
+
+    def delete(self, circle: Circle):
+        self._writable()
+        if circle.id in self._circles:
+            self._unindex(circle.id)
+            self._commit()
+
+    def find(self, id: int) -> Optional[Circle]:
+        self._load()
+        circle = self._circles.get(id)
+        return self._copy(circle) if circle is not None else None
+
+    def find_by_member(self, user_id: int) -> List[Circle]:
+        self._load()
+        return [self._copy(self._circles[id]) for id in sorted(self._circles_by_user.get(user_id, ()))]
+
+    def is_member(self, circle_id: int, user_id: int) -> bool:
+        self._load()
+        return circle_id in self._circles_by_user.get(user_id, ())
+
+    def _copy(self, circle: Circle) -> Circle:
+        copied = Circle.construct(id=circle.id, members=list(circle.members))
+        copied._member_ids = circle.member_ids()
+        return copied
+
+
+def join_many(repository: ICircleRepository, circle_id: int, users: Iterable[User]) -> Circle:
+    """サークルに複数のユーザーをまとめて参加させ、1回の書き込みで保存する"""
+    circle = repository.find(circle_id)
+    if circle is None:
+        raise Exception(f"サークルが見つかりません (id={circle_id})")
+    circle.join_many(list(users))
+    return repository.save(circle)
 
 
 def main():
@@ -31,7 +248,17 @@ def main():
     user1 = User(id=1, user_name="foo")
     # ルール3. 直接インスタンス化されたオブジェクトのメソッドへのアクセス
     # NOTE: circle.member.append(user1) のように内部のオブジェクトを直接操作するのはNG
-    circle.join(user1)
+    circle.join(user1, greet=True)
+
+    # リポジトリ
+    repository = CircleRepository("circles.json")
+    repository.clear()
+    repository.save(circle)
+    join_many(repository, circle.id, [User(id=i, user_name=f"user{i}") for i in range(2, 10)])
+
+    # ユーザーが参加しているサークルは逆引きのインデックスで引く
+    print([circle.id for circle in repository.find_by_member(5)])  # [0]
+    print(repository.is_member(0, 42))  # False
 
 
 if __name__ == "__main__":
@@ -1,4 +1,8 @@
 import abc
+import io
+import itertools
+import json
+from typing import Optional, List, Iterator, BinaryIO
 from pydantic import BaseModel
 from repository import UserRepository, IUserRepository
 
@@ -6,6 +10,10 @@ class UserData(BaseModel):
     id: int
     user_name: str
 
+    class Config:
+        # DTOは参照専用なのでイミュータブルにする (リードモデルのUserDataをコピーせずに共有できる)
+        allow_mutation = False
+
 class UserUpdateOutputData(BaseModel):
     """出力データ"""
     user_data: UserData
@@ -14,6 +22,10 @@ class UserGetInputData(BaseModel):
     """入力データ"""
     id: int
 
+class UserBatchGetInputData(BaseModel):
+    """まとめて取得するときの入力データ。idsがNoneなら全ユーザー"""
+    ids: Optional[List[int]] = None
+
 
 #
 # [Use Case Output Port]
@@ -30,6 +42,45 @@ class UserGetPresenter(IUserGetOutputPort):
     def output(self, output_data: UserUpdateOutputData):
         print(output_data)
 
+class IUserBatchGetOutputPort(metaclass=abc.ABCMeta):
+    @abc.abstractmethod
+    def output(self, output_data: Iterator[UserUpdateOutputData]):
+        """output_dataは1件ずつ取り出すイテレーター。取り出した分だけユーザーを読み込む"""
+        raise NotImplementedError
+
+#
+# [Presenter]
+#
+class NdjsonUserPresenter(IUserBatchGetOutputPort):
+    """出力データを1行1件のJSON (NDJSON) でsinkに書き込むプレゼンター
+    buffer_sizeバイトたまるごとにsinkに書き込む。sinkへの書き込みがブロックしている間は次の出力データを取り出さないので、
+    読み込みは書き込みの速さに合わせて進み (バックプレッシャー)、メモリにはバッファ1つ分しか保持しない。
+    """
+    def __init__(self, sink: BinaryIO, buffer_size: int = 64 * 1024):
+        self.sink = sink
+        self.buffer_size = buffer_size
+
+    def chunks(self, output_data: Iterator[UserUpdateOutputData]) -> Iterator[bytes]:
+        """NDJSONをbuffer_sizeバイト前後のかたまりで返すジェネレーター
+        WSGIのレスポンスのように、呼び出し側が取り出すペースで書き出したい場合はこちらを使う
+        """
+        buffer = io.BytesIO()
+        for data in output_data:
+            user_data = data.user_data
+            line = json.dumps({"id": user_data.id, "user_name": user_data.user_name}, ensure_ascii=False)
+            buffer.write(line.encode("utf-8"))
+            buffer.write(b"\n")
+            if buffer.tell() >= self.buffer_size:
+                yield buffer.getvalue()
+                buffer = io.BytesIO()
+        if buffer.tell() > 0:
+            yield buffer.getvalue()
+
+    def output(self, output_data: Iterator[UserUpdateOutputData]):
+        for chunk in self.chunks(output_data):
+            self.sink.write(chunk)
+        self.sink.flush()
+
 #
 # [Use Case Input Port]
 #
@@ -38,6 +89,11 @@ class IUserGetInputPort(metaclass=abc.ABCMeta):
     def handle(self, input_data: UserGetInputData):
         raise NotImplementedError
 
+class IUserBatchGetInputPort(metaclass=abc.ABCMeta):
+    @abc.abstractmethod
+    def handle(self, input_data: UserBatchGetInputData):
+        raise NotImplementedError
+
 #
 # [Use Case Interactor]
 #
@@ -57,6 +113,38 @@ class UserGetInteractor(IUserGetInputPort):
         output_data = UserUpdateOutputData(user_data=user_data)
         self.presenter.output(output_data)
 
+class UserBatchGetInteractor(IUserBatchGetInputPort):
+    """複数のユーザーを取得して、出力データを1件ずつプレゼンターに流すインタラクター
+    - idsを指定したら、chunk_size件ずつfind_manyで取得する (1件ずつfindしない)
+    - idsがNoneなら、iter_usersで全ユーザーを1回だけ走査する
+    どちらもプレゼンターが取り出した分だけ読み込むので、全ユーザーをメモリに載せない。
+    見つからないidは出力しない。
+    """
+    def __init__(self, repository: IUserRepository, presenter: IUserBatchGetOutputPort, chunk_size: int = 1000):
+        self.repository = repository
+        self.presenter = presenter
+        self.chunk_size = chunk_size
+
+    def _users(self, input_data: UserBatchGetInputData):
+        if input_data.ids is None:
+            yield from self.repository.iter_users()
+            return
+        ids = iter(input_data.ids)
+        while True:
+            chunk = list(itertools.islice(ids, self.chunk_size))
+            if len(chunk) == 0:
+                return
+            yield from self.repository.find_many(chunk)
+
+    def _output_data(self, input_data: UserBatchGetInputData) -> Iterator[UserUpdateOutputData]:
+        for user in self._users(input_data):
+            # 値はリポジトリから読み込んだ検証済みのものなので、バリデーションを省く
+            user_data = UserData.construct(id=user.id, user_name=str(user.user_name))
+            yield UserUpdateOutputData.construct(user_data=user_data)
+
+    def handle(self, input_data: UserBatchGetInputData):
+        self.presenter.output(self._output_data(input_data))
+
 #
 # [Controller]
 #
@@ -68,4 +156,9 @@ if __name__ == "__main__":
     repository = UserRepository("store.json")
     presenter = UserGetPresenter()
     interactor = UserGetInteractor(repository, presenter)
-    controller(interactor)
\ No newline at end of file
+    controller(interactor)
+
+    # まとめて取得し、NDJSONで標準出力に書き出す
+    import sys
+    batch_interactor = UserBatchGetInteractor(repository, NdjsonUserPresenter(sys.stdout.buffer))
+    batch_interactor.handle(UserBatchGetInputData(ids=[1, 2, 3]))  # {"id": 1, "user_name": "..."}
\ No newline at end of file
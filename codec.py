@@ -0,0 +1,124 @@
+import abc
+import json
+from typing import Dict, Optional, TYPE_CHECKING
+from entity import User
+
+# repositoryがこのモジュールを読み込むので、UserStoreSchemaは型の確認のときと使うときだけ読み込む
+if TYPE_CHECKING:
+    from repository import UserStoreSchema
+
+
+class IStoreCodec(metaclass=abc.ABCMeta):
+    """データストアのファイルの形式 (UserStoreSchemaとバイト列の変換) のインターフェース
+    どのコーデックもUserStoreSchemaと同じ構造のJSONを読み書きするので、
+    別のコーデックで書いたファイルもそのまま読める (store_readerのストリーミングでも読める)。
+    """
+    name: str
+
+    @abc.abstractmethod
+    def encode(self, schema: "UserStoreSchema") -> bytes:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def decode(self, data: bytes) -> "UserStoreSchema":
+        raise NotImplementedError
+
+
+def to_document(schema: "UserStoreSchema") -> dict:
+    """UserStoreSchemaをJSONにする辞書に変換する
+    pydanticのdict()はフィールドごとに型を調べながら再帰的に変換するので、構造が決まっているこの形に直接組み立てる
+    """
+    return {
+        "id": schema.id,
+        "users": [
+            {"id": user.id, "user_name": {"first_name": user.user_name.first_name, "last_name": user.user_name.last_name}}
+            for user in schema.users
+        ],
+    }
+
+def from_document(document: dict) -> "UserStoreSchema":
+    """to_documentの逆。リポジトリが書き込んだ検証済みのデータなので、バリデーションを省く"""
+    from repository import UserStoreSchema
+    return UserStoreSchema.construct(
+        id=document.get("id", 1),
+        users=[User.from_trusted(record) for record in document["users"]],
+    )
+
+
+class CompactJsonCodec(IStoreCodec):
+    """インデントなしのJSON。インデントがなければ標準ライブラリのCの実装でエンコードされる"""
+    name = "compact"
+
+    def encode(self, schema: "UserStoreSchema") -> bytes:
+        return json.dumps(to_document(schema), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def decode(self, data: bytes) -> "UserStoreSchema":
+        return from_document(json.loads(data))
+
+class PrettyJsonCodec(IStoreCodec):
+    """インデント付きのJSON (以前の形式)。ファイルを直接読んでデバッグするとき用
+    インデントを付けるとPythonの実装でエンコードされるので、compactより数倍遅い
+    """
+    name = "pretty"
+
+    def encode(self, schema: "UserStoreSchema") -> bytes:
+        return json.dumps(to_document(schema), ensure_ascii=False, indent=2).encode("utf-8")
+
+    def decode(self, data: bytes) -> "UserStoreSchema":
+        return from_document(json.loads(data))
+
+class OrjsonCodec(IStoreCodec):
+    """orjsonを使うインデントなしのJSON。orjsonがインストールされているときだけ使える"""
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+
+    def encode(self, schema: "UserStoreSchema") -> bytes:
+        return self._orjson.dumps(to_document(schema))
+
+    def decode(self, data: bytes) -> "UserStoreSchema":
+        return from_document(self._orjson.loads(data))
+
+
+def available_codecs() -> Dict[str, IStoreCodec]:
+    """使えるコーデックを名前で引ける辞書で返す"""
+    codecs: Dict[str, IStoreCodec] = {"compact": CompactJsonCodec(), "pretty": PrettyJsonCodec()}
+    try:
+        codecs["orjson"] = OrjsonCodec()
+    except ImportError:
+        pass
+    return codecs
+
+_default: Optional[IStoreCodec] = None
+
+def default_codec() -> IStoreCodec:
+    """orjsonがあればOrjsonCodec、なければCompactJsonCodec"""
+    global _default
+    if _default is None:
+        try:
+            _default = OrjsonCodec()
+        except ImportError:
+            _default = CompactJsonCodec()
+    return _default
+
+def get_codec(name: Optional[str] = None) -> IStoreCodec:
+    """名前からコーデックを返す。Noneならdefault_codec()"""
+    if name is None:
+        return default_codec()
+    codecs = available_codecs()
+    if name not in codecs:
+        raise Exception(f"コーデックが使えません ({name})。使えるコーデック: {', '.join(sorted(codecs))}")
+    return codecs[name]
+
+
+if __name__ == "__main__":
+    from repository import UserStoreSchema
+    from value_object import UserName
+
+    schema = UserStoreSchema(id=1, users=[User(id=1, user_name=UserName(first_name="けいた", last_name="みどりかわ"))])
+    for name, codec in available_codecs().items():
+        data = codec.encode(schema)
+        print(f"{name:>8} {len(data):4d}bytes {codec.decode(data) == schema}")
+    print(default_codec().name)  # orjson (インストールされていれば)
@@ -1,30 +1,145 @@
+import atexit
+from typing import Any, Callable, Iterator, List
 from dependency_injector import containers, providers
-from repository import UserRepository
+from repository import IUserRepository, UserRepository
 from domein_service import UserService
 from application import UserApplicationService
 
 
+# instrumentationは計測を有効にしたときだけ読み込む (起動時間を短くするため)
+def create_metrics():
+    from instrumentation import Metrics
+    return Metrics()
+
+
+def instrument_repository(repository: IUserRepository, metrics: Callable[[], Any], enabled: bool) -> IUserRepository:
+    """enabledのときだけリポジトリを計測用のラッパーで包む。metricsはMetricsのプロバイダー"""
+    if not enabled:
+        return repository
+    from instrumentation import InstrumentedUserRepository
+    return InstrumentedUserRepository(repository, metrics())
+
+
+def instrument_service(service: Any, metrics: Callable[[], Any], component: str, enabled: bool) -> Any:
+    """enabledのときだけサービスを計測用のラッパーで包む"""
+    if not enabled:
+        return service
+    from instrumentation import InstrumentedService
+    return InstrumentedService(service, metrics(), component)
+
+
+def repository_resource(repository: IUserRepository, warm_up: bool = True) -> Iterator[IUserRepository]:
+    """リポジトリのリソース
+    init_resources()でリポジトリを作ってウォームアップし、shutdown_resources()でフラッシュして閉じる
+    """
+    if warm_up and hasattr(repository, "warm_up"):
+        # リクエストを受ける前にデータストアとインデックスを読み込んでおく
+        repository.warm_up()
+    yield repository
+    if hasattr(repository, "close"):
+        # ジャーナルのコンパクションやプロセスプールなど、残っている処理を終えてから閉じる
+        repository.close()
+
+
+def thread_repositories() -> Iterator[List[IUserRepository]]:
+    """スレッドごとのリポジトリの一覧のリソース
+    スレッドごとに作ったリポジトリを登録しておき、shutdown_resources()ですべてフラッシュして閉じる
+    """
+    repositories: List[IUserRepository] = []
+    yield repositories
+    for repository in repositories:
+        if hasattr(repository, "close"):
+            repository.close()
+
+
+def register_repository(repository: IUserRepository, repositories: List[IUserRepository]) -> IUserRepository:
+    """スレッドで最初に作ったリポジトリを一覧に登録して返す"""
+    repositories.append(repository)
+    return repository
+
+
 class Container(containers.DeclarativeContainer):
-    config = providers.Configuration()
+    """config.repository_scopeでリポジトリを作る単位を選ぶ
+    - "call" (既定): 呼び出しごとに新しいリポジトリを作る
+    - "process": リポジトリはResourceで、プロセスで1つ。すべてのスレッドとサービスで共有する。
+      init_resources()で作成とウォームアップ、shutdown_resources()で終了処理を行う
+    - "thread": リポジトリはThreadLocalSingletonで、スレッドごとに1つ。
+      作ったリポジトリはthread_repositoriesに登録し、shutdown_resources()でまとめて閉じる
+    サービスは状態を持たないので、呼び出しごとに作ってもコストはない (スコープに合ったリポジトリが注入される)
+    """
+    config = providers.Configuration(default={"repository_scope": "call", "warm_up": False})
+
+    # Singletonはコンテナごとに1つのインスタンスを共有する
+    metrics = providers.Singleton(create_metrics)
 
     # Factoryは呼び出しごとに新しいインスタンスを作る
-    user_repository = providers.Factory(
+    # 別のリポジトリを使うときはstore_repositoryをoverrideする
+    store_repository = providers.Factory(
         UserRepository,
         store_path=config.store_path
     )
 
+    thread_repositories = providers.Resource(thread_repositories)
+
+    shared_repository = providers.Selector(
+        config.repository_scope,
+        call=store_repository,
+        process=providers.Resource(repository_resource, repository=store_repository, warm_up=config.warm_up),
+        thread=providers.ThreadLocalSingleton(register_repository, repository=store_repository, repositories=thread_repositories),
+    )
+
+    # config.instrumentation.enabledがTrueのときだけ計測用のラッパーで包む (無効ならそのまま返す)
+    user_repository = providers.Factory(
+        instrument_repository,
+        repository=shared_repository,
+        metrics=metrics.provider,
+        enabled=config.instrumentation.enabled
+    )
+
     user_service = providers.Factory(
-        UserService,
-        user_repository=user_repository
+        instrument_service,
+        service=providers.Factory(UserService, user_repository=user_repository),
+        metrics=metrics.provider,
+        component="user_service",
+        enabled=config.instrumentation.enabled
     )
 
     user_application = providers.Factory(
-        UserApplicationService,
-        repository=user_repository,
-        service=user_service
+        instrument_service,
+        service=providers.Factory(UserApplicationService, repository=user_repository, service=user_service),
+        metrics=metrics.provider,
+        component="user_application",
+        enabled=config.instrumentation.enabled
     )
 
 
+class ProductionContainer(Container):
+    """本番用のコンテナ
+    Containerの既定のスコープ ("call") ではリポジトリを呼び出しごとに作るので、スナップショットや名前のインデックスを共有できない。
+    本番ではrepository_scopeを"process"か"thread"にして、リポジトリをサービス間で共有する。
+    UserRepositoryを含め、リポジトリの書き込みはスレッドセーフなので、"process"で1つのインスタンスを共有できる。
+
+    既定の設定はrepository_scope="process", warm_up=Trueで、from_dictで渡した設定で上書きできる。
+    create_production_containerで作ると、リソースを初期化して、プロセスの終了時にshutdown_resources()を呼ぶ。
+    """
+    # configを宣言し直すと、Containerから引き継いだプロバイダーは元のconfigを参照したままになるので、既定値だけを差し替える
+    config_defaults = {"repository_scope": "process", "warm_up": True}
+
+    def __new__(cls, **overriding_providers):
+        container = super().__new__(cls, **overriding_providers)
+        container.config.set_default({**container.config.get_default(), **cls.config_defaults})
+        return container
+
+
+def create_production_container(config: dict) -> ProductionContainer:
+    """ProductionContainerを作り、リソースを初期化する"""
+    container = ProductionContainer()
+    container.config.from_dict(config)
+    container.init_resources()
+    atexit.register(container.shutdown_resources)
+    return container
+
+
 if __name__ == "__main__":
     config = {
         "store_path": "store.json"
@@ -55,4 +170,8 @@ if __name__ == "__main__":
     app.update(1, "keita", "midorikawa")
 
     # 削除
-    app.delete(3)
\ No newline at end of file
+    app.delete(3)
+    # 本番用のコンテナ: リポジトリを1つだけ作り、起動時に読み込んでおく
+    production = create_production_container({"store_path": "store.json"})
+    print(production.user_application().repository is production.user_repository())  # True
+    print(production.user_application().get(1))  # id=1 user_name=UserName(first_name='keita', last_name='midorikawa')
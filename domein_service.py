@@ -1,3 +1,4 @@
+from typing import List
 from value_object import UserName
 from entity import User
 from repository import IUserRepository, UserRepository
@@ -14,9 +15,24 @@ class UserService:
     # 「ユーザーの重複確認」はドメインのルールに近いので、existsはドメインサービスに実装する
     def exists(self, user: User) -> bool:
         # データの入出力処理をリポジトリに閉じ込めることで、見通しが良くなる
+        # (UserRepositoryに名前のフィルターを設定すると、存在しない名前はデータストアを読まずに判定される)
         found = self.user_repository.find_by_name(user.user_name)
         return found is not None
 
+    def duplicates(self, users: List[User]) -> List[User]:
+        """usersのうち、名前がusers内で重複しているか、すでに存在しているユーザーを返す
+        データストアへの問い合わせは1回だけ
+        """
+        found = self.user_repository.find_many_by_name([user.user_name for user in users])
+        stored = {user.user_name for user in found}
+        seen = set()
+        duplicated = []
+        for user in users:
+            if user.user_name in seen or user.user_name in stored:
+                duplicated.append(user)
+            seen.add(user.user_name)
+        return duplicated
+
 if __name__ == "__main__":
     # リポジトリ
     store_path = "store.json"
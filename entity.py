@@ -9,6 +9,20 @@ class User(BaseModel):
         """外部から直接インスタンス変数を変更させてはいけない (デメテルの法則)"""
         self.user_name = user_name
 
+    @classmethod
+    def from_trusted(cls, record: dict) -> "User":
+        """データストアに保存した形式の辞書からバリデーションを省いて作る
+        書き込むときに検証済みのデータを読み込むときだけに使う
+        """
+        user_name = record["user_name"]
+        user = cls.__new__(cls)
+        object.__setattr__(user, "__dict__", {
+            "id": record["id"],
+            "user_name": UserName.from_trusted(user_name["first_name"], user_name["last_name"]),
+        })
+        object.__setattr__(user, "__fields_set__", {"id", "user_name"})
+        return user
+
     def __eq__(self, other):
         if other is None or not isinstance(other, User):
             return False
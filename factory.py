@@ -3,6 +3,7 @@ from value_object import UserName
 from entity import User
 from repository import IUserRepository, UserRepository
 from domein_service import UserService
+from id_allocator import IIdAllocator, BlockIdAllocator
 
 class IUserFactory(metaclass=abc.ABCMeta):
     """ファクトリーのインターフェース"""
@@ -11,13 +12,16 @@ class IUserFactory(metaclass=abc.ABCMeta):
         raise NotImplementedError
 
 class UserFactory(IUserFactory):
-    """ファクトリー"""
+    """ファクトリー
+    idの採番はIIdAllocatorに任せる。BlockIdAllocatorならidをブロック単位で予約するので、
+    ほとんどのcreateはデータストアにアクセスせずに済む
+    """
 
-    def __init__(self):
-        pass
+    def __init__(self, allocator: IIdAllocator):
+        self.allocator = allocator
 
     def create(self, user_name: UserName) -> User:
-        id = 1  # DBに接続してインクリメントされたIDを撮ってくる処理
+        id = self.allocator.allocate()
         return User(id=id, user_name=user_name)
 
 
@@ -48,8 +52,8 @@ if __name__ == "__main__":
     # ドメインサービス
     service = UserService(repository)
 
-    # ファクトリー
-    factory = UserFactory()
+    # ファクトリー (採番済みのidはstore.json.sequenceに保存する)
+    factory = UserFactory(BlockIdAllocator(store_path + ".sequence"))
 
     # 初期化
     repository.clear()
@@ -0,0 +1,79 @@
+import abc
+import json
+import os
+import threading
+import weakref
+from repository import store_lock, write_atomically
+
+class IIdAllocator(metaclass=abc.ABCMeta):
+    """idの採番のインターフェース"""
+    @abc.abstractmethod
+    def allocate(self) -> int:
+        raise NotImplementedError
+
+class BlockIdAllocator(IIdAllocator):
+    """idをブロック単位で予約する採番 (hi/lo方式)
+
+    採番済みの最大値 (high) をsequence_pathのファイルに保存しておき、
+    ブロックを使い切ったときだけロックを取ってhighをblock_size進め、その範囲をメモリ上で1つずつ払い出す。
+    ほとんどのallocateはメモリ上のインクリメントだけで済み、ファイルの読み書きはblock_size件に1回になる。
+
+    - スレッド間: メモリ上のブロックはthreading.Lockで保護する
+    - プロセス間: highの更新はflockで直列化するので、プロセスごとに異なるブロックを予約する
+    - 再起動: 予約したブロックの残りは使わずに捨てるので、idは飛ぶが重複はしない
+    - fork: 子プロセスは親のブロックを引き継がずに、新しいブロックを予約する
+
+    UserStoreSchema.idはデータストアのバージョンに使っているので、highは別のファイルに保存する。
+    """
+    def __init__(self, sequence_path: str, block_size: int = 1000, minimum: int = 1):
+        """minimumより小さいidは払い出さない (既存のユーザーのidと重ならないようにするときに指定する)"""
+        self._sequence_path = sequence_path
+        self._block_size = block_size
+        self._minimum = minimum
+        self._lock = threading.Lock()
+        self._next = 0
+        self._limit = 0
+        _allocators.add(self)
+
+    def _discard_block(self):
+        self._lock = threading.Lock()
+        self._next = 0
+        self._limit = 0
+
+    def _read_high(self) -> int:
+        if not os.path.exists(self._sequence_path):
+            return 0
+        with open(self._sequence_path, encoding="utf-8") as reader:
+            return json.load(reader)["high"]
+
+    def _reserve(self):
+        """新しいブロックを予約する。self._lockを取得した状態で呼ぶこと"""
+        with store_lock(self._sequence_path):
+            start = max(self._read_high() + 1, self._minimum)
+            high = start + self._block_size - 1
+            write_atomically(self._sequence_path, json.dumps({"high": high}))
+        self._next = start
+        self._limit = high
+
+    def allocate(self) -> int:
+        with self._lock:
+            if self._next == 0 or self._next > self._limit:
+                self._reserve()
+            id = self._next
+            self._next += 1
+            return id
+
+# forkした子プロセスで、親が予約したブロックを捨てるために作成したアロケーターを覚えておく
+_allocators: "weakref.WeakSet[BlockIdAllocator]" = weakref.WeakSet()
+
+def _discard_blocks_after_fork():
+    for allocator in list(_allocators):
+        allocator._discard_block()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_discard_blocks_after_fork)
+
+
+if __name__ == "__main__":
+    allocator = BlockIdAllocator("store.json.sequence", block_size=100)
+    print([allocator.allocate() for _ in range(3)])  # [1, 2, 3] (2回目以降は前回の予約の続きから)
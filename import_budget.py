@@ -0,0 +1,86 @@
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, List, Optional, Set
+
+# エントリーポイントごとのimportにかける時間の上限 (ミリ秒)
+# pydanticの読み込みに60ms前後、dependency_injectorの読み込みに100ms前後かかるので、それに余裕を持たせた値にしている
+BUDGETS_MS: Dict[str, float] = {
+    "application": 150,
+    "clean_architecture": 150,
+    "di_container": 300,
+}
+
+# エントリーポイントのimportで読み込んではいけないモジュール
+# 使うときに読み込むオプションのバックエンドや、書き込み・計測のときにしか使わないモジュール
+LAZY_MODULES: Set[str] = {
+    "sqlite3",
+    "mmap",
+    "multiprocessing",
+    "concurrent.futures.process",
+    "tempfile",
+    "store_reader",
+    "instrumentation",
+    "name_filter",
+    "orjson",
+    "journal_repository",
+    "sqlite_repository",
+    "sharded_repository",
+    "binary_repository",
+    "async_repository",
+}
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_times(module: str) -> Dict[str, int]:
+    """別プロセスでmoduleをimportし、読み込まれたモジュールごとの累積のimport時間 (マイクロ秒) を返す"""
+    env = dict(os.environ, PYTHONPATH=PACKAGE_DIR)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env, cwd=PACKAGE_DIR, capture_output=True, text=True, check=True,
+    )
+    times: Dict[str, int] = {}
+    # import time: self [us] | cumulative | imported package
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def check(modules: List[str], repeat: int = 5) -> List[str]:
+    """各エントリーポイントのimport時間と読み込んだモジュールを確認し、違反を返す
+    時間はrepeat回のうち最も短いものを使う (1回目は.pycの作成などで遅くなるため)
+    """
+    errors: List[str] = []
+    for module in modules:
+        runs = [import_times(module) for _ in range(repeat)]
+        elapsed = min(times[module] for times in runs) / 1000
+        budget = BUDGETS_MS[module]
+        print(f"{module:>20} {elapsed:8.1f}ms / {budget:6.1f}ms")
+        if elapsed > budget:
+            errors.append(f"{module}: import時間が上限を超えています ({elapsed:.1f}ms > {budget:.1f}ms)")
+        eager = sorted(name for name in runs[0] if name in LAZY_MODULES)
+        if len(eager) > 0:
+            errors.append(f"{module}: 遅延して読み込むべきモジュールを読み込んでいます ({', '.join(eager)})")
+    return errors
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="エントリーポイントのimport時間を確認する")
+    parser.add_argument("modules", nargs="*", default=sorted(BUDGETS_MS))
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    errors = check(args.modules, args.repeat)
+    for error in errors:
+        print(error, file=sys.stderr)
+    return 1 if len(errors) > 0 else 0
+
+
+if __name__ == "__main__":
+    # python import_budget.py
+    sys.exit(main())
@@ -0,0 +1,273 @@
+import bisect
+import functools
+import logging
+import threading
+import time
+from typing import Optional, List, Dict, Tuple, Iterator, Any
+from entity import User
+from value_object import UserName
+from repository import IUserRepository
+
+# レイテンシのヒストグラムのバケットの上限 (秒)。10μsから10秒まで
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+# (メトリクス名, ラベル) ラベルは (名前, 値) のタプル
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+class Histogram:
+    """固定バケットのヒストグラム
+    観測値を保持せずにバケットごとの件数だけを数えるので、メモリと記録のコストは観測数によらず一定。
+    パーセンタイルはバケット内を線形補間して推定する。
+    """
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        # 最後の要素は最大のバケットを超えた観測値の件数
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, q: float) -> float:
+        """q (0から1) のパーセンタイルの推定値"""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if count > 0 and cumulative + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+class Metrics:
+    """カウンターとヒストグラムを集めるレジストリ (スレッドセーフ)"""
+    def __init__(self, prefix: str = "ddd"):
+        self._prefix = prefix
+        self._lock = threading.Lock()
+        self._counters: Dict[MetricKey, float] = {}
+        self._histograms: Dict[MetricKey, Histogram] = {}
+
+    def inc(self, name: str, amount: float = 1, **labels: str):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels: str):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def counter(self, name: str, **labels: str) -> float:
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def histogram(self, name: str, **labels: str) -> Optional[Histogram]:
+        with self._lock:
+            return self._histograms.get((name, tuple(sorted(labels.items()))))
+
+    def to_prometheus(self) -> str:
+        """Prometheusのテキスト形式で出力する"""
+        def format_labels(labels: Tuple[Tuple[str, str], ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+            pairs = labels + extra
+            if len(pairs) == 0:
+                return ""
+            return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+        lines: List[str] = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            typed = set()
+            for (name, labels), value in counters:
+                metric = f"{self._prefix}_{name}"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} counter")
+                    typed.add(metric)
+                lines.append(f"{metric}{format_labels(labels)} {value:g}")
+            for (name, labels), histogram in histograms:
+                metric = f"{self._prefix}_{name}"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} histogram")
+                    typed.add(metric)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{metric}_bucket{format_labels(labels, (('le', f'{bound:g}'),))} {cumulative}")
+                lines.append(f"{metric}_bucket{format_labels(labels, (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{metric}_sum{format_labels(labels)} {histogram.sum:g}")
+                lines.append(f"{metric}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def log_line(self) -> str:
+        """メソッドごとの呼び出し回数とp50/p95/p99、I/Oのカウンターを1行にまとめる"""
+        parts: List[str] = []
+        with self._lock:
+            for (name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                label = ".".join(value for _, value in labels) or name
+                parts.append(
+                    f"{label} n={histogram.count} p50={histogram.percentile(0.5) * 1000:.3f}ms "
+                    f"p95={histogram.percentile(0.95) * 1000:.3f}ms p99={histogram.percentile(0.99) * 1000:.3f}ms"
+                )
+            for (name, labels), value in sorted(self._counters.items()):
+                if name.endswith("_bytes_total"):
+                    label = ".".join(value for _, value in labels)
+                    parts.append(f"{name}{'[' + label + ']' if label else ''}={value:g}")
+        return " | ".join(parts)
+
+class MetricsLogger:
+    """一定間隔でメトリクスを1行のログに出力するバックグラウンドのスレッド"""
+    def __init__(self, metrics: Metrics, interval: float = 60.0, logger: Optional[logging.Logger] = None):
+        self._metrics = metrics
+        self._interval = interval
+        self._logger = logger or logging.getLogger("ddd.metrics")
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> "MetricsLogger":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            self._logger.info(self._metrics.log_line())
+
+def timed(method):
+    """メソッドの呼び出し回数とレイテンシを記録するデコレーター"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._metrics.observe("call_duration_seconds", time.perf_counter() - start,
+                                  component=self._component, method=method.__name__)
+    return wrapper
+
+class InstrumentedUserRepository(IUserRepository):
+    """任意のIUserRepositoryをラップして、メソッドごとの呼び出し回数とレイテンシを記録する
+    ラップしたリポジトリがattach_metricsを持っていれば (UserRepository)、
+    ファイルの読み書きのバイト数とパースの時間も記録させる。
+    """
+    def __init__(self, repository: IUserRepository, metrics: Metrics, component: str = "user_repository"):
+        self._repository = repository
+        self._metrics = metrics
+        self._component = component
+        attach_metrics = getattr(repository, "attach_metrics", None)
+        if attach_metrics is not None:
+            attach_metrics(metrics)
+
+    def __getattr__(self, name: str) -> Any:
+        # clearやcloseなど、インターフェースにないメソッドはそのまま委譲する
+        return getattr(self._repository, name)
+
+    @timed
+    def save(self, user: User) -> User:
+        return self._repository.save(user)
+
+    @timed
+    def delete(self, user: User):
+        self._repository.delete(user)
+
+    @timed
+    def find_by_name(self, user_name: UserName) -> Optional[User]:
+        return self._repository.find_by_name(user_name)
+
+    @timed
+    def find(self, id: int) -> Optional[User]:
+        return self._repository.find(id)
+
+    @timed
+    def save_many(self, users: List[User]) -> List[User]:
+        return self._repository.save_many(users)
+
+    @timed
+    def delete_many(self, users: List[User]):
+        self._repository.delete_many(users)
+
+    @timed
+    def find_many(self, ids: List[int]) -> List[User]:
+        return self._repository.find_many(ids)
+
+    @timed
+    def find_many_by_name(self, user_names: List[UserName]) -> List[User]:
+        return self._repository.find_many_by_name(user_names)
+
+    @timed
+    def apply_changes(self, saved: List[User], deleted: List[User]):
+        self._repository.apply_changes(saved, deleted)
+
+    @timed
+    def list(self, cursor: Optional[int] = None, limit: int = 100) -> List[User]:
+        return self._repository.list(cursor, limit)
+
+    @timed
+    def search_by_name_prefix(self, prefix: str, limit: int = 100) -> List[User]:
+        return self._repository.search_by_name_prefix(prefix, limit)
+
+    def iter_users(self) -> Iterator[User]:
+        # 全件を読み終わるまでの時間を記録する
+        start = time.perf_counter()
+        try:
+            yield from self._repository.iter_users()
+        finally:
+            self._metrics.observe("call_duration_seconds", time.perf_counter() - start,
+                                  component=self._component, method="iter_users")
+
+class InstrumentedService:
+    """アプリケーションサービスやドメインサービスをラップして、公開メソッドの呼び出し回数とレイテンシを記録する
+    ラップしたオブジェクトのインターフェースをそのまま提供する
+    """
+    def __init__(self, service: Any, metrics: Metrics, component: str):
+        self._service = service
+        self._metrics = metrics
+        self._component = component
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._service, name)
+        if name.startswith("_") or not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                self._metrics.observe("call_duration_seconds", time.perf_counter() - start,
+                                      component=self._component, method=name)
+        return wrapper
+
+
+if __name__ == "__main__":
+    from di_container import Container
+
+    container = Container()
+    container.config.from_dict({"store_path": "store.json", "instrumentation": {"enabled": True}})
+
+    repository = container.user_repository()
+    app = container.user_application()
+
+    repository.clear()
+    app.register(1, "kta", "mido")
+    for _ in range(100):
+        app.get(1)
+
+    metrics = container.metrics()
+    print(metrics.log_line())  # user_application.get n=100 p50=... | ...
+    print(metrics.to_prometheus())  # # TYPE ddd_store_read_bytes_total counter ...
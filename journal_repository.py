@@ -0,0 +1,251 @@
+import glob
+import json
+import os
+import threading
+from typing import Optional, List, Dict, Iterator
+from pydantic import BaseModel
+from entity import User
+from value_object import UserName
+from repository import IUserRepository, UserNameIndex, UserOrderIndex
+
+class JournalCheckpointSchema(BaseModel):
+    """チェックポイントの構造定義
+    segment番までのジャーナルを反映した状態を表す
+    """
+    segment: int = 0
+    users: List[User]
+
+    @classmethod
+    def parse_trusted_file(cls, path: str) -> "JournalCheckpointSchema":
+        """リポジトリが書き込んだチェックポイントを、バリデーションを省いて読み込む"""
+        with open(path, encoding="utf-8") as reader:
+            data = json.load(reader)
+        return cls.construct(segment=data.get("segment", 0), users=[User.from_trusted(record) for record in data["users"]])
+
+class JournalUserRepository(IUserRepository):
+    """追記型ジャーナルのリポジトリ
+
+    ディレクトリの構成
+    - checkpoint.json: ある時点のユーザー全件 (JournalCheckpointSchema)
+    - journal.00000001.log: 1行1レコードの変更履歴 (NDJSON)
+
+    save/deleteはジャーナルの末尾に1行追記するだけなので、書き込みのコストはユーザー数に依存しない。
+    起動時はチェックポイントを読み込んでから、それより新しいジャーナルを順に再生して現在の状態を復元する。
+    ジャーナルがcompact_thresholdバイトを超えたら新しいセグメントに切り替え、
+    バックグラウンドのスレッドで新しいチェックポイントを書き出して古いセグメントを削除する (コンパクション)。
+    """
+    CHECKPOINT = "checkpoint.json"
+
+    def __init__(self, store_dir: str, compact_threshold: int = 1024 * 1024, fsync: bool = False):
+        self._store_dir = store_dir
+        self._compact_threshold = compact_threshold
+        self._fsync = fsync
+        self._lock = threading.Lock()
+        self._compactor: Optional[threading.Thread] = None
+        os.makedirs(store_dir, exist_ok=True)
+        self._users: Dict[int, User] = {}
+        self._names = UserNameIndex()
+        # 並び順のインデックス。最初にlist・search_by_name_prefixを呼んだときに作り、以降は_applyで更新する
+        self._order: Optional[UserOrderIndex] = None
+        self._segment = self._recover()
+        self._writer = open(self._segment_path(self._segment), "a", encoding="utf-8")
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self._store_dir, f"journal.{segment:08d}.log")
+
+    def _segments(self) -> List[int]:
+        paths = glob.glob(os.path.join(self._store_dir, "journal.*.log"))
+        return sorted(int(os.path.basename(path).split(".")[1]) for path in paths)
+
+    def _recover(self) -> int:
+        """チェックポイントとジャーナルから現在の状態を復元し、書き込み先のセグメント番号を返す"""
+        checkpoint_path = os.path.join(self._store_dir, self.CHECKPOINT)
+        checkpoint = JournalCheckpointSchema(users=[])
+        if os.path.exists(checkpoint_path):
+            checkpoint = JournalCheckpointSchema.parse_trusted_file(checkpoint_path)
+        self._users = {user.id: user for user in checkpoint.users}
+        self._names = UserNameIndex(checkpoint.users)
+        segment = checkpoint.segment + 1
+        for number in self._segments():
+            if number <= checkpoint.segment:
+                # チェックポイントに反映済み (コンパクション中に停止した場合に残る)
+                os.remove(self._segment_path(number))
+                continue
+            self._replay(self._segment_path(number))
+            segment = number
+        return segment
+
+    def _replay(self, path: str):
+        with open(path, "rb+") as reader:
+            offset = 0
+            for line in reader:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete record")
+                    record = json.loads(line)
+                except ValueError:
+                    # 書き込み途中で停止した末尾の行は捨てる
+                    reader.truncate(offset)
+                    break
+                self._apply(record)
+                offset += len(line)
+
+    def _apply(self, record: dict):
+        if record["op"] == "save":
+            user = User.from_trusted(record["user"])
+            previous = self._users.pop(user.id, None)
+            self._names.put(user, previous)
+            if self._order is not None:
+                self._order.put(user, previous)
+            self._users[user.id] = user
+        elif record["op"] == "delete":
+            removed = self._users.pop(record["id"], None)
+            if removed is not None:
+                self._names.remove(removed)
+                if self._order is not None:
+                    self._order.remove(removed)
+        elif record["op"] == "clear":
+            self._users = {}
+            self._names.clear()
+            self._order = None
+
+    def _append(self, records: List[dict], saved: List[User], deleted: List[User]):
+        """レコードをジャーナルに追記してメモリ上の状態に反映する
+        saved/deletedはrecordsで保存・削除するユーザー。追記する前に名前の重複を確認する
+        """
+        lines = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        with self._lock:
+            self._names.check(saved, deleted)
+            self._writer.write(lines)
+            self._writer.flush()
+            if self._fsync:
+                os.fsync(self._writer.fileno())
+            for record in records:
+                self._apply(record)
+            if self._writer.tell() >= self._compact_threshold:
+                self._start_compaction()
+
+    def _start_compaction(self):
+        """新しいセグメントに切り替え、古いセグメントのコンパクションをバックグラウンドで始める
+        self._lockを取得した状態で呼ぶこと
+        """
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._writer.close()
+        sealed = self._segment
+        self._segment += 1
+        self._writer = open(self._segment_path(self._segment), "a", encoding="utf-8")
+        # ロックを取得している間に全件をバリデーションすると書き込みが止まるので、バリデーションを省く
+        # (self._usersのユーザーは置き換えるだけで変更しないので、バックグラウンドで書き出しても壊れない)
+        checkpoint = JournalCheckpointSchema.construct(segment=sealed, users=list(self._users.values()))
+        self._compactor = threading.Thread(target=self._compact, args=(checkpoint,), daemon=True)
+        self._compactor.start()
+
+    def _compact(self, checkpoint: JournalCheckpointSchema):
+        checkpoint_path = os.path.join(self._store_dir, self.CHECKPOINT)
+        temp_path = checkpoint_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as writer:
+            writer.write(checkpoint.json(ensure_ascii=False))
+            writer.flush()
+            os.fsync(writer.fileno())
+        # 置き換えはアトミックなので、途中で停止しても古いチェックポイントとジャーナルから復元できる
+        os.replace(temp_path, checkpoint_path)
+        for number in self._segments():
+            if number <= checkpoint.segment:
+                os.remove(self._segment_path(number))
+
+    def compact(self):
+        """コンパクションを実行して完了を待つ"""
+        with self._lock:
+            self._start_compaction()
+        self.wait_compaction()
+
+    def wait_compaction(self):
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+
+    def close(self):
+        self.wait_compaction()
+        with self._lock:
+            self._writer.close()
+
+    def clear(self):
+        self._append([{"op": "clear"}], [], [])
+
+    def save(self, user: User) -> User:
+        self._append([{"op": "save", "user": user.dict()}], [user], [])
+        return user
+
+    def delete(self, user: User):
+        if user.id in self._users:
+            self._append([{"op": "delete", "id": user.id}], [], [user])
+
+    def find_by_name(self, user_name: UserName) -> Optional[User]:
+        found = self.find_many_by_name([user_name])
+        return found[0] if len(found) > 0 else None
+
+    def find(self, id: int) -> Optional[User]:
+        user = self._users.get(id)
+        return user.copy() if user is not None else None
+
+    def save_many(self, users: List[User]) -> List[User]:
+        self._append([{"op": "save", "user": user.dict()} for user in users], users, [])
+        return users
+
+    def delete_many(self, users: List[User]):
+        records = [{"op": "delete", "id": user.id} for user in users if user.id in self._users]
+        if len(records) > 0:
+            self._append(records, [], users)
+
+    def find_many(self, ids: List[int]) -> List[User]:
+        found = [self._users.get(id) for id in ids]
+        return [user.copy() for user in found if user is not None]
+
+    def find_many_by_name(self, user_names: List[UserName]) -> List[User]:
+        ids = [self._names.get(user_name) for user_name in set(user_names)]
+        found = [self._users.get(id) for id in ids if id is not None]
+        return [user.copy() for user in found if user is not None]
+
+    def apply_changes(self, saved: List[User], deleted: List[User]):
+        records = [{"op": "delete", "id": user.id} for user in deleted]
+        records += [{"op": "save", "user": user.dict()} for user in saved]
+        if len(records) > 0:
+            self._append(records, saved, deleted)
+
+    def iter_users(self) -> Iterator[User]:
+        for user in list(self._users.values()):
+            yield user.copy()
+
+    def _order_index(self) -> UserOrderIndex:
+        with self._lock:
+            if self._order is None:
+                self._order = UserOrderIndex(self._users.values())
+            return self._order
+
+    def list(self, cursor: Optional[int] = None, limit: int = 100) -> List[User]:
+        found = [self._users.get(id) for id in self._order_index().page(cursor, limit)]
+        return [user.copy() for user in found if user is not None]
+
+    def search_by_name_prefix(self, prefix: str, limit: int = 100) -> List[User]:
+        found = [self._users.get(id) for id in self._order_index().search(prefix, limit)]
+        return [user.copy() for user in found if user is not None]
+
+
+if __name__ == "__main__":
+    # リポジトリ
+    repository = JournalUserRepository("store.journal", compact_threshold=4096)
+
+    # 初期化
+    repository.clear()
+
+    # ユーザー追加処理 (ジャーナルに1行ずつ追記される)
+    for i in range(100):
+        repository.save(User(id=i, user_name=UserName(first_name=f"foo{i}", last_name="bar")))
+    repository.wait_compaction()
+
+    # 再起動してもチェックポイントとジャーナルから復元される
+    repository.close()
+    repository = JournalUserRepository("store.journal", compact_threshold=4096)
+    print(repository.find(99))  # id=99 user_name=UserName(first_name='foo99', last_name='bar')
+    repository.close()
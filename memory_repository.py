@@ -0,0 +1,222 @@
+import logging
+import threading
+from typing import Optional, List, Dict, Iterator
+from entity import User
+from value_object import UserName
+from repository import IUserRepository, UserNameIndex, UserOrderIndex
+
+logger = logging.getLogger("ddd.memory_repository")
+
+class MemorySnapshot:
+    """InMemoryUserRepositoryのある時点の状態
+    一度公開したスナップショットは変更しない (書き込みはコピーした新しいスナップショットを作って差し替える)。
+    そのため読み込み側はロックを取らずに、参照を取り出した時点の一貫した状態を読める。
+    """
+    def __init__(self, users: Dict[int, User], names: UserNameIndex, order: Optional[UserOrderIndex] = None):
+        self.users = users
+        self.names = names
+        # 並び順のインデックスは、最初にlist・search_by_name_prefixを呼んだときに作る
+        # 複数の読み込みスレッドが同時に作っても同じ内容になるので、ロックは取らない
+        self._order = order
+
+    def order(self) -> UserOrderIndex:
+        order = self._order
+        if order is None:
+            order = UserOrderIndex(self.users.values())
+            self._order = order
+        return order
+
+    def apply(self, saved: List[User], deleted: List[User]) -> "MemorySnapshot":
+        """削除と保存を反映した新しいスナップショットを返す (自分自身は変更しない)"""
+        self.names.check(saved, deleted)
+        users = dict(self.users)
+        names = self.names.copy()
+        order = self._order.copy() if self._order is not None else None
+        for user in deleted:
+            removed = users.pop(user.id, None)
+            if removed is not None:
+                names.remove(removed)
+                if order is not None:
+                    order.remove(removed)
+        for user in saved:
+            previous = users.pop(user.id, None)
+            names.put(user, previous)
+            if order is not None:
+                order.put(user, previous)
+            users[user.id] = user.copy()
+        return MemorySnapshot(users, names, order)
+
+
+class InMemoryUserRepository(IUserRepository):
+    """メモリ上にユーザーを保持するリポジトリ (遅いデータストアの前に置くホットな層)
+
+    - 読み込み: 現在のスナップショットの参照を取り出して辞書を引くだけで、ロックを取らない。
+      書き込み中でも、読み込みは書き込み前か書き込み後のどちらかの状態を一貫して見る
+    - 書き込み: ロックで直列化し、辞書をコピーして変更を反映した新しいスナップショットに差し替える (コピーオンライト)。
+      1回の書き込みはユーザー数に比例するので、まとめて書き込むときはsave_manyやapply_changesを使う
+
+    backendを指定すると、作成時にbackendの全ユーザーを読み込み、変更をflush()でbackendに書き込む。
+    flush_intervalを指定すると、バックグラウンドのスレッドがその秒数ごとにflush()する。
+    前回のflush()からの変更だけをapply_changesで1回で書き込むので、書き込みの多い負荷でもbackendへの書き込みは間引かれる。
+    flushする前にプロセスが停止すると、その間の変更は失われる。終了するときはclose()を呼ぶこと。
+    バックグラウンドのflushが失敗したら例外をログに出して保持し、次のflush()・close()がその例外を投げる。
+    """
+    def __init__(self, backend: Optional[IUserRepository] = None, flush_interval: Optional[float] = None):
+        self._backend = backend
+        self._write_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        users = list(backend.iter_users()) if backend is not None else []
+        self._snapshot = MemorySnapshot({user.id: user for user in users}, UserNameIndex(users))
+        # 前回のflushからの変更。_write_lockを取得して更新する
+        self._pending_saved: Dict[int, User] = {}
+        self._pending_deleted: Dict[int, User] = {}
+        self._pending_clear = False
+        self._closed = threading.Event()
+        # バックグラウンドのflushで起きた最後の例外。_write_lockを取得して更新する
+        self._flush_error: Optional[BaseException] = None
+        self._flusher: Optional[threading.Thread] = None
+        if backend is not None and flush_interval is not None:
+            self._flusher = threading.Thread(target=self._flush_periodically, args=(flush_interval,), daemon=True)
+            self._flusher.start()
+
+    def _flush_periodically(self, interval: float):
+        while not self._closed.wait(interval):
+            try:
+                self._flush()
+            except Exception as e:
+                # 書き込めなかった変更は残っているので、次の周期でもう一度書き込む
+                logger.exception("backendへの定期的な書き込みに失敗しました")
+                with self._write_lock:
+                    self._flush_error = e
+
+    def _write(self, saved: List[User], deleted: List[User], clear: bool = False):
+        with self._write_lock:
+            if clear:
+                self._snapshot = MemorySnapshot({}, UserNameIndex())
+                self._pending_saved.clear()
+                self._pending_deleted.clear()
+                self._pending_clear = True
+                return
+            self._snapshot = self._snapshot.apply(saved, deleted)
+            if self._backend is None:
+                return
+            for user in deleted:
+                self._pending_saved.pop(user.id, None)
+                self._pending_deleted[user.id] = user
+            for user in saved:
+                self._pending_deleted.pop(user.id, None)
+                self._pending_saved[user.id] = self._snapshot.users[user.id]
+
+    def flush(self):
+        """前回のflushからの変更をbackendに書き込む。失敗したら変更を戻して、次回また書き込む
+        書き込めても、その前にバックグラウンドのflushが失敗していれば、その例外を投げる
+        """
+        self._flush()
+        with self._write_lock:
+            error = self._flush_error
+            self._flush_error = None
+        if error is not None:
+            raise error
+
+    def _flush(self):
+        if self._backend is None:
+            return
+        with self._flush_lock:
+            with self._write_lock:
+                saved = self._pending_saved
+                deleted = self._pending_deleted
+                clear = self._pending_clear
+                self._pending_saved = {}
+                self._pending_deleted = {}
+                self._pending_clear = False
+            if not clear and len(saved) == 0 and len(deleted) == 0:
+                return
+            try:
+                if clear:
+                    self._backend.clear()
+                self._backend.apply_changes(list(saved.values()), list(deleted.values()))
+            except BaseException:
+                with self._write_lock:
+                    # 書き込めなかった変更のうち、その後さらに変更されていないものを戻す
+                    for id, user in saved.items():
+                        if id not in self._pending_saved and id not in self._pending_deleted:
+                            self._pending_saved[id] = user
+                    for id, user in deleted.items():
+                        if id not in self._pending_saved and id not in self._pending_deleted:
+                            self._pending_deleted[id] = user
+                    self._pending_clear = self._pending_clear or clear
+                raise
+
+    def close(self):
+        """定期的なflushを止めて、残りの変更をbackendに書き込む"""
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+
+    def clear(self):
+        self._write([], [], clear=True)
+
+    def save(self, user: User) -> User:
+        self._write([user], [])
+        return user
+
+    def delete(self, user: User):
+        self._write([], [user])
+
+    def find_by_name(self, user_name: UserName) -> Optional[User]:
+        snapshot = self._snapshot
+        id = snapshot.names.get(user_name)
+        return snapshot.users[id].copy() if id is not None else None
+
+    def find(self, id: int) -> Optional[User]:
+        user = self._snapshot.users.get(id)
+        return user.copy() if user is not None else None
+
+    def save_many(self, users: List[User]) -> List[User]:
+        self._write(users, [])
+        return users
+
+    def delete_many(self, users: List[User]):
+        self._write([], users)
+
+    def find_many(self, ids: List[int]) -> List[User]:
+        users = self._snapshot.users
+        found = [users.get(id) for id in ids]
+        return [user.copy() for user in found if user is not None]
+
+    def find_many_by_name(self, user_names: List[UserName]) -> List[User]:
+        snapshot = self._snapshot
+        ids = [snapshot.names.get(user_name) for user_name in set(user_names)]
+        return [snapshot.users[id].copy() for id in ids if id is not None]
+
+    def apply_changes(self, saved: List[User], deleted: List[User]):
+        self._write(saved, deleted)
+
+    def iter_users(self) -> Iterator[User]:
+        # 取り出したスナップショットは変更されないので、走査中に書き込まれても壊れない
+        for user in self._snapshot.users.values():
+            yield user.copy()
+
+    def list(self, cursor: Optional[int] = None, limit: int = 100) -> List[User]:
+        snapshot = self._snapshot
+        return [snapshot.users[id].copy() for id in snapshot.order().page(cursor, limit)]
+
+    def search_by_name_prefix(self, prefix: str, limit: int = 100) -> List[User]:
+        snapshot = self._snapshot
+        return [snapshot.users[id].copy() for id in snapshot.order().search(prefix, limit)]
+
+
+if __name__ == "__main__":
+    from repository import UserRepository
+
+    # store.jsonの前に置き、1秒ごとに変更を書き込む
+    repository = InMemoryUserRepository(UserRepository("store.json"), flush_interval=1.0)
+    repository.clear()
+    repository.save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+    print(repository.find_by_name(UserName(first_name="kta", last_name="mido")))  # id=1 user_name=...
+
+    # 終了時に残りの変更を書き込む
+    repository.close()
+    print(UserRepository("store.json").find(1))  # id=1 user_name=...
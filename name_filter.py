@@ -0,0 +1,90 @@
+import hashlib
+import math
+import struct
+from typing import Iterable, Optional, Tuple
+from value_object import UserName
+
+# ファイルの先頭: マジック, データストアのスタンプ (inode, サイズ, 更新時刻), ビット数, ハッシュ関数の数
+_HEADER = struct.Struct("<4sQQqQI")
+_MAGIC = b"UNBF"
+
+
+class UserNameBloomFilter:
+    """UserNameのブルームフィルター
+    might_containがFalseなら、その名前のユーザーは確実に存在しない。Trueなら存在するかもしれない (偽陽性がある)。
+    expected_users件を登録したときに偽陽性率がfalse_positive_rate程度になるように、ビット数とハッシュ関数の数を決める。
+    要素を削除できないので、削除したユーザーの名前は作り直すまで「存在するかもしれない」のまま残る。
+    """
+    def __init__(self, expected_users: int = 100_000, false_positive_rate: float = 0.01):
+        if expected_users <= 0 or not 0 < false_positive_rate < 1:
+            raise ValueError("expected_users must be positive and false_positive_rate must be between 0 and 1")
+        self.num_bits = max(8, math.ceil(-expected_users * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / expected_users * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, user_name: UserName) -> Iterable[int]:
+        # 1回のハッシュから2つの値を取り出し、その線形結合でnum_hashes個の位置を作る (ダブルハッシュ法)
+        key = f"{user_name.first_name}\x00{user_name.last_name}".encode("utf-8")
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, user_name: UserName):
+        for position in self._positions(user_name):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def add_many(self, user_names: Iterable[UserName]):
+        for user_name in user_names:
+            self.add(user_name)
+
+    def might_contain(self, user_name: UserName) -> bool:
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(user_name))
+
+    def same_size(self, other: "UserNameBloomFilter") -> bool:
+        return self.num_bits == other.num_bits and self.num_hashes == other.num_hashes
+
+    def to_bytes(self, stamp: Tuple[int, int, int]) -> bytes:
+        """作成元のデータストアのスタンプと一緒にバイト列にする"""
+        return _HEADER.pack(_MAGIC, *stamp, self.num_bits, self.num_hashes) + bytes(self._bits)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> Tuple["UserNameBloomFilter", Tuple[int, int, int]]:
+        """to_bytesの逆。フィルターと作成元のデータストアのスタンプを返す"""
+        if len(data) < _HEADER.size:
+            raise ValueError("invalid bloom filter data")
+        magic, ino, size, mtime_ns, num_bits, num_hashes = _HEADER.unpack_from(data)
+        body = data[_HEADER.size:]
+        if magic != _MAGIC or len(body) != (num_bits + 7) // 8:
+            raise ValueError("invalid bloom filter data")
+        name_filter = cls.__new__(cls)
+        name_filter.num_bits = num_bits
+        name_filter.num_hashes = num_hashes
+        name_filter._bits = bytearray(body)
+        return name_filter, (ino, size, mtime_ns)
+
+
+class NameFilterStats:
+    """フィルターの効果を確認するためのカウンター
+    - checks: フィルターに問い合わせた回数
+    - negatives: 「確実に存在しない」と判定して、データストアの検索を省いた回数
+    - false_positives: 「存在するかもしれない」と判定したが、検索したら存在しなかった回数
+    """
+    def __init__(self):
+        self.checks = 0
+        self.negatives = 0
+        self.false_positives = 0
+
+    def false_positive_rate(self) -> Optional[float]:
+        """存在しなかった名前のうち、フィルターが見逃した割合。まだ存在しない名前を問い合わせていなければNone"""
+        misses = self.negatives + self.false_positives
+        return self.false_positives / misses if misses > 0 else None
+
+
+if __name__ == "__main__":
+    name_filter = UserNameBloomFilter(expected_users=1000)
+    name_filter.add(UserName(first_name="kta", last_name="mido"))
+    print(name_filter.num_bits, name_filter.num_hashes)  # 9586 7
+    print(name_filter.might_contain(UserName(first_name="kta", last_name="mido")))  # True
+    print(name_filter.might_contain(UserName(first_name="foo", last_name="bar")))  # False (ほぼ確実に)
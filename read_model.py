@@ -0,0 +1,164 @@
+import json
+from typing import Optional, List, Dict, Iterator
+from entity import User
+from value_object import UserName
+from repository import IUserRepository
+from clean_architecture import (
+    UserData, UserUpdateOutputData, UserGetInputData, IUserGetInputPort, IUserGetOutputPort
+)
+
+class UserReadModel:
+    """参照系のリードモデル (CQRSのプロジェクション)
+    ユーザーごとに、そのまま返せるUserDataとJSONにシリアライズしたバイト列を保持する。
+    参照は辞書を1回引くだけで、ドメインモデル (User) の生成やシリアライズは行わない。
+    UserDataはイミュータブルでバイト列も変更できないので、コピーせずにそのまま返す。
+    """
+    def __init__(self):
+        self._records: Dict[int, UserData] = {}
+        self._serialized: Dict[int, bytes] = {}
+
+    def put(self, user: User):
+        user_name = str(user.user_name)
+        self._records[user.id] = UserData.construct(id=user.id, user_name=user_name)
+        self._serialized[user.id] = json.dumps({"id": user.id, "user_name": user_name}, ensure_ascii=False).encode("utf-8")
+
+    def remove(self, id: int):
+        self._records.pop(id, None)
+        self._serialized.pop(id, None)
+
+    def clear(self):
+        self._records.clear()
+        self._serialized.clear()
+
+    def get(self, id: int) -> Optional[UserData]:
+        return self._records.get(id)
+
+    def get_json(self, id: int) -> Optional[bytes]:
+        return self._serialized.get(id)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+class ProjectingUserRepository(IUserRepository):
+    """書き込みのたびにリードモデルを差分で更新するリポジトリ
+    任意のIUserRepositoryをラップし、書き込みが成功したら変更されたユーザーだけをリードモデルに反映する。
+    作成時にリポジトリの全ユーザーからリードモデルを作る。
+
+    リードモデルはこのリポジトリを通した書き込みだけを反映する。
+    別のプロセスが同じデータストアに書き込む場合は、rebuild()で作り直すこと。
+    """
+    def __init__(self, repository: IUserRepository, read_model: Optional[UserReadModel] = None):
+        self._repository = repository
+        self.read_model = read_model or UserReadModel()
+        self.rebuild()
+
+    def __getattr__(self, name: str):
+        # closeやwarm_upなど、インターフェースにないメソッドはそのまま委譲する
+        return getattr(self._repository, name)
+
+    def rebuild(self):
+        """リポジトリの全ユーザーからリードモデルを作り直す"""
+        self.read_model.clear()
+        for user in self._repository.iter_users():
+            self.read_model.put(user)
+
+    def clear(self):
+        self._repository.clear()
+        self.read_model.clear()
+
+    def save(self, user: User) -> User:
+        saved = self._repository.save(user)
+        self.read_model.put(user)
+        return saved
+
+    def delete(self, user: User):
+        self._repository.delete(user)
+        self.read_model.remove(user.id)
+
+    def find_by_name(self, user_name: UserName) -> Optional[User]:
+        return self._repository.find_by_name(user_name)
+
+    def find(self, id: int) -> Optional[User]:
+        return self._repository.find(id)
+
+    def save_many(self, users: List[User]) -> List[User]:
+        saved = self._repository.save_many(users)
+        for user in users:
+            self.read_model.put(user)
+        return saved
+
+    def delete_many(self, users: List[User]):
+        self._repository.delete_many(users)
+        for user in users:
+            self.read_model.remove(user.id)
+
+    def find_many(self, ids: List[int]) -> List[User]:
+        return self._repository.find_many(ids)
+
+    def find_many_by_name(self, user_names: List[UserName]) -> List[User]:
+        return self._repository.find_many_by_name(user_names)
+
+    def apply_changes(self, saved: List[User], deleted: List[User]):
+        self._repository.apply_changes(saved, deleted)
+        for user in deleted:
+            self.read_model.remove(user.id)
+        for user in saved:
+            self.read_model.put(user)
+
+    def iter_users(self) -> Iterator[User]:
+        return self._repository.iter_users()
+
+    def list(self, cursor: Optional[int] = None, limit: int = 100) -> List[User]:
+        return self._repository.list(cursor, limit)
+
+    def search_by_name_prefix(self, prefix: str, limit: int = 100) -> List[User]:
+        return self._repository.search_by_name_prefix(prefix, limit)
+
+class UserQueryService:
+    """参照系のアプリケーションサービス
+    UserGetApplicationService.getと異なり、ドメインモデルではなくリードモデルのUserDataを返す
+    """
+    def __init__(self, read_model: UserReadModel):
+        self.read_model = read_model
+
+    def get(self, id: int) -> Optional[UserData]:
+        return self.read_model.get(id)
+
+    def get_json(self, id: int) -> Optional[bytes]:
+        """シリアライズ済みのJSONをそのまま返す"""
+        return self.read_model.get_json(id)
+
+class UserGetQueryInteractor(IUserGetInputPort):
+    """UserGetInteractorのリードモデル版
+    リポジトリからUserを読み込んでUserDataに変換する代わりに、リードモデルのUserDataをそのまま出力する
+    """
+    def __init__(self, read_model: UserReadModel, presenter: IUserGetOutputPort):
+        self.read_model = read_model
+        self.presenter = presenter
+
+    def handle(self, input_data: UserGetInputData):
+        user_data = self.read_model.get(input_data.id)
+        if user_data is None:
+            return
+        self.presenter.output(UserUpdateOutputData.construct(user_data=user_data))
+
+
+if __name__ == "__main__":
+    from repository import UserRepository
+    from domein_service import UserService
+    from application import UserApplicationService
+    from clean_architecture import UserGetPresenter, controller
+
+    # 書き込みはリードモデルを更新するリポジトリを通す
+    repository = ProjectingUserRepository(UserRepository("store.json"))
+    repository.clear()
+    app = UserApplicationService(repository, UserService(repository))
+    app.register(1, "kta", "mido")
+    app.update(1, "keita", "midorikawa")
+
+    # 参照はリードモデルから返す
+    query = UserQueryService(repository.read_model)
+    print(query.get(1))  # id=1 user_name='keita midorikawa'
+    print(query.get_json(1))  # b'{"id": 1, "user_name": "keita midorikawa"}'
+
+    controller(UserGetQueryInteractor(repository.read_model, UserGetPresenter()))  # user_data=UserData(id=1, user_name='keita midorikawa')
@@ -0,0 +1,62 @@
+import argparse
+import json
+import os
+import shutil
+from typing import List, TextIO
+from sharded_repository import read_shard_count, write_shard_count, shard_of, shard_path
+from store_reader import iter_user_records
+
+def rebalance(store_dir: str, shard_count: int) -> int:
+    """store_dirのシャードをshard_count個に再配置し、移動したユーザー数 (シャードが変わったユーザーの数) を返す
+    シャード数を変更するときに、停止中のデータストアに対して実行する (オフライン)。
+    既存のシャードを1件ずつ読みながら新しいシャードのファイルに書き出すので、メモリはユーザー数によらず一定。
+    """
+    old_count = read_shard_count(store_dir)
+    if old_count is None:
+        raise Exception(f"シャードのディレクトリではありません ({store_dir})")
+
+    work_dir = store_dir.rstrip(os.sep) + ".rebalance"
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+
+    # UserStoreSchemaと同じ形式で、配列の要素を順に書き足していく
+    writers: List[TextIO] = [open(shard_path(work_dir, shard), "w", encoding="utf-8") for shard in range(shard_count)]
+    counts = [0] * shard_count
+    moved = 0
+    for writer in writers:
+        writer.write('{"id": 1, "users": [')
+    for shard in range(old_count):
+        path = shard_path(store_dir, shard)
+        if not os.path.exists(path):
+            continue
+        for record in iter_user_records(path):
+            new_shard = shard_of(record["id"], shard_count)
+            if counts[new_shard] > 0:
+                writers[new_shard].write(", ")
+            writers[new_shard].write(json.dumps(record, ensure_ascii=False))
+            counts[new_shard] += 1
+            if new_shard != shard:
+                moved += 1
+    for writer in writers:
+        writer.write("]}")
+        writer.close()
+    write_shard_count(work_dir, shard_count)
+
+    # 書き出しが終わってから入れ替える
+    old_dir = store_dir.rstrip(os.sep) + ".old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    os.rename(store_dir, old_dir)
+    os.rename(work_dir, store_dir)
+    shutil.rmtree(old_dir)
+    return moved
+
+
+if __name__ == "__main__":
+    # python rebalance_shards.py store.shards 16
+    parser = argparse.ArgumentParser(description="シャードを再配置する")
+    parser.add_argument("store_dir")
+    parser.add_argument("shard_count", type=int)
+    args = parser.parse_args()
+
+    moved = rebalance(args.store_dir, args.shard_count)
+    print(f"{moved} users moved -> {args.shard_count} shards")
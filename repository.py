@@ -1,15 +1,37 @@
 import abc
+import bisect
+import heapq
 import os
-from typing import Optional, List
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional, List, Dict, Tuple, Callable, Iterable, Iterator, TypeVar, Union
 from entity import User
 from value_object import UserName
 from pydantic import BaseModel
+from codec import IStoreCodec, default_codec
+
+try:
+    import fcntl
+except ImportError:
+    # fcntlがない環境 (Windows) ではプロセス間のロックをしない
+    fcntl = None
+
+T = TypeVar("T")
 
 class UserStoreSchema(BaseModel):
-    """データストアの構造定義"""
+    """データストアの構造定義
+    idはデータストアのバージョン。書き込むたびに1ずつ増える
+    """
     id: int = 1
     users: List[User]
 
+    @classmethod
+    def parse_trusted_file(cls, path: str, codec: Optional[IStoreCodec] = None) -> "UserStoreSchema":
+        """リポジトリが書き込んだファイルを、バリデーションを省いて読み込む (parse_fileの数倍速い)"""
+        with open(path, "rb") as reader:
+            return (codec or default_codec()).decode(reader.read())
+
 class IUserRepository(metaclass=abc.ABCMeta):
     """リポジトリのインターフェース"""
     @abc.abstractmethod
@@ -28,55 +50,627 @@ class IUserRepository(metaclass=abc.ABCMeta):
     def find(self, id: int) -> Optional[User]:
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def save_many(self, users: List[User]) -> List[User]:
+        """まとめて保存する。1回の書き込みで永続化する"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete_many(self, users: List[User]):
+        """まとめて削除する。1回の書き込みで永続化する"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def find_many(self, ids: List[int]) -> List[User]:
+        """idsの順に、見つかったユーザーだけを返す"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def find_many_by_name(self, user_names: List[UserName]) -> List[User]:
+        """いずれかの名前を持つユーザーを返す"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def apply_changes(self, saved: List[User], deleted: List[User]):
+        """削除と保存をまとめて1回の書き込みで永続化する (削除を先に反映する)"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def iter_users(self) -> Iterator[User]:
+        """全ユーザーを1件ずつ返す"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def list(self, cursor: Optional[int] = None, limit: int = 100) -> List[User]:
+        """idがcursorより大きいユーザーを、idの昇順にlimit件返す (キーセットページネーション)
+        次のページは、返した最後のユーザーのidをcursorにして取得する
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def search_by_name_prefix(self, prefix: str, limit: int = 100) -> List[User]:
+        """「姓 名」(name_key) がprefixで始まるユーザーを、名前の昇順にlimit件返す"""
+        raise NotImplementedError
+
+# ファイルの同一性を判定するためのスタンプ (inode, サイズ, 更新時刻)
+StoreStamp = Tuple[int, int, int]
+
+class StoreVersionConflict(Exception):
+    """読み込んでから書き込むまでの間に、別のリポジトリ (別のプロセス) がデータストアを更新した
+    スナップショットは破棄済みなので、ユースケースをやり直せば最新の状態で再実行できる
+    """
+
+def read_stamp(store_path: str) -> Optional[StoreStamp]:
+    try:
+        stat = os.stat(store_path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+@contextmanager
+def store_lock(store_path: str) -> Iterator[None]:
+    """ロックファイルに排他ロック (flock) をかけて、プロセス間の書き込みを直列化する"""
+    if fcntl is None:
+        yield
+        return
+    with open(store_path + ".lock", "a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+def write_atomically(store_path: str, data: Union[str, bytes]):
+    """一時ファイルに書き込んでからリネームする
+    読み込む側からは、書き込み前か書き込み後のどちらかのファイルしか見えない
+    dataがbytesならバイナリで、strならUTF-8で書き込む
+    """
+    directory = os.path.dirname(os.path.abspath(store_path))
+    # 起動を速くするため、書き込むときに読み込む
+    import tempfile
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(store_path) + ".", suffix=".tmp")
+    try:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with os.fdopen(fd, "wb") as writer:
+            writer.write(data)
+            writer.flush()
+            os.fsync(writer.fileno())
+        os.replace(temp_path, store_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def retry_on_conflict(operation: Callable[[], T], retries: int = 3) -> T:
+    """StoreVersionConflictが起きたら、operationを最大retries回まで実行する
+    ```
+    retry_on_conflict(lambda: app.update(1, "keita", "midorikawa"))
+    ```
+    """
+    for attempt in range(retries):
+        try:
+            return operation()
+        except StoreVersionConflict:
+            if attempt == retries - 1:
+                raise
+    raise ValueError("retries must be positive")
+
+def name_key(user_name: UserName) -> str:
+    """名前の並び順と前方一致の検索に使うキー。「姓 名」の順にする"""
+    return f"{user_name.last_name} {user_name.first_name}"
+
+def page_users(users: Iterable[User], cursor: Optional[int], limit: int) -> List[User]:
+    """usersからlistの結果を選ぶ。インデックスを持たない場合に使う (usersを1回走査する)"""
+    candidates = (user for user in users if cursor is None or user.id > cursor)
+    return heapq.nsmallest(limit, candidates, key=lambda user: user.id)
+
+def search_users(users: Iterable[User], prefix: str, limit: int) -> List[User]:
+    """usersからsearch_by_name_prefixの結果を選ぶ。インデックスを持たない場合に使う (usersを1回走査する)"""
+    candidates = (user for user in users if name_key(user.user_name).startswith(prefix))
+    return heapq.nsmallest(limit, candidates, key=lambda user: (name_key(user.user_name), user.id))
+
+class UserOrderIndex:
+    """idの昇順と名前 (name_key) の昇順にユーザーのidを並べたインデックス
+    bisectで開始位置を求めてから必要な件数だけ取り出すので、listとsearch_by_name_prefixはO(log n + limit)。
+    保存・削除のたびにput/removeで更新する。挿入と削除はリストの要素をずらすのでO(n)だが、
+    memmoveでまとめて移動するので、データストア全体を並べ直すよりずっと速い。
+    """
+    def __init__(self, users: Iterable[User] = ()):
+        users = list(users)
+        self._ids: List[int] = sorted(user.id for user in users)
+        self._names: List[Tuple[str, int]] = sorted((name_key(user.user_name), user.id) for user in users)
+
+    def put(self, user: User, previous: Optional[User] = None):
+        """userを登録する。previousは同じidで保存済みだったユーザー"""
+        if previous is not None:
+            self.remove(previous)
+        bisect.insort(self._ids, user.id)
+        bisect.insort(self._names, (name_key(user.user_name), user.id))
+
+    def remove(self, user: User):
+        i = bisect.bisect_left(self._ids, user.id)
+        if i < len(self._ids) and self._ids[i] == user.id:
+            del self._ids[i]
+        entry = (name_key(user.user_name), user.id)
+        i = bisect.bisect_left(self._names, entry)
+        if i < len(self._names) and self._names[i] == entry:
+            del self._names[i]
+
+    def clear(self):
+        self._ids.clear()
+        self._names.clear()
+
+    def copy(self) -> "UserOrderIndex":
+        copied = UserOrderIndex()
+        copied._ids = list(self._ids)
+        copied._names = list(self._names)
+        return copied
+
+    def page(self, cursor: Optional[int], limit: int) -> List[int]:
+        start = 0 if cursor is None else bisect.bisect_right(self._ids, cursor)
+        return self._ids[start:start + limit]
+
+    def search(self, prefix: str, limit: int) -> List[int]:
+        ids: List[int] = []
+        # (prefix,) は (prefix, id) や (prefixで始まる文字列, id) より前に並ぶ
+        i = bisect.bisect_left(self._names, (prefix,))
+        while i < len(self._names) and len(ids) < limit:
+            key, id = self._names[i]
+            if not key.startswith(prefix):
+                break
+            ids.append(id)
+            i += 1
+        return ids
+
+class UserNameIndex:
+    """名前からidを引くインデックス
+    UserNameはハッシュ可能なので辞書のキーにでき、名前での検索と重複の確認が定数時間で済む。
+    リポジトリは書き込みの前にcheckで名前の重複を確認し、保存・削除のたびにput/removeでインデックスを更新する。
+    """
+    def __init__(self, users: Iterable[User] = ()):
+        self._ids: Dict[UserName, int] = {user.user_name: user.id for user in users}
+
+    def get(self, user_name: UserName) -> Optional[int]:
+        return self._ids.get(user_name)
+
+    def __iter__(self) -> Iterator[UserName]:
+        return iter(self._ids)
+
+    def check(self, saved: List[User], deleted: List[User]):
+        """削除と保存を反映したときに、同じ名前のユーザーが複数にならないか確認する (インデックスは変更しない)"""
+        deleted_ids = {user.id for user in deleted}
+        # 同じidが複数あれば後のものが保存される
+        final = {user.id: user for user in saved}
+        claimed: Dict[UserName, int] = {}
+        for user in final.values():
+            owner = claimed.get(user.user_name)
+            if owner is None:
+                owner = self._ids.get(user.user_name)
+                # 削除されるユーザーや、保存で名前が変わるユーザーの名前は使える
+                if owner is not None and (owner in deleted_ids or owner in final):
+                    owner = None
+            if owner is not None and owner != user.id:
+                raise Exception(f"{user.user_name} はすでに存在しています")
+            claimed[user.user_name] = user.id
+
+    def put(self, user: User, previous: Optional[User] = None):
+        """userを登録する。previousは同じidで保存済みだったユーザー (名前を変更した場合は古い名前を外す)"""
+        if previous is not None:
+            self.remove(previous)
+        self._ids[user.user_name] = user.id
+
+    def remove(self, user: User):
+        if self._ids.get(user.user_name) == user.id:
+            del self._ids[user.user_name]
+
+    def clear(self):
+        self._ids.clear()
+
+    def copy(self) -> "UserNameIndex":
+        copied = UserNameIndex()
+        copied._ids = dict(self._ids)
+        return copied
+
+class UserStoreSnapshot:
+    """パース済みのデータストアをメモリ上に保持するスナップショット
+    idをキーにした辞書と名前のインデックスを持つので、findとfind_by_nameは辞書の参照だけで済む
+    """
+    def __init__(self, schema: UserStoreSchema, stamp: Optional[StoreStamp]):
+        self.version = schema.id
+        self.stamp = stamp
+        self.users: Dict[int, User] = {user.id: user for user in schema.users}
+        self.names = UserNameIndex(schema.users)
+        # 並び順のインデックスは、最初にlist・search_by_name_prefixを呼んだときに作る
+        self._order: Optional[UserOrderIndex] = None
+
+    def order(self) -> UserOrderIndex:
+        if self._order is None:
+            self._order = UserOrderIndex(self.users.values())
+        return self._order
+
+    def clear(self):
+        self.users.clear()
+        self.names.clear()
+        self._order = None
+
+    def apply(self, saved: List[User], deleted: List[User]) -> bool:
+        """名前の重複を確認してから削除と保存を反映する。変更があればTrue
+        呼び出し元が渡したオブジェクトを変更してもスナップショットが壊れないようにコピーを保持する
+        """
+        self.names.check(saved, deleted)
+        changed = False
+        for user in deleted:
+            removed = self.users.pop(user.id, None)
+            if removed is not None:
+                self.names.remove(removed)
+                if self._order is not None:
+                    self._order.remove(removed)
+                changed = True
+        for user in saved:
+            previous = self.users.pop(user.id, None)
+            self.names.put(user, previous)
+            if self._order is not None:
+                self._order.put(user, previous)
+            self.users[user.id] = user.copy()
+            changed = True
+        return changed
+
+    def to_schema(self) -> UserStoreSchema:
+        # スナップショットのユーザーは検証済みなので、書き込みのたびに全件をバリデーションしない
+        return UserStoreSchema.construct(id=self.version, users=list(self.users.values()))
+
 class UserRepository(IUserRepository):
     """リポジトリ
     データの入出力処理を担当
+
+    パースしたデータストアをスナップショットとして保持し、
+    ファイルがディスク上で変更されたとき (inode・サイズ・更新時刻が変わったとき) だけ読み直す。
+    別の手段でファイルを書き換えた場合は invalidate() でスナップショットを破棄できる。
+
+    同じファイルを複数のプロセスで共有できるように、書き込みは次の手順で行う。
+    1. ロックファイルに排他ロックをかける
+    2. スナップショットを読み込んだ後にバージョンが進んでいたら StoreVersionConflict を投げる (楽観的ロック)
+    3. バージョンを1つ進めて一時ファイルに書き込み、リネームで置き換える
+    同じプロセスのスレッド間では、読み込みと書き込みをロックで直列化するので、1つのインスタンスを共有できる
+    (読み込み・変更の反映・書き込みの途中に、他のスレッドの変更が割り込まない)。
+
+    cache=Falseにすると、読み込みのためにスナップショットを作らず、ファイルを先頭から1件ずつ読んで
+    一致した時点でやめる (store_reader)。一度しか検索しない短命なプロセスや、メモリに載らない大きなデータストア向け。
+
+    name_filter_expected_usersを指定すると、名前のブルームフィルター (name_filter) で
+    「確実に存在しない」と判定できた名前は、データストアを読まずにfind_by_nameがNoneを返す。
+    registerの重複確認のように、ほとんどが存在しない名前の検索になる場合に、cache=Falseの全件の走査や
+    起動直後のパースを省ける。値は想定するユーザー数で、フィルターの大きさを決める。
+    フィルターはデータストアのスタンプと一緒に "<store_path>.names.bloom" に保存し、
+    スタンプが一致しなければ (他のプロセスが書き込んだ場合など) 作り直す。
+    書き込みのたびにはメモリ上のフィルターに名前を追加するだけで、ファイルにはclose()で保存する。
+
+    codecはファイルの形式 (codec.py)。省略するとorjsonがあればOrjsonCodec、なければCompactJsonCodecを使う。
+    ファイルを読んでデバッグしたいときはPrettyJsonCodec (インデント付き) を指定する。どの形式のファイルも読める。
     """
-    def __init__(self, store_path: str):
+    def __init__(
+        self,
+        store_path: str,
+        cache: bool = True,
+        name_filter_expected_users: Optional[int] = None,
+        codec: Optional[IStoreCodec] = None,
+    ):
         self._store_path = store_path
+        self._cache = cache
+        self._codec = codec or default_codec()
+        # スナップショットはその場で変更するので、スナップショットと名前のフィルターを使う処理はこのロックを取得する
+        self._lock = threading.RLock()
+        self._snapshot: Optional[UserStoreSnapshot] = None
+        self._name_filter_expected_users = name_filter_expected_users
+        # name_filter.UserNameBloomFilterと、その作成元のデータストアのスタンプ
+        self._name_filter = None
+        self._name_filter_stamp: Optional[StoreStamp] = None
+        # メモリ上のフィルターに、まだファイルに保存していない名前があればTrue
+        self._name_filter_dirty = False
+        self.name_filter_stats = None
+        if name_filter_expected_users is not None:
+            from name_filter import NameFilterStats
+            self.name_filter_stats = NameFilterStats()
+        # instrumentation.Metrics。設定されていればファイルの読み書きのバイト数とパースの時間を記録する
+        self._metrics = None
+
+    def attach_metrics(self, metrics):
+        self._metrics = metrics
+
+    def _stamp(self) -> Optional[StoreStamp]:
+        return read_stamp(self._store_path)
 
     def _save(self, schema: UserStoreSchema):
-        with open(self._store_path, "w") as writer:
-            writer.write(schema.json(ensure_ascii=False, indent=2))
+        data = self._codec.encode(schema)
+        write_atomically(self._store_path, data)
+        if self._metrics is not None:
+            self._metrics.inc("store_written_bytes_total", len(data))
 
     def _load(self) -> UserStoreSchema:
-        if os.path.exists(self._store_path):
-            return UserStoreSchema.parse_file(self._store_path)
-        return UserStoreSchema(users=[])
+        try:
+            with open(self._store_path, "rb") as reader:
+                data = reader.read()
+        except FileNotFoundError:
+            return UserStoreSchema(users=[])
+        if self._metrics is None:
+            return self._codec.decode(data)
+        start = time.perf_counter()
+        schema = self._codec.decode(data)
+        self._metrics.observe("store_parse_seconds", time.perf_counter() - start)
+        self._metrics.inc("store_read_bytes_total", len(data))
+        return schema
+
+    def _current(self) -> UserStoreSnapshot:
+        """最新のスナップショットを返す。ファイルが変更されていなければパースしない"""
+        stamp = self._stamp()
+        if self._snapshot is None or stamp is None or self._snapshot.stamp != stamp:
+            # スタンプを先に取ってから読み込むので、読み込み中に書き換えられても次回読み直される
+            self._snapshot = UserStoreSnapshot(self._load(), stamp)
+        return self._snapshot
+
+    def _writable(self) -> UserStoreSnapshot:
+        """変更を反映するスナップショット
+        最後に読み込んだスナップショットを読み直さずに使うので、その後に他のプロセスが書き込んでいれば
+        _commitがStoreVersionConflictを投げる (findで読んだユーザーを変更してsaveしても、他の更新を上書きしない)。
+        cache=Falseでは読み込みにスナップショットを使わないので、書き込むときに最新のデータストアを読み込む
+        """
+        if self._cache and self._snapshot is not None:
+            return self._snapshot
+        return self._current()
+
+    def _readable(self) -> Optional[UserStoreSnapshot]:
+        """読み込みに使うスナップショット。cache=Falseで最新のスナップショットがなければNone"""
+        if self._cache:
+            return self._current()
+        stamp = self._stamp()
+        if self._snapshot is not None and stamp is not None and self._snapshot.stamp == stamp:
+            return self._snapshot
+        return None
+
+    def _stream(self) -> Iterator[User]:
+        """スナップショットを作らずに、ファイルからユーザーを1件ずつ読む"""
+        if not os.path.exists(self._store_path):
+            return iter(())
+        # ストリーミングを使わない場合は読み込まない
+        from store_reader import iter_users
+        return iter_users(self._store_path)
+
+    def _commit(self, snapshot: UserStoreSnapshot, saved: Iterable[User] = ()):
+        """スナップショットをファイルに書き出し、自分の書き込みで読み直さないようにスタンプを更新する
+        名前のフィルターが書き込み前のデータストアと一致していれば、savedの名前を追加して新しいスタンプにする
+        (フィルターのファイルはclose()で保存する)
+        """
+        try:
+            with store_lock(self._store_path):
+                previous_stamp = self._stamp()
+                # スタンプが変わっていなければバージョンも変わっていないので、パースせずに済む
+                if previous_stamp != snapshot.stamp and self._load().id != snapshot.version:
+                    raise StoreVersionConflict(f"データストアが他のプロセスによって更新されました ({self._store_path})")
+                snapshot.version += 1
+                self._save(snapshot.to_schema())
+                snapshot.stamp = self._stamp()
+                if self._name_filter is not None and self._name_filter_stamp == previous_stamp:
+                    self._name_filter.add_many(user.user_name for user in saved)
+                    self._name_filter_stamp = snapshot.stamp
+                    self._name_filter_dirty = True
+        except BaseException:
+            # 書き込みに失敗したらメモリ上の変更を捨てて、次回ファイルから読み直す
+            self._snapshot = None
+            self._name_filter = None
+            self._name_filter_dirty = False
+            raise
+        self._snapshot = snapshot
+
+    def _name_filter_path(self) -> str:
+        return self._store_path + ".names.bloom"
+
+    def _fresh_name_filter(self):
+        """データストアと同じスタンプの名前のフィルターを返す
+        メモリ上のフィルターが古ければ保存したフィルターを読み、それも古ければデータストアの全ユーザーから作り直して保存する
+        """
+        stamp = self._stamp()
+        if self._name_filter is not None and self._name_filter_stamp == stamp:
+            return self._name_filter
+        from name_filter import UserNameBloomFilter
+        name_filter = UserNameBloomFilter(self._name_filter_expected_users)
+        stored = self._read_name_filter(stamp)
+        if stored is not None and stored.same_size(name_filter):
+            name_filter = stored
+        elif stamp is not None:
+            stamp = self._build_name_filter(name_filter)
+        self._name_filter = name_filter
+        self._name_filter_stamp = stamp
+        self._name_filter_dirty = False
+        return name_filter
+
+    def _read_name_filter(self, stamp: Optional[StoreStamp]):
+        """保存したフィルターを読む。ない・壊れている・スタンプが一致しない場合はNone"""
+        if stamp is None:
+            return None
+        from name_filter import UserNameBloomFilter
+        try:
+            with open(self._name_filter_path(), "rb") as reader:
+                stored, stored_stamp = UserNameBloomFilter.from_bytes(reader.read())
+        except (OSError, ValueError):
+            return None
+        return stored if stored_stamp == stamp else None
+
+    def _build_name_filter(self, name_filter) -> Optional[StoreStamp]:
+        """データストアの全ユーザーの名前をフィルターに追加して保存し、作成元のスタンプを返す"""
+        if self._cache:
+            snapshot = self._current()
+            stamp = snapshot.stamp
+            name_filter.add_many(snapshot.names)
+        else:
+            # スタンプを先に取ってから読むので、読み込み中に書き換えられても次回作り直される
+            stamp = self._stamp()
+            name_filter.add_many(user.user_name for user in self._stream())
+        if stamp is not None:
+            with store_lock(self._store_path):
+                if self._stamp() == stamp:
+                    write_atomically(self._name_filter_path(), name_filter.to_bytes(stamp))
+        return stamp
+
+    def _persist_name_filter(self):
+        """メモリ上のフィルターがデータストアと同じスタンプなら、ファイルに保存する
+        その後に他のプロセスが書き込んでいれば保存しない (古いフィルターは、次に使うプロセスが作り直す)
+        """
+        if self._name_filter is None or not self._name_filter_dirty:
+            return
+        with store_lock(self._store_path):
+            if self._stamp() == self._name_filter_stamp:
+                write_atomically(self._name_filter_path(), self._name_filter.to_bytes(self._name_filter_stamp))
+        self._name_filter_dirty = False
+
+    def _excluded_by_name_filter(self, user_name: UserName) -> bool:
+        """名前のフィルターで「確実に存在しない」と判定できればTrue (フィルターを使わない場合は常にFalse)"""
+        if self._name_filter_expected_users is None:
+            return False
+        self.name_filter_stats.checks += 1
+        if self._fresh_name_filter().might_contain(user_name):
+            return False
+        self.name_filter_stats.negatives += 1
+        if self._metrics is not None:
+            self._metrics.inc("name_filter_negatives_total")
+        return True
+
+    def _record_name_filter_miss(self):
+        """フィルターが「存在するかもしれない」と判定した名前が存在しなかった (偽陽性)"""
+        if self._name_filter_expected_users is None:
+            return
+        self.name_filter_stats.false_positives += 1
+        if self._metrics is not None:
+            self._metrics.inc("name_filter_false_positives_total")
+
+    def invalidate(self):
+        """スナップショットを破棄し、次回のアクセスでファイルを読み直す"""
+        with self._lock:
+            self._snapshot = None
+            self._name_filter = None
+
+    def warm_up(self):
+        """スナップショットと名前のインデックスを読み込んでおく (最初のリクエストでパースしないように)"""
+        with self._lock:
+            self._current()
+
+    def close(self):
+        """メモリ上の名前のフィルターをファイルに保存する"""
+        with self._lock:
+            self._persist_name_filter()
 
     def clear(self):
-        self._save(UserStoreSchema(users=[]))
+        with self._lock:
+            snapshot = self._current()
+            snapshot.clear()
+            # フィルターからは名前を削除できないので、次に使うときに作り直す
+            self._name_filter = None
+            self._commit(snapshot)
 
     def save(self, user: User) -> User:
-        store = self._load()
-        users = list(filter(lambda e: e.id == user.id, store.users))
-        if len(users) > 0:
-            # update
-            delete_user = users[0]
-            store.users.remove(delete_user)
-        store.users.append(user)
-        self._save(store)
-        return user
+        with self._lock:
+            snapshot = self._writable()
+            snapshot.apply([user], [])
+            self._commit(snapshot, [user])
+            return user
 
     def delete(self, user: User):
-        store = self._load()
-        users = list(filter(lambda e: e.id == user.id, store.users))
-        if len(users) > 0:
-            delete_user = users[0]
-            store.users.remove(delete_user)
-            self._save(store)
+        with self._lock:
+            snapshot = self._writable()
+            if snapshot.apply([], [user]):
+                self._commit(snapshot)
 
     def find_by_name(self, user_name: UserName) -> Optional[User]:
-        for user in self._load().users:
-            if user.user_name == user_name:
-                return user
-        return None
+        with self._lock:
+            if self._excluded_by_name_filter(user_name):
+                return None
+            snapshot = self._readable()
+            if snapshot is None:
+                found = next((user for user in self._stream() if user.user_name == user_name), None)
+            else:
+                id = snapshot.names.get(user_name)
+                found = snapshot.users[id].copy() if id is not None else None
+            if found is None:
+                self._record_name_filter_miss()
+            return found
 
     def find(self, id: int) -> Optional[User]:
-        for user in self._load().users:
-            if user.id == id:
-                return user
-        return None
+        with self._lock:
+            snapshot = self._readable()
+            if snapshot is None:
+                return next((user for user in self._stream() if user.id == id), None)
+            user = snapshot.users.get(id)
+            # UserNameはイミュータブルなので浅いコピーでスナップショットを保護できる
+            return user.copy() if user is not None else None
+
+    def save_many(self, users: List[User]) -> List[User]:
+        with self._lock:
+            snapshot = self._writable()
+            snapshot.apply(users, [])
+            self._commit(snapshot, users)
+            return users
+
+    def delete_many(self, users: List[User]):
+        with self._lock:
+            snapshot = self._writable()
+            if snapshot.apply([], users):
+                self._commit(snapshot)
+
+    def find_many(self, ids: List[int]) -> List[User]:
+        with self._lock:
+            snapshot = self._readable()
+            if snapshot is None:
+                wanted = set(ids)
+                users = {}
+                for user in self._stream():
+                    if user.id in wanted:
+                        users[user.id] = user
+                        if len(users) == len(wanted):
+                            break
+                return [users[id] for id in ids if id in users]
+            found = [snapshot.users.get(id) for id in ids]
+            return [user.copy() for user in found if user is not None]
+
+    def find_many_by_name(self, user_names: List[UserName]) -> List[User]:
+        with self._lock:
+            names = {user_name for user_name in user_names if not self._excluded_by_name_filter(user_name)}
+            if len(names) == 0:
+                return []
+            snapshot = self._readable()
+            if snapshot is None:
+                return [user for user in self._stream() if user.user_name in names]
+            ids = [snapshot.names.get(user_name) for user_name in names]
+            return [snapshot.users[id].copy() for id in ids if id is not None]
+
+    def iter_users(self) -> Iterator[User]:
+        with self._lock:
+            snapshot = self._readable()
+            users = list(snapshot.users.values()) if snapshot is not None else None
+        if users is None:
+            yield from self._stream()
+            return
+        for user in users:
+            yield user.copy()
+
+    def apply_changes(self, saved: List[User], deleted: List[User]):
+        with self._lock:
+            snapshot = self._writable()
+            snapshot.apply(saved, deleted)
+            self._commit(snapshot, saved)
+
+    def list(self, cursor: Optional[int] = None, limit: int = 100) -> List[User]:
+        with self._lock:
+            snapshot = self._readable()
+            if snapshot is None:
+                return page_users(self._stream(), cursor, limit)
+            return [snapshot.users[id].copy() for id in snapshot.order().page(cursor, limit)]
+
+    def search_by_name_prefix(self, prefix: str, limit: int = 100) -> List[User]:
+        with self._lock:
+            snapshot = self._readable()
+            if snapshot is None:
+                return search_users(self._stream(), prefix, limit)
+            return [snapshot.users[id].copy() for id in snapshot.order().search(prefix, limit)]
 
 
 if __name__ == "__main__":
@@ -1,8 +1,26 @@
-from typing import Optional
+import logging
+import os
+import tempfile
+import threading
+import time
+import multiprocessing
+from typing import Optional, List, Iterator
 from entity import User
 from value_object import UserName
-from repository import IUserRepository, UserStoreSchema
+from repository import IUserRepository, UserRepository, UserStoreSchema, StoreVersionConflict, retry_on_conflict, page_users, search_users
+from journal_repository import JournalUserRepository
+from sqlite_repository import SqliteUserRepository
+from store_reader import UserStoreReader, iter_users
+from sharded_repository import ShardedUserRepository, shard_of
+from rebalance_shards import rebalance
+from binary_repository import BinaryUserRepository, json_to_binary, binary_to_json
 from domein_service import UserService
+from id_allocator import BlockIdAllocator
+import circle
+from user_transfer import import_users, export_users
+import memory_repository
+from memory_repository import InMemoryUserRepository
+from codec import available_codecs, get_codec
 
 class InMemoryRepository(IUserRepository):
     """テスト用のインメモリなリポジトリを実装"""
@@ -30,6 +48,61 @@ class InMemoryRepository(IUserRepository):
     def find(self, id: int) -> Optional[User]:
         return None
 
+    def save_many(self, users: List[User]) -> List[User]:
+        ids = {user.id for user in users}
+        self.data.users = [user for user in self.data.users if user.id not in ids] + list(users)
+        return users
+
+    def delete_many(self, users: List[User]):
+        ids = {user.id for user in users}
+        self.data.users = [user for user in self.data.users if user.id not in ids]
+
+    def find_many(self, ids: List[int]) -> List[User]:
+        users = {user.id: user for user in self.data.users}
+        return [users[id] for id in ids if id in users]
+
+    def find_many_by_name(self, user_names: List[UserName]) -> List[User]:
+        return [user for user in self.data.users if user.user_name in user_names]
+
+    def list(self, cursor: Optional[int] = None, limit: int = 100) -> List[User]:
+        return page_users(self.data.users, cursor, limit)
+
+    def search_by_name_prefix(self, prefix: str, limit: int = 100) -> List[User]:
+        return search_users(self.data.users, prefix, limit)
+
+    def apply_changes(self, saved: List[User], deleted: List[User]):
+        self.delete_many(deleted)
+        self.save_many(saved)
+
+    def iter_users(self) -> Iterator[User]:
+        return iter(list(self.data.users))
+
+
+def assert_list_and_search(repository: IUserRepository):
+    """list・search_by_name_prefixの各リポジトリ共通のテスト。保存・名前の変更・削除が反映されることも確認する"""
+    repository.save_many([
+        User(id=i, user_name=UserName(first_name=f"first{i}", last_name="mido" if i % 2 == 1 else "foo")) for i in range(1, 21)
+    ])
+    ids: List[int] = []
+    cursor = None
+    while True:
+        page = repository.list(cursor, 7)
+        if len(page) == 0:
+            break
+        ids += [user.id for user in page]
+        cursor = page[-1].id
+    assert ids == list(range(1, 21))
+    assert [user.id for user in repository.search_by_name_prefix("mido", 3)] == [1, 11, 13]
+    assert [user.id for user in repository.search_by_name_prefix("mido first1", 100)] == [1, 11, 13, 15, 17, 19]
+
+    repository.save(User(id=11, user_name=UserName(first_name="zzz", last_name="foo")))
+    repository.delete(repository.find(13))
+    repository.save(User(id=21, user_name=UserName(first_name="first1x", last_name="mido")))
+    assert [user.id for user in repository.search_by_name_prefix("mido first1", 100)] == [1, 15, 17, 19, 21]
+    assert [user.id for user in repository.search_by_name_prefix("foo zz", 10)] == [11]
+    assert repository.search_by_name_prefix("nobody", 10) == []
+    assert [user.id for user in repository.list(12, 2)] == [14, 15]
+    assert [user.id for user in repository.list(20, 10)] == [21]
 
 
 class UserServiceTest:
@@ -50,9 +123,1017 @@ class UserServiceTest:
         service = UserService(repository)
         assert service.exists(user) == True
 
+    def test_duplicates(self):
+        """バッチ内で重複している名前と、すでに存在する名前を見つける"""
+        repository = InMemoryRepository()
+        repository.save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+        service = UserService(repository)
+        users = [
+            User(id=2, user_name=UserName(first_name="foo", last_name="bar")),
+            User(id=3, user_name=UserName(first_name="kta", last_name="mido")),
+            User(id=4, user_name=UserName(first_name="foo", last_name="bar")),
+        ]
+        assert [user.id for user in service.duplicates(users)] == [3, 4]
+
+
+def register_in_process(store_path: str, start: int, count: int):
+    """別プロセスから同じファイルにユーザーを追加する"""
+    repository = UserRepository(store_path)
+    for i in range(start, start + count):
+        user = User(id=i, user_name=UserName(first_name=f"foo{i}", last_name="bar"))
+        retry_on_conflict(lambda: repository.save(user), retries=100)
+
+
+def allocate_in_process(sequence_path: str, count: int, queue: multiprocessing.Queue):
+    """別プロセスでidを採番する"""
+    allocator = BlockIdAllocator(sequence_path, block_size=7)
+    queue.put([allocator.allocate() for _ in range(count)])
+
+
+class UserRepositoryTest:
+    """ファイルに保存するリポジトリのテストコード"""
+
+    def _store_path(self) -> str:
+        return os.path.join(tempfile.mkdtemp(), "store.json")
+
+    def test_save_and_find(self):
+        """保存したユーザーをidと名前で取得できる"""
+        repository = UserRepository(self._store_path())
+        user = User(id=1, user_name=UserName(first_name="kta", last_name="mido"))
+        repository.save(user)
+        assert repository.find(1) == user
+        assert repository.find_by_name(user.user_name) == user
+        assert repository.find(2) is None
+
+    def test_snapshot_is_not_shared(self):
+        """取得したユーザーを変更してもスナップショットは変わらない"""
+        repository = UserRepository(self._store_path())
+        repository.save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+        user = repository.find(1)
+        user.change_name(UserName(first_name="foo", last_name="bar"))
+        assert repository.find_by_name(UserName(first_name="foo", last_name="bar")) is None
+        assert repository.find(1).user_name == UserName(first_name="kta", last_name="mido")
+
+    def test_reload_when_file_changed(self):
+        """別のリポジトリがファイルを書き換えたら読み直す"""
+        store_path = self._store_path()
+        reader = UserRepository(store_path)
+        writer = UserRepository(store_path)
+        writer.save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+        assert reader.find(1) is not None
+        writer.save(User(id=2, user_name=UserName(first_name="foo", last_name="bar")))
+        assert reader.find(2) is not None
+        writer.delete(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+        assert reader.find(1) is None
+
+    def test_find_does_not_reparse(self):
+        """ファイルが変わらなければ何度検索してもパースは1回だけ"""
+        repository = UserRepository(self._store_path())
+        repository.save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+        repository.invalidate()
+        loads = []
+        load = repository._load
+        repository._load = lambda: loads.append(1) or load()
+        for _ in range(10):
+            repository.find(1)
+            repository.find_by_name(UserName(first_name="kta", last_name="mido"))
+        assert len(loads) == 1
+
+    def test_bulk(self):
+        """まとめて保存・取得・削除できる"""
+        repository = UserRepository(self._store_path())
+        users = [User(id=i, user_name=UserName(first_name=f"foo{i}", last_name="bar")) for i in range(10)]
+        repository.save_many(users)
+        assert [user.id for user in repository.find_many([3, 100, 1])] == [3, 1]
+        names = [UserName(first_name="foo2", last_name="bar"), UserName(first_name="none", last_name="bar")]
+        assert [user.id for user in repository.find_many_by_name(names)] == [2]
+        repository.delete_many(users[:5])
+        assert [user.id for user in repository.find_many(list(range(10)))] == [5, 6, 7, 8, 9]
+
+    def test_version_conflict(self):
+        """読み込んだ後に他のリポジトリが書き込んでいたら、上書きせずにエラーにする"""
+        store_path = self._store_path()
+        repository1 = UserRepository(store_path)
+        repository2 = UserRepository(store_path)
+        repository1.save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+        # 2つのリポジトリが同じユーザーを読み込んで変更する
+        user1 = repository1.find(1)
+        user2 = repository2.find(1)
+        user2.change_name(UserName(first_name="foo", last_name="bar"))
+        repository2.save(user2)
+        user1.change_name(UserName(first_name="keita", last_name="midorikawa"))
+        try:
+            repository1.save(user1)
+            assert False
+        except StoreVersionConflict:
+            pass
+        assert UserRepository(store_path).find(1).user_name == UserName(first_name="foo", last_name="bar")
+        # 読み直してから変更すれば、最新の状態に対して書き込める
+        user1 = repository1.find(1)
+        user1.change_name(UserName(first_name="keita", last_name="midorikawa"))
+        repository1.save(user1)
+        assert repository2.find(1).user_name == UserName(first_name="keita", last_name="midorikawa")
+        # retry_on_conflictは失敗したら読み直して再実行する
+        repository2.save(User(id=2, user_name=UserName(first_name="foo", last_name="bar")))
+        retry_on_conflict(lambda: repository1.save(User(id=3, user_name=UserName(first_name="hoge", last_name="piyo"))))
+        assert len(repository2.find_many([1, 2, 3])) == 3
+
+    def test_multi_process_writes(self):
+        """複数のプロセスから書き込んでも更新が失われない"""
+        store_path = self._store_path()
+        processes = [
+            multiprocessing.Process(target=register_in_process, args=(store_path, n * 20, 20))
+            for n in range(4)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        assert len(UserRepository(store_path).find_many(list(range(80)))) == 80
+
+    def test_streaming_without_cache(self):
+        """cache=Falseならスナップショットを作らずにファイルを読んで検索する"""
+        store_path = self._store_path()
+        users = [User(id=i, user_name=UserName(first_name=f"foo{i}", last_name="bar")) for i in range(100)]
+        UserRepository(store_path).save_many(users)
+        repository = UserRepository(store_path, cache=False)
+        assert repository.find(50) == users[50]
+        assert repository.find(100) is None
+        assert repository.find_by_name(UserName(first_name="foo7", last_name="bar")).id == 7
+        assert [user.id for user in repository.find_many([3, 1, 200])] == [3, 1]
+        assert len(list(repository.iter_users())) == 100
+        assert repository._snapshot is None
+
+    def test_invalidate(self):
+        """invalidateするとファイルを読み直す"""
+        repository = UserRepository(self._store_path())
+        repository.save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+        repository.find(1)
+        repository.invalidate()
+        assert repository.find(1) is not None
+
+    def test_trusted_load(self):
+        """バリデーションを省いて読み込んだユーザーも、通常のモデルと同じように扱える"""
+        store_path = self._store_path()
+        UserRepository(store_path).save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+        user = UserRepository(store_path).find(1)
+        assert user == User(id=1, user_name=UserName(first_name="kta", last_name="mido"))
+        assert user.user_name == UserName(first_name="kta", last_name="mido")
+        assert user.dict() == UserStoreSchema.parse_file(store_path).users[0].dict()
+        user.change_name(UserName(first_name="keita", last_name="midorikawa"))
+        assert user.copy().user_name.first_name == "keita"
+
+    def test_unique_name(self):
+        """同じ名前の別のユーザーは保存できず、名前を変更したら古い名前は使える"""
+        assert len({UserName(first_name="kta", last_name="mido"), UserName(first_name="kta", last_name="mido")}) == 1
+        repository = UserRepository(self._store_path())
+        user = User(id=1, user_name=UserName(first_name="kta", last_name="mido"))
+        repository.save(user)
+        try:
+            repository.save(User(id=2, user_name=UserName(first_name="kta", last_name="mido")))
+            assert False
+        except Exception as e:
+            assert "すでに存在しています" in str(e)
+        assert repository.find(2) is None
+        user.change_name(UserName(first_name="keita", last_name="midorikawa"))
+        repository.save(user)
+        repository.save(User(id=2, user_name=UserName(first_name="kta", last_name="mido")))
+        assert repository.find_by_name(UserName(first_name="kta", last_name="mido")).id == 2
+        assert repository.find_by_name(UserName(first_name="keita", last_name="midorikawa")).id == 1
+        # 削除と保存を同時に反映すれば、削除したユーザーの名前を使える
+        repository.apply_changes([User(id=3, user_name=UserName(first_name="kta", last_name="mido"))], [repository.find(2)])
+        assert repository.find_by_name(UserName(first_name="kta", last_name="mido")).id == 3
+
+    def test_list_and_search(self):
+        """並び順のインデックスでページと前方一致検索を返す。cache=Falseならファイルを走査して同じ結果を返す"""
+        assert_list_and_search(UserRepository(self._store_path()))
+        assert_list_and_search(UserRepository(self._store_path(), cache=False))
+
+    def test_codecs(self):
+        """どのコーデックで書いたファイルも、他のコーデックとストリーミングで読める。compactはprettyより小さい"""
+        users = [User(id=i, user_name=UserName(first_name=f"けいた{i}", last_name="mido")) for i in range(50)]
+        sizes = {}
+        for name, codec in available_codecs().items():
+            store_path = self._store_path()
+            UserRepository(store_path, codec=codec).save_many(users)
+            sizes[name] = os.path.getsize(store_path)
+            for other in available_codecs().values():
+                assert UserRepository(store_path, codec=other).find_many(list(range(50))) == users
+            assert UserRepository(store_path, cache=False).find_by_name(UserName(first_name="けいた7", last_name="mido")).id == 7
+            assert UserStoreSchema.parse_file(store_path).users == users
+        assert sizes["compact"] < sizes["pretty"]
+        try:
+            get_codec("unknown")
+            assert False
+        except Exception as e:
+            assert "コーデックが使えません" in str(e)
+
+    def test_name_filter(self):
+        """名前のフィルターで存在しないと判定した名前は、データストアを読まずにNoneを返す"""
+        store_path = self._store_path()
+        repository = UserRepository(store_path, name_filter_expected_users=1000)
+        repository.save_many([User(id=i, user_name=UserName(first_name=f"user{i}", last_name="test")) for i in range(1, 101)])
+        assert repository.find_by_name(UserName(first_name="user1", last_name="test")).id == 1
+        assert repository.find_by_name(UserName(first_name="kta", last_name="mido")) is None
+        assert repository.name_filter_stats.negatives + repository.name_filter_stats.false_positives == 1
+
+        # 保存したフィルターを読み込むので、存在しない名前の検索ではデータストアを読まない
+        streaming = UserRepository(store_path, cache=False, name_filter_expected_users=1000)
+        def fail():
+            raise AssertionError("データストアを読みました")
+        streaming._stream = fail
+        for i in range(100):
+            assert streaming.find_by_name(UserName(first_name=f"missing{i}", last_name="test")) is None
+        assert streaming.name_filter_stats.negatives > 90
+        assert streaming.find_many_by_name([UserName(first_name="missing0", last_name="test")]) == []
+
+        # 書き込みではフィルターのファイルを書き直さず、close()で保存する
+        filter_path = store_path + ".names.bloom"
+        with open(filter_path, "rb") as reader:
+            stored = reader.read()
+        repository.save(User(id=101, user_name=UserName(first_name="hoge", last_name="piyo")))
+        assert repository.find_by_name(UserName(first_name="hoge", last_name="piyo")).id == 101
+        with open(filter_path, "rb") as reader:
+            assert reader.read() == stored
+        repository.close()
+        reopened = UserRepository(store_path, cache=False, name_filter_expected_users=1000)
+        reopened._stream = fail
+        assert reopened.find_by_name(UserName(first_name="missing0", last_name="test")) is None
+
+        # 他のインスタンスが書き込んだ名前はフィルターを作り直して見つける
+        UserRepository(store_path).save(User(id=200, user_name=UserName(first_name="kta", last_name="mido")))
+        assert repository.find_by_name(UserName(first_name="kta", last_name="mido")).id == 200
+
+        # 削除した名前はフィルターに残るので、偽陽性として数える
+        repository.delete(repository.find(1))
+        assert repository.find_by_name(UserName(first_name="user1", last_name="test")) is None
+        assert repository.name_filter_stats.false_positives >= 1
+        assert 0 < repository.name_filter_stats.false_positive_rate() <= 1
+
+
+class JournalUserRepositoryTest:
+    """ジャーナルに追記するリポジトリのテストコード"""
+
+    def test_list_and_search(self):
+        """並び順のインデックスでページと前方一致検索を返す。再起動後も同じ結果になる"""
+        store_dir = tempfile.mkdtemp()
+        repository = JournalUserRepository(store_dir)
+        assert_list_and_search(repository)
+        repository.close()
+        repository = JournalUserRepository(store_dir)
+        assert [user.id for user in repository.search_by_name_prefix("mido first1", 100)] == [1, 15, 17, 19, 21]
+        repository.close()
+
+    def test_recover_after_restart(self):
+        """再起動してもジャーナルを再生して同じ状態に戻る"""
+        store_dir = tempfile.mkdtemp()
+        repository = JournalUserRepository(store_dir)
+        repository.save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+        repository.save(User(id=2, user_name=UserName(first_name="foo", last_name="bar")))
+        repository.save(User(id=1, user_name=UserName(first_name="keita", last_name="midorikawa")))
+        repository.delete(User(id=2, user_name=UserName(first_name="foo", last_name="bar")))
+        repository.close()
+
+        repository = JournalUserRepository(store_dir)
+        assert repository.find(1).user_name == UserName(first_name="keita", last_name="midorikawa")
+        assert repository.find(2) is None
+        repository.close()
+
+    def test_bulk(self):
+        """まとめて保存・削除したものも再起動後に復元される"""
+        store_dir = tempfile.mkdtemp()
+        repository = JournalUserRepository(store_dir)
+        users = [User(id=i, user_name=UserName(first_name=f"foo{i}", last_name="bar")) for i in range(10)]
+        repository.save_many(users)
+        repository.delete_many(users[:5])
+        repository.close()
+
+        repository = JournalUserRepository(store_dir)
+        assert [user.id for user in repository.find_many(list(range(10)))] == [5, 6, 7, 8, 9]
+        names = [UserName(first_name="foo7", last_name="bar")]
+        assert [user.id for user in repository.find_many_by_name(names)] == [7]
+        repository.close()
+
+    def test_compaction(self):
+        """コンパクション後もチェックポイントとジャーナルから同じ状態に戻る"""
+        store_dir = tempfile.mkdtemp()
+        repository = JournalUserRepository(store_dir, compact_threshold=512)
+        for i in range(50):
+            repository.save(User(id=i, user_name=UserName(first_name=f"foo{i}", last_name="bar")))
+        repository.compact()
+        repository.delete(User(id=0, user_name=UserName(first_name="foo0", last_name="bar")))
+        repository.close()
+        assert len(os.listdir(store_dir)) <= 3
+
+        repository = JournalUserRepository(store_dir)
+        assert repository.find(0) is None
+        assert repository.find(49).user_name == UserName(first_name="foo49", last_name="bar")
+        repository.close()
+
+    def test_discard_incomplete_record(self):
+        """書き込み途中の末尾のレコードは捨てて復元する"""
+        store_dir = tempfile.mkdtemp()
+        repository = JournalUserRepository(store_dir)
+        repository.save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+        repository.close()
+        journal = [name for name in os.listdir(store_dir) if name.endswith(".log")][0]
+        with open(os.path.join(store_dir, journal), "a") as writer:
+            writer.write('{"op": "save", "user": {"id": 2')
+
+        repository = JournalUserRepository(store_dir)
+        assert repository.find(2) is None
+        repository.save(User(id=3, user_name=UserName(first_name="foo", last_name="bar")))
+        repository.close()
+        repository = JournalUserRepository(store_dir)
+        assert repository.find(1) is not None
+        assert repository.find(3) is not None
+        repository.close()
+
+    def test_unique_name(self):
+        """同じ名前の別のユーザーはジャーナルに追記されない"""
+        store_dir = tempfile.mkdtemp()
+        repository = JournalUserRepository(store_dir)
+        repository.save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+        try:
+            repository.save_many([
+                User(id=2, user_name=UserName(first_name="foo", last_name="bar")),
+                User(id=3, user_name=UserName(first_name="foo", last_name="bar")),
+            ])
+            assert False
+        except Exception as e:
+            assert "すでに存在しています" in str(e)
+        repository.close()
+        repository = JournalUserRepository(store_dir)
+        assert repository.find(2) is None
+        assert repository.find_by_name(UserName(first_name="kta", last_name="mido")).id == 1
+        repository.close()
+
+
+class SqliteUserRepositoryTest:
+    """SQLiteのリポジトリのテストコード"""
+
+    def _repository(self) -> SqliteUserRepository:
+        return SqliteUserRepository(os.path.join(tempfile.mkdtemp(), "store.sqlite3"))
+
+    def test_list_and_search(self):
+        """主キーと名前の式インデックスでページと前方一致検索を返す"""
+        repository = self._repository()
+        assert_list_and_search(repository)
+        repository.close()
+
+    def test_save_and_find(self):
+        """保存・更新・削除したユーザーをidと名前で取得できる"""
+        repository = self._repository()
+        repository.save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+        repository.save(User(id=1, user_name=UserName(first_name="keita", last_name="midorikawa")))
+        assert repository.find(1).user_name == UserName(first_name="keita", last_name="midorikawa")
+        assert repository.find_by_name(UserName(first_name="keita", last_name="midorikawa")).id == 1
+        assert repository.find_by_name(UserName(first_name="kta", last_name="mido")) is None
+        repository.delete(User(id=1, user_name=UserName(first_name="keita", last_name="midorikawa")))
+        assert repository.find(1) is None
+        repository.close()
+
+    def test_bulk(self):
+        """まとめて保存・取得・削除できる"""
+        repository = self._repository()
+        users = [User(id=i, user_name=UserName(first_name=f"foo{i}", last_name="bar")) for i in range(1000)]
+        repository.save_many(users)
+        assert [user.id for user in repository.find_many([3, 1000, 1])] == [3, 1]
+        assert len(repository.find_many(list(range(1000)))) == 1000
+        names = [UserName(first_name="foo2", last_name="bar"), UserName(first_name="none", last_name="bar")]
+        assert [user.id for user in repository.find_many_by_name(names)] == [2]
+        repository.delete_many(users[:500])
+        assert len(repository.find_many(list(range(1000)))) == 500
+        repository.close()
+
+    def test_unique_name(self):
+        """同じ名前のユーザーは保存できない"""
+        repository = self._repository()
+        repository.save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+        try:
+            repository.save(User(id=2, user_name=UserName(first_name="kta", last_name="mido")))
+            assert False
+        except Exception as e:
+            assert "すでに存在しています" in str(e)
+        assert repository.find(2) is None
+        repository.close()
+
+    def test_iter_users_returns_connections(self):
+        """走査の途中でも接続を返却するので、プールの大きさ以上の走査を開いたまま検索できる"""
+        repository = SqliteUserRepository(os.path.join(tempfile.mkdtemp(), "store.sqlite3"), pool_size=2, pool_timeout=1.0)
+        repository.save_many([User(id=i, user_name=UserName(first_name=f"foo{i}", last_name="bar")) for i in range(1200)])
+        iterators = [repository.iter_users() for _ in range(4)]
+        for iterator in iterators:
+            next(iterator)
+        assert repository.find(7) is not None
+        assert sorted(user.id for user in iterators[0]) == list(range(1, 1200))
+        repository.close()
+
+    def test_pool_timeout(self):
+        """接続を借りられなければ、待ち続けずに例外を投げる"""
+        repository = SqliteUserRepository(os.path.join(tempfile.mkdtemp(), "store.sqlite3"), pool_size=1, pool_timeout=0.1)
+        with repository._connection():
+            try:
+                repository.find(1)
+                assert False
+            except Exception as e:
+                assert "接続プール" in str(e)
+        assert repository.find(1) is None
+        repository.close()
+
+    def test_concurrent_save(self):
+        """複数のスレッドから同時に保存できる"""
+        repository = self._repository()
+
+        def register(start: int):
+            for i in range(start, start + 50):
+                repository.save(User(id=i, user_name=UserName(first_name=f"foo{i}", last_name="bar")))
+
+        threads = [threading.Thread(target=register, args=(n * 50,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert all(repository.find(i) is not None for i in range(400))
+        repository.close()
+
+
+class UserStoreReaderTest:
+    """ストリーミングリーダーのテストコード"""
+
+    def test_same_as_parse_file(self):
+        """バッファの大きさによらず、parse_fileと同じユーザーを同じ順に返す"""
+        store_path = os.path.join(tempfile.mkdtemp(), "store.json")
+        repository = UserRepository(store_path)
+        repository.save_many([User(id=i, user_name=UserName(first_name=f"名前{i}", last_name="bar")) for i in range(50)])
+        expected = UserStoreSchema.parse_file(store_path).users
+        for buffer_size in [1, 7, 64, 4096]:
+            users = list(iter_users(store_path, buffer_size))
+            assert [user.dict() for user in users] == [user.dict() for user in expected]
+
+    def test_stop_at_first_match(self):
+        """見つかった時点で読むのをやめる"""
+        store_path = os.path.join(tempfile.mkdtemp(), "store.json")
+        UserRepository(store_path).save_many(
+            [User(id=i, user_name=UserName(first_name=f"foo{i}", last_name="bar")) for i in range(1000)]
+        )
+        with open(store_path, encoding="utf-8") as reader:
+            for record in UserStoreReader(reader, buffer_size=256).records():
+                if record["id"] == 1:
+                    break
+            assert reader.tell() < os.path.getsize(store_path) // 10
+
+
+class ShardedUserRepositoryTest:
+    """シャーディングしたリポジトリのテストコード"""
+
+    def test_list_and_search(self):
+        """各シャードの結果をマージして、全体の順序でページと前方一致検索を返す"""
+        repository = ShardedUserRepository(tempfile.mkdtemp(), shard_count=3, max_workers=1)
+        assert_list_and_search(repository)
+        repository.close()
+
+    def test_save_and_find(self):
+        """各ユーザーは1つのシャードにだけ保存され、idと名前で取得でき、全件を走査できる"""
+        store_dir = tempfile.mkdtemp()
+        repository = ShardedUserRepository(store_dir, shard_count=4, max_workers=2)
+        users = [User(id=i, user_name=UserName(first_name=f"foo{i}", last_name="bar")) for i in range(100)]
+        repository.save_many(users)
+        repository.save(User(id=100, user_name=UserName(first_name="kta", last_name="mido")))
+        assert repository.find(100).user_name == UserName(first_name="kta", last_name="mido")
+        assert repository.find_by_name(UserName(first_name="foo42", last_name="bar")).id == 42
+        assert repository.find_by_name(UserName(first_name="none", last_name="bar")) is None
+        repository.delete_many(users[:10])
+        assert [user.id for user in repository.find_many([5, 50, 100])] == [50, 100]
+        total = sum(len(UserStoreSchema.parse_file(os.path.join(store_dir, name)).users)
+                    for name in os.listdir(store_dir) if name.startswith("shard-") and name.endswith(".json"))
+        assert total == 91
+        # 全件の走査は各シャードのファイルをプロセスプールで並列にパースする
+        assert sorted(user.id for user in repository.iter_users()) == list(range(10, 101))
+        assert repository._executor is not None
+        repository.close()
+
+    def test_unique_name_across_shards(self):
+        """別のシャードに同じ名前のユーザーがいれば保存できない。名前の検索はシャードのファイルを走査しない"""
+        repository = ShardedUserRepository(tempfile.mkdtemp(), shard_count=4, max_workers=1)
+        # id=1と2は別のシャードに入る
+        assert shard_of(1, 4) != shard_of(2, 4)
+        repository.save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+        for save in [
+            lambda: repository.save(User(id=2, user_name=UserName(first_name="kta", last_name="mido"))),
+            lambda: repository.save_many([User(id=2, user_name=UserName(first_name="kta", last_name="mido"))]),
+        ]:
+            try:
+                save()
+                assert False
+            except Exception as e:
+                assert "すでに存在しています" in str(e)
+        assert repository.find(2) is None
+        # 別のシャードのユーザーの名前を変更すれば、古い名前は使える
+        repository.apply_changes([
+            User(id=1, user_name=UserName(first_name="keita", last_name="midorikawa")),
+            User(id=2, user_name=UserName(first_name="kta", last_name="mido")),
+        ], [])
+        assert repository.find_by_name(UserName(first_name="kta", last_name="mido")).id == 2
+        assert repository._executor is None
+        repository.close()
+
+    def test_shard_count_mismatch(self):
+        """保存済みのシャード数と異なる数では開けない"""
+        store_dir = tempfile.mkdtemp()
+        ShardedUserRepository(store_dir, shard_count=4).close()
+        try:
+            ShardedUserRepository(store_dir, shard_count=8)
+            assert False
+        except Exception as e:
+            assert "シャード数が一致しません" in str(e)
+
+    def test_rebalance(self):
+        """再配置してもすべてのユーザーを取得できる"""
+        store_dir = tempfile.mkdtemp()
+        repository = ShardedUserRepository(store_dir, shard_count=3)
+        repository.save_many([User(id=i, user_name=UserName(first_name=f"foo{i}", last_name="bar")) for i in range(100)])
+        repository.close()
+        assert rebalance(store_dir, 5) == sum(1 for i in range(100) if shard_of(i, 3) != shard_of(i, 5))
+
+        repository = ShardedUserRepository(store_dir)
+        assert repository.shard_count == 5
+        assert len(repository.find_many(list(range(100)))) == 100
+        assert sorted(user.id for user in repository.iter_users()) == list(range(100))
+        repository.close()
+
+class BinaryUserRepositoryTest:
+    """バイナリ形式のリポジトリのテストコード"""
+
+    def test_list_and_search(self):
+        """ファイルのidのインデックスでページを返し、名前の並び順のインデックスで前方一致検索を返す"""
+        repository = BinaryUserRepository(os.path.join(tempfile.mkdtemp(), "store.bin"))
+        assert_list_and_search(repository)
+        repository.close()
+
+    def test_save_and_find(self):
+        """保存・更新・削除したユーザーをidと名前で取得できる"""
+        repository = BinaryUserRepository(os.path.join(tempfile.mkdtemp(), "store.bin"))
+        assert repository.find(1) is None
+        repository.save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+        repository.save(User(id=1, user_name=UserName(first_name="けいた", last_name="みどりかわ")))
+        assert repository.find(1).user_name == UserName(first_name="けいた", last_name="みどりかわ")
+        assert repository.find_by_name(UserName(first_name="けいた", last_name="みどりかわ")).id == 1
+        repository.delete(repository.find(1))
+        assert repository.find(1) is None
+        repository.close()
+
+    def test_bulk(self):
+        """まとめて保存・取得・削除できる"""
+        repository = BinaryUserRepository(os.path.join(tempfile.mkdtemp(), "store.bin"))
+        users = [User(id=i, user_name=UserName(first_name=f"foo{i}", last_name="bar")) for i in range(1000)]
+        repository.save_many(list(reversed(users)))
+        assert [user.id for user in repository.find_many([3, 1000, 1])] == [3, 1]
+        assert [user.id for user in repository.iter_users()] == list(range(1000))
+        repository.apply_changes([User(id=1000, user_name=UserName(first_name="kta", last_name="mido"))], users[:500])
+        assert len(repository.find_many(list(range(1001)))) == 501
+        repository.close()
+
+    def test_reopen_when_file_replaced(self):
+        """他のインスタンスが書き込んだら開き直して最新の内容を読む"""
+        store_path = os.path.join(tempfile.mkdtemp(), "store.bin")
+        first = BinaryUserRepository(store_path)
+        second = BinaryUserRepository(store_path)
+        first.save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+        assert second.find(1) is not None
+        second.save(User(id=2, user_name=UserName(first_name="foo", last_name="bar")))
+        assert first.find(2) is not None
+        assert len(first.find_many([1, 2])) == 2
+        first.close()
+        second.close()
+
+    def test_convert(self):
+        """store.jsonとバイナリ形式を相互に変換できる"""
+        store_dir = tempfile.mkdtemp()
+        json_path = os.path.join(store_dir, "store.json")
+        users = [User(id=i, user_name=UserName(first_name=f"foo{i}", last_name="bar")) for i in range(100)]
+        UserRepository(json_path).save_many(users)
+        json_to_binary(json_path, os.path.join(store_dir, "store.bin"))
+        assert BinaryUserRepository(os.path.join(store_dir, "store.bin")).find(42) == users[42]
+        binary_to_json(os.path.join(store_dir, "store.bin"), os.path.join(store_dir, "converted.json"))
+        assert UserStoreSchema.parse_file(os.path.join(store_dir, "converted.json")).users == users
+
+    def test_unique_name(self):
+        """同じ名前の別のユーザーは保存できない"""
+        repository = BinaryUserRepository(os.path.join(tempfile.mkdtemp(), "store.bin"))
+        repository.save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+        try:
+            repository.save(User(id=2, user_name=UserName(first_name="kta", last_name="mido")))
+            assert False
+        except Exception as e:
+            assert "すでに存在しています" in str(e)
+        assert repository.find(2) is None
+        repository.close()
+
+    def test_unique_name_in_first_write(self):
+        """データストアがないときやclearの直後でも、同じ名前のユーザーをまとめて保存できない"""
+        repository = BinaryUserRepository(os.path.join(tempfile.mkdtemp(), "store.bin"))
+        duplicated = [
+            User(id=1, user_name=UserName(first_name="kta", last_name="mido")),
+            User(id=2, user_name=UserName(first_name="kta", last_name="mido")),
+        ]
+        for prepare in [lambda: None, repository.clear]:
+            prepare()
+            try:
+                repository.save_many(duplicated)
+                assert False
+            except Exception as e:
+                assert "すでに存在しています" in str(e)
+            assert repository.find_many([1, 2]) == []
+        repository.close()
+
+class BlockIdAllocatorTest:
+    """ブロック単位の採番のテストコード"""
+
+    def _sequence_path(self) -> str:
+        return os.path.join(tempfile.mkdtemp(), "store.json.sequence")
+
+    def test_restart(self):
+        """再起動しても採番済みのidは払い出さない"""
+        sequence_path = self._sequence_path()
+        allocator = BlockIdAllocator(sequence_path, block_size=10)
+        assert [allocator.allocate() for _ in range(3)] == [1, 2, 3]
+        allocator = BlockIdAllocator(sequence_path, block_size=10)
+        assert allocator.allocate() == 11
+        assert BlockIdAllocator(self._sequence_path(), minimum=100).allocate() == 100
+
+    def test_threads(self):
+        """複数のスレッドから採番しても重複しない"""
+        allocator = BlockIdAllocator(self._sequence_path(), block_size=5)
+        ids: List[int] = []
+
+        def allocate():
+            for _ in range(100):
+                ids.append(allocator.allocate())
+
+        threads = [threading.Thread(target=allocate) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(set(ids)) == 800
+
+    def test_processes(self):
+        """複数のプロセスから採番しても重複しない"""
+        sequence_path = self._sequence_path()
+        queue = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=allocate_in_process, args=(sequence_path, 50, queue)) for _ in range(4)]
+        for process in processes:
+            process.start()
+        ids = [id for _ in processes for id in queue.get()]
+        for process in processes:
+            process.join()
+        assert len(set(ids)) == 200
+
+
+class CircleRepositoryTest:
+    """サークルのリポジトリのテストコード"""
+
+    def test_join(self):
+        """参加済みのユーザーと定員を超える参加を拒否する。join_manyは1人でも参加できなければ誰も参加しない"""
+        c = circle.Circle(id=1)
+        c.join(circle.User(id=1, user_name="foo"))
+        assert c.is_member(1) and not c.is_member(2)
+        try:
+            c.join(circle.User(id=1, user_name="foo"))
+            assert False
+        except Exception as e:
+            assert "すでにサークルのメンバーです" in str(e)
+        users = [circle.User(id=i, user_name=f"user{i}") for i in range(2, circle.Circle.MAX_MEMBERS + 2)]
+        try:
+            c.join_many(users)
+            assert False
+        except Exception as e:
+            assert "定員" in str(e)
+        assert len(c.members) == 1
+        c.join_many(users[:-1])
+        assert c.is_full() and len(c.members) == circle.Circle.MAX_MEMBERS
+
+    def test_find_by_member(self):
+        """逆引きのインデックスで、ユーザーが参加しているサークルを引ける。更新・削除・他のインスタンスの書き込みも反映される"""
+        store_path = os.path.join(tempfile.mkdtemp(), "circles.json")
+        repository = circle.CircleRepository(store_path)
+        foo = circle.User(id=1, user_name="foo")
+        bar = circle.User(id=2, user_name="bar")
+        repository.save_many([circle.Circle(id=1, members=[foo]), circle.Circle(id=2, members=[foo, bar])])
+        assert [c.id for c in repository.find_by_member(1)] == [1, 2]
+        assert repository.is_member(2, 2) and not repository.is_member(1, 2)
+
+        # 取得したサークルを変更しても、保存するまでインデックスは変わらない
+        c = repository.find(2)
+        c.leave(foo)
+        assert repository.is_member(2, 1)
+        repository.save(c)
+        assert [c.id for c in repository.find_by_member(1)] == [1]
+
+        # 別のインスタンスの書き込みはファイルから読み直す
+        circle.join_many(circle.CircleRepository(store_path), 1, [bar])
+        assert [c.id for c in repository.find_by_member(2)] == [1, 2]
+        repository.delete(repository.find(1))
+        assert [c.id for c in repository.find_by_member(2)] == [2]
+        assert repository.find_by_member(1) == []
+        assert circle.CircleRepository(store_path).find(2).member_ids() == {2}
+
+    def test_version_conflict(self):
+        """読み込んだ後に他のインスタンスが書き込んでいれば、読み直して上書きせずにStoreVersionConflictを投げる"""
+        store_path = os.path.join(tempfile.mkdtemp(), "circles.json")
+        circle.CircleRepository(store_path).save(circle.Circle(id=1))
+        first = circle.CircleRepository(store_path)
+        second = circle.CircleRepository(store_path)
+        first_circle = first.find(1)
+        second_circle = second.find(1)
+        first_circle.join(circle.User(id=1, user_name="foo"))
+        first.save(first_circle)
+        second_circle.join(circle.User(id=2, user_name="bar"))
+        try:
+            second.save(second_circle)
+            assert False
+        except StoreVersionConflict:
+            pass
+        assert circle.CircleRepository(store_path).find(1).member_ids() == {1}
+
+        # 失敗した後はファイルから読み直すので、取得し直せば保存できる
+        circle.join_many(second, 1, [circle.User(id=2, user_name="bar")])
+        assert circle.CircleRepository(store_path).find(1).member_ids() == {1, 2}
+
+
+class InMemoryUserRepositoryTest:
+    """インメモリのリポジトリのテストコード"""
+
+    def test_save_and_find(self):
+        """保存・更新・削除したユーザーをidと名前で取得でき、同じ名前の別のユーザーは保存できない"""
+        repository = InMemoryUserRepository()
+        repository.save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+        user = repository.find(1)
+        user.change_name(UserName(first_name="keita", last_name="midorikawa"))
+        assert repository.find(1).user_name == UserName(first_name="kta", last_name="mido")
+        repository.save(user)
+        assert repository.find_by_name(UserName(first_name="keita", last_name="midorikawa")).id == 1
+        assert repository.find_by_name(UserName(first_name="kta", last_name="mido")) is None
+        try:
+            repository.save(User(id=2, user_name=UserName(first_name="keita", last_name="midorikawa")))
+            assert False
+        except Exception as e:
+            assert "すでに存在しています" in str(e)
+        repository.delete(user)
+        assert repository.find(1) is None
+        assert_list_and_search(repository)
+
+    def test_readers_see_consistent_snapshots(self):
+        """書き込み中も、読み込みはロックを取らずに名前とidが一致した状態を読める"""
+        repository = InMemoryUserRepository()
+        repository.save(User(id=1, user_name=UserName(first_name="user0", last_name="test")))
+        errors = []
+        done = threading.Event()
+
+        def read():
+            while not done.is_set():
+                users = list(repository.iter_users())
+                if len(users) != 1:
+                    errors.append(len(users))
+                user = users[0]
+                found = repository.find_by_name(user.user_name)
+                if found is not None and found.id != 1:
+                    errors.append(found.id)
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for reader in readers:
+            reader.start()
+        for i in range(1, 300):
+            repository.save(User(id=1, user_name=UserName(first_name=f"user{i}", last_name="test")))
+        done.set()
+        for reader in readers:
+            reader.join()
+        assert errors == []
+
+    def test_flush_to_backend(self):
+        """変更をまとめてbackendに書き込み、書き込めなかった変更は次のflushで書き込む"""
+        store_path = os.path.join(tempfile.mkdtemp(), "store.json")
+        backend = UserRepository(store_path)
+        backend.save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+        repository = InMemoryUserRepository(backend)
+        assert repository.find(1) is not None
+        repository.save(User(id=2, user_name=UserName(first_name="foo", last_name="bar")))
+        repository.delete(repository.find(1))
+        assert UserRepository(store_path).find(2) is None
+
+        writes = []
+        apply_changes = backend.apply_changes
+        def failing_apply_changes(saved, deleted):
+            writes.append((len(saved), len(deleted)))
+            if len(writes) == 1:
+                raise Exception("書き込みに失敗しました")
+            apply_changes(saved, deleted)
+        backend.apply_changes = failing_apply_changes
+        try:
+            repository.flush()
+            assert False
+        except Exception as e:
+            assert "失敗" in str(e)
+        repository.flush()
+        assert writes == [(1, 1), (1, 1)]
+        assert UserRepository(store_path).find(1) is None
+        assert UserRepository(store_path).find(2) is not None
+
+        # 定期的なflushとclose
+        repository = InMemoryUserRepository(UserRepository(store_path), flush_interval=0.01)
+        repository.save(User(id=3, user_name=UserName(first_name="hoge", last_name="piyo")))
+        repository.close()
+        assert UserRepository(store_path).find(3) is not None
+
+    def test_periodic_flush_error(self):
+        """バックグラウンドのflushの失敗はログに出し、次のcloseで例外を投げる。変更は次の周期で書き込む"""
+        store_path = os.path.join(tempfile.mkdtemp(), "store.json")
+        backend = UserRepository(store_path)
+        apply_changes = backend.apply_changes
+        failed = threading.Event()
+        def failing_apply_changes(saved, deleted):
+            if not failed.is_set():
+                failed.set()
+                raise Exception("書き込みに失敗しました")
+            apply_changes(saved, deleted)
+        backend.apply_changes = failing_apply_changes
+
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        memory_repository.logger.addHandler(handler)
+        try:
+            repository = InMemoryUserRepository(backend, flush_interval=0.01)
+            repository.save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+            deadline = time.monotonic() + 5
+            while len(records) == 0 and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            memory_repository.logger.removeHandler(handler)
+        assert len(records) == 1 and records[0].exc_info is not None
+        try:
+            repository.close()
+            assert False
+        except Exception as e:
+            assert "失敗" in str(e)
+        assert UserRepository(store_path).find(1) is not None
+        repository.close()
+
+
+class UserTransferTest:
+    """インポート・エクスポートのテストコード"""
+
+    def test_import_errors(self):
+        """不正なレコードと、かたまりをまたいで重複したidと名前をエラーにする。エラーがあれば保存しない"""
+        work_dir = tempfile.mkdtemp()
+        path = os.path.join(work_dir, "users.csv")
+        with open(path, "w") as writer:
+            writer.write("id,first_name,last_name\n1,kta,mido\n2,,mido\n3,foo,bar\nx,foo,baz\n1,foo,qux\n4,kta,mido\n5,hoge,fuga\n")
+        repository = UserRepository(os.path.join(work_dir, "store.json"))
+        result = import_users(path, repository, workers=2, chunk_size=2)
+        assert result.records == 7 and result.written == 0
+        assert [error.split(":")[0] for error in result.errors] == ["3行目", "5行目", "6行目", "7行目"]
+        assert repository.find(1) is None
+
+        result = import_users(path, repository, workers=2, chunk_size=2, skip_invalid=True)
+        assert result.written == 3
+        assert sorted(user.id for user in repository.iter_users()) == [1, 3, 5]
+
+    def test_import_against_store(self):
+        """データストアにすでにあるidと名前はエラーにして上書きしない。CSVの空行は読み飛ばす"""
+        work_dir = tempfile.mkdtemp()
+        path = os.path.join(work_dir, "users.csv")
+        with open(path, "w") as writer:
+            writer.write("id,first_name,last_name\n\n1,foo,bar\n2,kta,mido\n  ,  \n3,hoge,fuga\n")
+        repository = UserRepository(os.path.join(work_dir, "store.json"))
+        repository.save(User(id=1, user_name=UserName(first_name="kta", last_name="mido")))
+        result = import_users(path, repository, workers=1, chunk_size=2)
+        assert result.records == 3 and result.written == 0
+        assert [error.split(":")[0] for error in result.errors] == ["3行目", "4行目"]
+        assert "データストア" in result.errors[0]
+
+        result = import_users(path, repository, workers=1, chunk_size=2, skip_invalid=True)
+        assert result.written == 1
+        assert repository.find(1).user_name == UserName(first_name="kta", last_name="mido")
+        assert repository.find(3) is not None
+
+    def test_import_normalized_names(self):
+        """検証で変換された名前を保存し、重複の確認も変換後の名前で行う"""
+        work_dir = tempfile.mkdtemp()
+        path = os.path.join(work_dir, "users.ndjson")
+        with open(path, "w") as writer:
+            writer.write('{"id": 1, "user_name": {"first_name": 12345, "last_name": "mido"}}\n')
+            writer.write('{"id": 2, "user_name": {"first_name": "12345", "last_name": "mido"}}\n')
+        store_path = os.path.join(work_dir, "store.json")
+        result = import_users(path, UserRepository(store_path), workers=1, skip_invalid=True)
+        assert result.written == 1 and [error.split(":")[0] for error in result.errors] == ["2行目"]
+        assert UserStoreSchema.parse_file(store_path).users[0].user_name.first_name == "12345"
+        assert UserRepository(store_path).find(1).user_name.first_name == "12345"
+
+    def test_round_trip(self):
+        """エクスポートしたNDJSONを別のバックエンドにインポートできる"""
+        work_dir = tempfile.mkdtemp()
+        source = UserRepository(os.path.join(work_dir, "store.json"), cache=False)
+        source.save_many([User(id=i, user_name=UserName(first_name=f"user{i}", last_name="けいた")) for i in range(1, 201)])
+        path = os.path.join(work_dir, "users.ndjson")
+        assert export_users(source, path).records == 200
+
+        target = SqliteUserRepository(os.path.join(work_dir, "store.sqlite3"))
+        result = import_users(path, target, workers=2, chunk_size=50)
+        assert result.errors == [] and result.written == 200 and result.records_per_second() > 0
+        assert target.find(200).user_name == UserName(first_name="user200", last_name="けいた")
+        target.close()
+
 
 if __name__ == "__main__":
     test = UserServiceTest()
 
     test.test_exists_false()
     test.test_exists_true()
+    test.test_duplicates()
+
+    test = UserRepositoryTest()
+
+    test.test_list_and_search()
+    test.test_save_and_find()
+    test.test_snapshot_is_not_shared()
+    test.test_reload_when_file_changed()
+    test.test_find_does_not_reparse()
+    test.test_bulk()
+    test.test_version_conflict()
+    test.test_multi_process_writes()
+    test.test_streaming_without_cache()
+    test.test_invalidate()
+    test.test_trusted_load()
+    test.test_unique_name()
+    test.test_name_filter()
+    test.test_codecs()
+
+    test = UserStoreReaderTest()
+
+    test.test_same_as_parse_file()
+    test.test_stop_at_first_match()
+
+    test = JournalUserRepositoryTest()
+
+    test.test_list_and_search()
+    test.test_recover_after_restart()
+    test.test_bulk()
+    test.test_compaction()
+    test.test_discard_incomplete_record()
+    test.test_unique_name()
+
+    test = ShardedUserRepositoryTest()
+
+    test.test_list_and_search()
+    test.test_save_and_find()
+    test.test_unique_name_across_shards()
+    test.test_shard_count_mismatch()
+    test.test_rebalance()
+
+    test = SqliteUserRepositoryTest()
+
+    test.test_list_and_search()
+    test.test_save_and_find()
+    test.test_bulk()
+    test.test_unique_name()
+    test.test_iter_users_returns_connections()
+    test.test_pool_timeout()
+    test.test_concurrent_save()
+
+    test = BlockIdAllocatorTest()
+
+    test.test_restart()
+    test.test_threads()
+    test.test_processes()
+
+    test = BinaryUserRepositoryTest()
+
+    test.test_list_and_search()
+    test.test_save_and_find()
+    test.test_bulk()
+    test.test_reopen_when_file_replaced()
+    test.test_convert()
+    test.test_unique_name()
+    test.test_unique_name_in_first_write()
+
+    test = CircleRepositoryTest()
+
+    test.test_join()
+    test.test_find_by_member()
+    test.test_version_conflict()
+
+    test = UserTransferTest()
+
+    test.test_import_errors()
+    test.test_import_against_store()
+    test.test_import_normalized_names()
+    test.test_round_trip()
+
+    test = InMemoryUserRepositoryTest()
+
+    test.test_save_and_find()
+    test.test_readers_see_consistent_snapshots()
+    test.test_flush_to_backend()
+    test.test_periodic_flush_error()
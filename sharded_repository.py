@@ -0,0 +1,208 @@
+import heapq
+import itertools
+import json
+import os
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, List, Dict, Iterator, Callable, TypeVar
+from entity import User
+from value_object import UserName
+from repository import IUserRepository, UserRepository, UserNameIndex, name_key, write_atomically
+from store_reader import iter_user_records
+
+T = TypeVar("T")
+
+MANIFEST = "shards.json"
+DEFAULT_SHARD_COUNT = 4
+
+def shard_of(id: int, shard_count: int) -> int:
+    """idからシャード番号を決める (プロセスやPythonのバージョンによらず同じ値になるようにcrc32を使う)"""
+    return zlib.crc32(str(id).encode()) % shard_count
+
+def shard_path(store_dir: str, shard: int) -> str:
+    return os.path.join(store_dir, f"shard-{shard:04d}.json")
+
+def read_shard_count(store_dir: str) -> Optional[int]:
+    manifest_path = os.path.join(store_dir, MANIFEST)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, encoding="utf-8") as reader:
+        return json.load(reader)["shard_count"]
+
+def write_shard_count(store_dir: str, shard_count: int):
+    # シャードのファイルと同じく一時ファイルからリネームするので、途中で停止しても壊れたshards.jsonが残らない
+    write_atomically(os.path.join(store_dir, MANIFEST), json.dumps({"shard_count": shard_count}))
+
+def read_shard_records(path: str) -> List[dict]:
+    """シャードのファイルのユーザーを辞書のまま読む (map_shardsでワーカープロセスから呼ぶ)"""
+    if not os.path.exists(path):
+        return []
+    return list(iter_user_records(path))
+
+class ShardedUserRepository(IUserRepository):
+    """シャーディングしたリポジトリ
+    ユーザーをidのハッシュでshard_count個のファイル (シャード) に分けて保存する。
+    各シャードはUserRepositoryなので、ロックやスナップショットはシャードごとに独立している。
+
+    - find/save/deleteはidから決まる1つのシャードだけを読み書きするので、書き込みのI/Oはシャード1つ分で済む
+    - find_by_nameは全シャードのスナップショットの名前のインデックスを引く (ファイルは走査しない)
+    - 名前の重複は、書き込む前に全シャードに対して確認する (シャードの中の確認だけでは、別のシャードの同じ名前を見逃すため)
+    - map_shardsは各シャードのファイルに対する処理をプロセスプールで並列に実行する。
+      iter_usersの全件の走査もmap_shardsで各シャードのファイルを並列にパースする
+    - シャード数はディレクトリのshards.jsonに記録する。変更するときはrebalance_shards.pyで再配置する
+
+    apply_changesなど複数のシャードにまたがる書き込みは、シャードごとには1回の書き込みでアトミックだが、
+    シャード間ではアトミックではない。名前の重複の確認と書き込みは、同じプロセスの中ではロックで直列化するが、
+    同じディレクトリに別のプロセスが同時に書き込む場合は重複を防げない。
+    """
+    def __init__(self, store_dir: str, shard_count: Optional[int] = None, max_workers: Optional[int] = None):
+        os.makedirs(store_dir, exist_ok=True)
+        stored_count = read_shard_count(store_dir)
+        if stored_count is None:
+            stored_count = shard_count or DEFAULT_SHARD_COUNT
+            write_shard_count(store_dir, stored_count)
+        elif shard_count is not None and shard_count != stored_count:
+            raise Exception(
+                f"シャード数が一致しません (保存済み={stored_count}, 指定={shard_count})。rebalance_shards.pyで再配置してください"
+            )
+        self._store_dir = store_dir
+        self._shard_count = stored_count
+        self._shards = [UserRepository(shard_path(store_dir, shard)) for shard in range(stored_count)]
+        self._max_workers = max_workers or min(stored_count, os.cpu_count() or 1)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # 全シャードに対する名前の重複の確認から書き込みまでを直列化する
+        self._write_lock = threading.RLock()
+
+    @property
+    def shard_count(self) -> int:
+        return self._shard_count
+
+    def _shard(self, id: int) -> UserRepository:
+        return self._shards[shard_of(id, self._shard_count)]
+
+    def _group(self, users: List[User]) -> Dict[int, List[User]]:
+        groups: Dict[int, List[User]] = {}
+        for user in users:
+            groups.setdefault(shard_of(user.id, self._shard_count), []).append(user)
+        return groups
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self._max_workers)
+        return self._executor
+
+    def map_shards(self, func: Callable[[str], T]) -> List[T]:
+        """各シャードのファイルパスを引数にfuncをプロセスプールで並列に実行する
+        funcはワーカープロセスに渡せるように、モジュールのトップレベルに定義した関数にすること
+        """
+        paths = [shard_path(self._store_dir, shard) for shard in range(self._shard_count)]
+        return list(self._pool().map(func, paths))
+
+    def warm_up(self):
+        """各シャードのスナップショットを読み込み、プロセスプールを起動しておく"""
+        for shard in self._shards:
+            shard.warm_up()
+        self.map_shards(os.path.exists)
+
+    def close(self):
+        for shard in self._shards:
+            shard.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _check_names(self, saved: List[User], deleted: List[User]):
+        """削除と保存を反映したときに、全シャードを通して同じ名前のユーザーが複数にならないか確認する"""
+        if len(saved) == 0:
+            return
+        found = self.find_many_by_name([user.user_name for user in saved])
+        UserNameIndex(found).check(saved, deleted)
+
+    def clear(self):
+        with self._write_lock:
+            for shard in self._shards:
+                shard.clear()
+
+    def save(self, user: User) -> User:
+        with self._write_lock:
+            self._check_names([user], [])
+            return self._shard(user.id).save(user)
+
+    def delete(self, user: User):
+        with self._write_lock:
+            self._shard(user.id).delete(user)
+
+    def find_by_name(self, user_name: UserName) -> Optional[User]:
+        found = self.find_many_by_name([user_name])
+        return found[0] if len(found) > 0 else None
+
+    def find(self, id: int) -> Optional[User]:
+        return self._shard(id).find(id)
+
+    def save_many(self, users: List[User]) -> List[User]:
+        with self._write_lock:
+            self._check_names(users, [])
+            for shard, group in self._group(users).items():
+                self._shards[shard].save_many(group)
+            return users
+
+    def delete_many(self, users: List[User]):
+        with self._write_lock:
+            for shard, group in self._group(users).items():
+                self._shards[shard].delete_many(group)
+
+    def find_many(self, ids: List[int]) -> List[User]:
+        groups: Dict[int, List[int]] = {}
+        for id in ids:
+            groups.setdefault(shard_of(id, self._shard_count), []).append(id)
+        found: Dict[int, User] = {}
+        for shard, group in groups.items():
+            for user in self._shards[shard].find_many(group):
+                found[user.id] = user
+        return [found[id] for id in ids if id in found]
+
+    def find_many_by_name(self, user_names: List[UserName]) -> List[User]:
+        # 名前からはシャードが決まらないので全シャードを引くが、各シャードは名前のインデックスの参照だけで済む
+        return [user for shard in self._shards for user in shard.find_many_by_name(user_names)]
+
+    def apply_changes(self, saved: List[User], deleted: List[User]):
+        with self._write_lock:
+            self._check_names(saved, deleted)
+            saved_groups = self._group(saved)
+            deleted_groups = self._group(deleted)
+            for shard in sorted(set(saved_groups) | set(deleted_groups)):
+                self._shards[shard].apply_changes(saved_groups.get(shard, []), deleted_groups.get(shard, []))
+
+    def iter_users(self) -> Iterator[User]:
+        # パースはワーカープロセスで並列に行い、シャードの順に辞書からユーザーを作って返す
+        # (パース済みのシャードの辞書は、返し終わるまでメモリに残る)
+        for records in self.map_shards(read_shard_records):
+            for record in records:
+                yield User.from_trusted(record)
+
+    def list(self, cursor: Optional[int] = None, limit: int = 100) -> List[User]:
+        # 各シャードの先頭limit件をidの順にマージする。読むのはシャード数 * limit件まで
+        pages = [shard.list(cursor, limit) for shard in self._shards]
+        return list(itertools.islice(heapq.merge(*pages, key=lambda user: user.id), limit))
+
+    def search_by_name_prefix(self, prefix: str, limit: int = 100) -> List[User]:
+        pages = [shard.search_by_name_prefix(prefix, limit) for shard in self._shards]
+        merged = heapq.merge(*pages, key=lambda user: (name_key(user.user_name), user.id))
+        return list(itertools.islice(merged, limit))
+
+
+if __name__ == "__main__":
+    # リポジトリ
+    repository = ShardedUserRepository("store.shards", shard_count=4)
+
+    # 初期化
+    repository.clear()
+
+    # ユーザー追加処理 (idごとに1つのシャードにだけ書き込む)
+    repository.save_many([User(id=i, user_name=UserName(first_name=f"foo{i}", last_name="bar")) for i in range(100)])
+    print(repository.find(42))  # id=42 user_name=UserName(first_name='foo42', last_name='bar')
+
+    # 名前での検索は全シャードの名前のインデックスを引く
+    print(repository.find_by_name(UserName(first_name="foo7", last_name="bar")))  # id=7 ...
+    repository.close()
@@ -0,0 +1,237 @@
+import queue
+import sqlite3
+from contextlib import contextmanager
+from typing import Iterator, Optional, List
+from entity import User
+from value_object import UserName
+from repository import IUserRepository
+
+# SQLは定数にしておき、接続ごとのステートメントキャッシュ (sqlite3のcached_statements) で
+# コンパイル済みのステートメントを使い回す
+CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    first_name TEXT NOT NULL,
+    last_name TEXT NOT NULL
+)
+"""
+CREATE_NAME_INDEX = "CREATE UNIQUE INDEX IF NOT EXISTS users_name ON users (first_name, last_name)"
+# search_by_name_prefix用の「姓 名」(repository.name_key) の式インデックス
+CREATE_NAME_KEY_INDEX = "CREATE INDEX IF NOT EXISTS users_name_key ON users (last_name || ' ' || first_name, id)"
+UPSERT = """
+INSERT INTO users (id, first_name, last_name) VALUES (?, ?, ?)
+ON CONFLICT (id) DO UPDATE SET first_name = excluded.first_name, last_name = excluded.last_name
+"""
+DELETE = "DELETE FROM users WHERE id = ?"
+DELETE_ALL = "DELETE FROM users"
+SELECT_BY_ID = "SELECT id, first_name, last_name FROM users WHERE id = ?"
+SELECT_BY_NAME = "SELECT id, first_name, last_name FROM users WHERE first_name = ? AND last_name = ?"
+SELECT_PAGE = "SELECT id, first_name, last_name FROM users WHERE id > ? ORDER BY id LIMIT ?"
+# 範囲の条件と並び順の式をインデックスと同じにして、インデックスの範囲走査で取り出す
+SELECT_BY_NAME_PREFIX = """
+SELECT id, first_name, last_name FROM users
+WHERE last_name || ' ' || first_name >= ? AND last_name || ' ' || first_name < ?
+ORDER BY last_name || ' ' || first_name, id LIMIT ?
+"""
+SELECT_BY_NAME_KEY_FROM = """
+SELECT id, first_name, last_name FROM users
+WHERE last_name || ' ' || first_name >= ?
+ORDER BY last_name || ' ' || first_name, id LIMIT ?
+"""
+# 古いSQLiteのバインド変数の上限 (999) を超えないように分割する
+CHUNK_SIZE = 500
+# SQLiteのINTEGERの最小値。listでcursorを省略したときに使う
+MIN_ID = -(2 ** 63)
+
+
+def _prefix_upper_bound(prefix: str) -> Optional[str]:
+    """prefixで始まるどの文字列よりも大きい最小の文字列。上限がなければNone
+    SQLiteのTEXTの比較 (UTF-8のバイト列の比較) はPythonの文字列の比較と同じ順序になる
+    """
+    prefix = prefix.rstrip(chr(0x10FFFF))
+    if len(prefix) == 0:
+        return None
+    code = ord(prefix[-1]) + 1
+    if 0xD800 <= code <= 0xDFFF:
+        # サロゲートはUTF-8にできないので飛ばす
+        code = 0xE000
+    return prefix[:-1] + chr(code)
+
+
+class SqliteUserRepository(IUserRepository):
+    """SQLiteのリポジトリ
+    idは主キー、(first_name, last_name)はユニークインデックスで検索するので、find・find_by_nameはO(log n)。
+    WALモードにして、読み込みと書き込みが互いにブロックしないようにする。
+    sqlite3の接続はスレッド間で同時に使えないので、接続プールから1スレッド1接続で貸し出す。
+    pool_timeout秒待っても接続を借りられなければ例外を投げる (接続を返却しない呼び出し元がいても止まり続けないように)。
+
+    UserRepositoryと同じくstore_pathを受け取るので、DIコンテナでそのまま差し替えられる。
+    """
+    def __init__(self, store_path: str, pool_size: int = 4, pool_timeout: float = 30.0):
+        self._store_path = store_path
+        self._pool_timeout = pool_timeout
+        self._pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        for _ in range(pool_size):
+            self._pool.put(self._connect())
+        with self._connection() as connection:
+            connection.execute(CREATE_TABLE)
+            connection.execute(CREATE_NAME_INDEX)
+            connection.execute(CREATE_NAME_KEY_INDEX)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self._store_path, timeout=30, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        """プールから接続を借りてトランザクションを実行し、終わったら返却する"""
+        try:
+            connection = self._pool.get(timeout=self._pool_timeout)
+        except queue.Empty:
+            raise Exception(f"接続プールから接続を取得できません ({self._pool_timeout}秒待ちました)")
+        try:
+            with connection:
+                yield connection
+        finally:
+            self._pool.put(connection)
+
+    def _to_user(self, row) -> User:
+        id, first_name, last_name = row
+        # 書き込むときに検証済みなので、読み込みではバリデーションを省く
+        return User.construct(id=id, user_name=UserName.from_trusted(first_name, last_name))
+
+    def close(self):
+        while not self._pool.empty():
+            self._pool.get().close()
+
+    def clear(self):
+        with self._connection() as connection:
+            connection.execute(DELETE_ALL)
+
+    def save(self, user: User) -> User:
+        try:
+            with self._connection() as connection:
+                connection.execute(UPSERT, (user.id, user.user_name.first_name, user.user_name.last_name))
+        except sqlite3.IntegrityError:
+            raise Exception(f"{user.user_name} はすでに存在しています")
+        return user
+
+    def delete(self, user: User):
+        with self._connection() as connection:
+            connection.execute(DELETE, (user.id,))
+
+    def find_by_name(self, user_name: UserName) -> Optional[User]:
+        with self._connection() as connection:
+            row = connection.execute(SELECT_BY_NAME, (user_name.first_name, user_name.last_name)).fetchone()
+        return self._to_user(row) if row is not None else None
+
+    def find(self, id: int) -> Optional[User]:
+        with self._connection() as connection:
+            row = connection.execute(SELECT_BY_ID, (id,)).fetchone()
+        return self._to_user(row) if row is not None else None
+
+    def save_many(self, users: List[User]) -> List[User]:
+        rows = [(user.id, user.user_name.first_name, user.user_name.last_name) for user in users]
+        try:
+            with self._connection() as connection:
+                connection.executemany(UPSERT, rows)
+        except sqlite3.IntegrityError:
+            raise Exception("同じ名前のユーザーがすでに存在しています")
+        return users
+
+    def delete_many(self, users: List[User]):
+        with self._connection() as connection:
+            connection.executemany(DELETE, [(user.id,) for user in users])
+
+    def find_many(self, ids: List[int]) -> List[User]:
+        found = {}
+        with self._connection() as connection:
+            for start in range(0, len(ids), CHUNK_SIZE):
+                chunk = ids[start:start + CHUNK_SIZE]
+                placeholders = ", ".join("?" * len(chunk))
+                sql = f"SELECT id, first_name, last_name FROM users WHERE id IN ({placeholders})"
+                for row in connection.execute(sql, chunk):
+                    found[row[0]] = row
+        return [self._to_user(found[id]) for id in ids if id in found]
+
+    def apply_changes(self, saved: List[User], deleted: List[User]):
+        rows = [(user.id, user.user_name.first_name, user.user_name.last_name) for user in saved]
+        try:
+            with self._connection() as connection:
+                connection.executemany(DELETE, [(user.id,) for user in deleted])
+                connection.executemany(UPSERT, rows)
+        except sqlite3.IntegrityError:
+            raise Exception("同じ名前のユーザーがすでに存在しています")
+
+    def find_many_by_name(self, user_names: List[UserName]) -> List[User]:
+        users = []
+        with self._connection() as connection:
+            for user_name in user_names:
+                row = connection.execute(SELECT_BY_NAME, (user_name.first_name, user_name.last_name)).fetchone()
+                if row is not None:
+                    users.append(self._to_user(row))
+        return users
+
+    def iter_users(self) -> Iterator[User]:
+        # idのキーセットでCHUNK_SIZE件ずつ取り出すので、全件をメモリに載せない
+        # ページごとに接続を返却するので、走査が途中で止まっていても他の呼び出しは接続を借りられる
+        cursor = MIN_ID
+        while True:
+            with self._connection() as connection:
+                rows = connection.execute(SELECT_PAGE, (cursor, CHUNK_SIZE)).fetchall()
+            for row in rows:
+                yield self._to_user(row)
+            if len(rows) < CHUNK_SIZE:
+                return
+            cursor = rows[-1][0]
+
+    def list(self, cursor: Optional[int] = None, limit: int = 100) -> List[User]:
+        with self._connection() as connection:
+            rows = connection.execute(SELECT_PAGE, (cursor if cursor is not None else MIN_ID, limit)).fetchall()
+        return [self._to_user(row) for row in rows]
+
+    def search_by_name_prefix(self, prefix: str, limit: int = 100) -> List[User]:
+        upper = _prefix_upper_bound(prefix)
+        with self._connection() as connection:
+            if upper is None:
+                rows = connection.execute(SELECT_BY_NAME_KEY_FROM, (prefix, limit)).fetchall()
+            else:
+                rows = connection.execute(SELECT_BY_NAME_PREFIX, (prefix, upper, limit)).fetchall()
+        return [self._to_user(row) for row in rows]
+
+
+if __name__ == "__main__":
+    from dependency_injector import providers
+    from di_container import Container
+
+    container = Container()
+    container.config.from_dict({"store_path": "store.sqlite3"})
+
+    # UserRepositoryの代わりにSqliteUserRepositoryを使う
+    container.store_repository.override(
+        providers.Factory(SqliteUserRepository, store_path=container.config.store_path)
+    )
+
+    # リポジトリ
+    repository = container.user_repository()
+
+    # アプリケーション
+    app = container.user_application()
+
+    # 初期化
+    repository.clear()
+
+    # 追加
+    app.register(1, "kta", "mido")
+    app.register(2, "foo", "bar")
+
+    # 取得
+    print(app.get(1))  # id=1 user_name=UserName(first_name='kta', last_name='mido')
+
+    # 更新
+    app.update(1, "keita", "midorikawa")
+
+    # 削除
+    app.delete(2)
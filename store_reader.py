@@ -0,0 +1,121 @@
+import json
+import re
+from typing import Iterator, TextIO, Any
+from entity import User
+
+class UserStoreReader:
+    """データストアのファイルからユーザーを1件ずつ読み出すストリーミングリーダー
+
+    UserStoreSchema.parse_fileはファイル全体を読み込んで全ユーザーのモデルを作るが、
+    このリーダーはバッファ付きでファイルを少しずつ読み、"users"配列の要素を1件ずつデコードして返す。
+    途中で読むのをやめればそれ以降は読み込まないので、検索は最初に一致した時点で終わり、
+    全件の走査もバッファ1つ分のメモリで済む。
+    """
+    NON_WHITESPACE = re.compile(r"\S")
+    TERMINATOR = re.compile(r"[,\]}\s]")
+
+    def __init__(self, reader: TextIO, buffer_size: int = 64 * 1024):
+        self._reader = reader
+        self._buffer_size = buffer_size
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        """バッファに続きを読み込む。ファイルの終わりならFalse"""
+        if self._eof:
+            return False
+        chunk = self._reader.read(self._buffer_size)
+        if chunk == "":
+            self._eof = True
+            return False
+        # 読み終わった部分は捨てる
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        """空白を読み飛ばし、次の文字を返す。ファイルの終わりなら空文字"""
+        while True:
+            match = self.NON_WHITESPACE.search(self._buffer, self._pos)
+            if match is not None:
+                self._pos = match.start()
+                return self._buffer[self._pos]
+            self._pos = len(self._buffer)
+            if not self._fill():
+                return ""
+
+    def _expect(self, *chars: str) -> str:
+        char = self._peek()
+        if char == "" or char not in chars:
+            raise ValueError(f"{'/'.join(chars)} が必要です (位置={self._pos}, 文字={char!r})")
+        self._pos += 1
+        return char
+
+    def _decode(self) -> Any:
+        """次のJSONの値を1つデコードする。値がバッファの途中で切れていれば続きを読み込む"""
+        if self._peek() in "-0123456789":
+            # 数値は途中で切れていてもデコードできてしまうので、区切り文字まで読み込んでおく
+            while self.TERMINATOR.search(self._buffer, self._pos) is None and self._fill():
+                pass
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            self._pos = end
+            return value
+
+    def records(self) -> Iterator[dict]:
+        """"users"配列の要素を辞書のまま1件ずつ返す"""
+        self._expect("{")
+        if self._peek() == "}":
+            return
+        while True:
+            key = self._decode()
+            self._expect(":")
+            if key == "users":
+                self._expect("[")
+                if self._peek() == "]":
+                    self._pos += 1
+                else:
+                    while True:
+                        yield self._decode()
+                        if self._expect(",", "]") == "]":
+                            break
+            else:
+                self._decode()
+            if self._expect(",", "}") == "}":
+                return
+
+def iter_user_records(store_path: str, buffer_size: int = 64 * 1024) -> Iterator[dict]:
+    """データストアのユーザーを辞書のまま1件ずつ返す"""
+    # コーデックはensure_ascii=FalseのUTF-8で書き込むので、ロケールによらずUTF-8で読む
+    with open(store_path, "r", encoding="utf-8", buffering=buffer_size) as reader:
+        yield from UserStoreReader(reader, buffer_size).records()
+
+def iter_users(store_path: str, buffer_size: int = 64 * 1024) -> Iterator[User]:
+    """データストアのユーザーを1件ずつ返す"""
+    for record in iter_user_records(store_path, buffer_size):
+        yield User.from_trusted(record)
+
+
+if __name__ == "__main__":
+    from value_object import UserName
+    from repository import UserRepository
+
+    store_path = "store.json"
+
+    # リポジトリ
+    repository = UserRepository(store_path)
+    repository.clear()
+    repository.save_many([User(id=i, user_name=UserName(first_name=f"foo{i}", last_name="bar")) for i in range(1000)])
+
+    # 先頭から順に読み、見つかった時点で読むのをやめる
+    for user in iter_users(store_path):
+        if user.id == 10:
+            print(user)  # id=10 user_name=UserName(first_name='foo10', last_name='bar')
+            break
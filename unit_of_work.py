@@ -0,0 +1,182 @@
+from typing import Optional, List, Dict, Set, Iterator
+from entity import User
+from value_object import UserName
+from repository import IUserRepository, UserRepository, name_key
+
+class UserUnitOfWork(IUserRepository):
+    """ユニットオブワーク
+    リポジトリへの変更 (新規・変更・削除) を記録しておき、commit()で1回の書き込みにまとめて永続化する。
+    rollback()すると記録した変更をすべて捨てる。
+
+    IUserRepositoryを実装しているので、アプリケーションサービスにリポジトリとして渡せば
+    複数のユースケースの呼び出しをまとめられる。
+    同じidのユーザーはアイデンティティマップで管理し、何度findしても同じオブジェクトを返す。
+    """
+    def __init__(self, repository: IUserRepository):
+        self._repository = repository
+        self._identity_map: Dict[int, User] = {}
+        self._loaded: Set[int] = set()
+        self._new: Dict[int, User] = {}
+        self._dirty: Dict[int, User] = {}
+        self._deleted: Dict[int, User] = {}
+        # saveしたときの名前。リポジトリ上の古い名前の検索結果を隠し、前方一致の検索に重ねるのに使う
+        self._names: Dict[int, UserName] = {}
+
+    def __enter__(self) -> "UserUnitOfWork":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+    def _register_loaded(self, user: User) -> User:
+        """リポジトリから読み込んだユーザーをアイデンティティマップに登録する"""
+        if user.id not in self._identity_map:
+            self._identity_map[user.id] = user
+            self._loaded.add(user.id)
+        return self._identity_map[user.id]
+
+    def _is_hidden(self, user: User) -> bool:
+        """リポジトリ上の状態が、このユニットオブワークの変更で上書きされているか"""
+        return user.id in self._deleted or user.id in self._names
+
+    def commit(self):
+        """記録した変更を1回の書き込みで永続化する"""
+        saved = list(self._new.values()) + list(self._dirty.values())
+        deleted = list(self._deleted.values())
+        if len(saved) > 0 or len(deleted) > 0:
+            self._repository.apply_changes(saved, deleted)
+        self._reset()
+
+    def rollback(self):
+        """記録した変更を捨てる。読み込んだオブジェクトも書き換えられている可能性があるので捨てる"""
+        self._reset()
+
+    def _reset(self):
+        self._identity_map.clear()
+        self._loaded.clear()
+        self._new.clear()
+        self._dirty.clear()
+        self._deleted.clear()
+        self._names.clear()
+
+    def save(self, user: User) -> User:
+        self._deleted.pop(user.id, None)
+        self._identity_map[user.id] = user
+        self._names[user.id] = user.user_name
+        if user.id in self._loaded:
+            self._dirty[user.id] = user
+        else:
+            self._new[user.id] = user
+        return user
+
+    def delete(self, user: User):
+        self._identity_map.pop(user.id, None)
+        self._names.pop(user.id, None)
+        self._dirty.pop(user.id, None)
+        self._new.pop(user.id, None)
+        # 新規のユーザーでもデータストアに同じidが残っている可能性があるので、削除は必ず記録する
+        self._deleted[user.id] = user
+
+    def find_by_name(self, user_name: UserName) -> Optional[User]:
+        found = self.find_many_by_name([user_name])
+        return found[0] if len(found) > 0 else None
+
+    def find(self, id: int) -> Optional[User]:
+        found = self.find_many([id])
+        return found[0] if len(found) > 0 else None
+
+    def save_many(self, users: List[User]) -> List[User]:
+        for user in users:
+            self.save(user)
+        return users
+
+    def delete_many(self, users: List[User]):
+        for user in users:
+            self.delete(user)
+
+    def find_many(self, ids: List[int]) -> List[User]:
+        missing = [id for id in ids if id not in self._identity_map and id not in self._deleted]
+        if len(missing) > 0:
+            for user in self._repository.find_many(missing):
+                self._register_loaded(user)
+        found = [self._identity_map.get(id) for id in ids if id not in self._deleted]
+        return [user for user in found if user is not None]
+
+    def find_many_by_name(self, user_names: List[UserName]) -> List[User]:
+        """アイデンティティマップのユーザーは、リポジトリ上の名前ではなく現在の名前で判定する"""
+        wanted = set(user_names)
+        found = {id: user for id, user in self._identity_map.items() if user.user_name in wanted}
+        for user in self._repository.find_many_by_name(user_names):
+            if self._is_hidden(user) or user.id in found:
+                continue
+            user = self._register_loaded(user)
+            if user.user_name in wanted:
+                found[user.id] = user
+        return list(found.values())
+
+    def apply_changes(self, saved: List[User], deleted: List[User]):
+        self.delete_many(deleted)
+        self.save_many(saved)
+
+    def iter_users(self) -> Iterator[User]:
+        """リポジトリのユーザーに、コミット前の変更を重ねて返す"""
+        seen = set()
+        for user in self._repository.iter_users():
+            if user.id in self._deleted:
+                continue
+            seen.add(user.id)
+            yield self._identity_map.get(user.id, user)
+        for id, user in list(self._new.items()):
+            if id not in seen:
+                yield user
+
+    def list(self, cursor: Optional[int] = None, limit: int = 100) -> List[User]:
+        """リポジトリのページに、コミット前の変更を重ねて返す
+        削除したユーザーの分だけ多めに取得すれば、除いた後もlimit件 (またはリポジトリの残り全部) が残る
+        """
+        users: Dict[int, User] = {}
+        for user in self._repository.list(cursor, limit + len(self._deleted)):
+            if user.id not in self._deleted:
+                users[user.id] = self._register_loaded(user)
+        for id in self._names:
+            if cursor is None or id > cursor:
+                users[id] = self._identity_map[id]
+        return [users[id] for id in sorted(users)[:limit]]
+
+    def search_by_name_prefix(self, prefix: str, limit: int = 100) -> List[User]:
+        """リポジトリの検索結果に、コミット前の変更を重ねて返す
+        削除・保存したユーザーはリポジトリ上の名前では返さないので、その分だけ多めに取得する
+        """
+        users: Dict[int, User] = {}
+        for user in self._repository.search_by_name_prefix(prefix, limit + len(self._deleted) + len(self._names)):
+            if not self._is_hidden(user):
+                users[user.id] = self._register_loaded(user)
+        for id, name in self._names.items():
+            if name_key(name).startswith(prefix):
+                users[id] = self._identity_map[id]
+        ordered = sorted(users.values(), key=lambda user: (name_key(self._names.get(user.id, user.user_name)), user.id))
+        return ordered[:limit]
+
+
+if __name__ == "__main__":
+    from domein_service import UserService
+    from application import UserApplicationService
+
+    # リポジトリ
+    repository = UserRepository("store.json")
+    repository.clear()
+
+    # ユニットオブワークをリポジトリとしてアプリケーションサービスに渡す
+    with UserUnitOfWork(repository) as uow:
+        app = UserApplicationService(uow, UserService(uow))
+        app.register(1, "kta", "mido")
+        app.register(2, "foo", "bar")
+        app.update(1, "keita", "midorikawa")
+        print(app.get(1) is app.get(1))  # True
+        print(repository.find(1))  # None (まだ書き込まれていない)
+
+    # withを抜けるとcommitされ、1回の書き込みで保存される
+    print(repository.find(1))  # id=1 user_name=UserName(first_name='keita', last_name='midorikawa')
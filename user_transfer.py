@@ -0,0 +1,290 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from collections import deque
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from pydantic import BaseModel
+from entity import User
+from value_object import UserName
+from repository import IUserRepository, UserRepository
+
+# CSVのヘッダー。1行目がこれと一致すればヘッダーとして読み飛ばす
+CSV_HEADER = ["id", "first_name", "last_name"]
+
+
+def _open_sqlite(path: str) -> IUserRepository:
+    from sqlite_repository import SqliteUserRepository
+    return SqliteUserRepository(path)
+
+def _open_journal(path: str) -> IUserRepository:
+    from journal_repository import JournalUserRepository
+    return JournalUserRepository(path)
+
+def _open_sharded(path: str) -> IUserRepository:
+    from sharded_repository import ShardedUserRepository
+    return ShardedUserRepository(path)
+
+def _open_binary(path: str) -> IUserRepository:
+    from binary_repository import BinaryUserRepository
+    return BinaryUserRepository(path)
+
+# コマンドラインで指定できるバックエンド。オプションのバックエンドは使うときに読み込む
+BACKENDS: Dict[str, Callable[[str], IUserRepository]] = {
+    # エクスポートでスナップショットを作らずに1件ずつ読むようにcache=Falseにする
+    "json": lambda path: UserRepository(path, cache=False),
+    "journal": _open_journal,
+    "sqlite": _open_sqlite,
+    "sharded": _open_sharded,
+    "binary": _open_binary,
+}
+
+
+class TransferResult(BaseModel):
+    """インポート・エクスポートの結果
+    records: 読み込んだ (書き出した) レコード数
+    written: リポジトリに保存したユーザー数 (エクスポートではrecordsと同じ)
+    errors: 不正なレコードと重複したレコードのエラーメッセージ
+    """
+    records: int
+    written: int
+    errors: List[str] = []
+    seconds: float
+
+    def records_per_second(self) -> float:
+        return self.records / self.seconds if self.seconds > 0 else 0.0
+
+
+def detect_format(path: str) -> str:
+    return "csv" if path.lower().endswith(".csv") else "ndjson"
+
+
+def validate_chunk(format: str, start_line: int, rows: list) -> Tuple[List[Tuple[int, int, str, str]], List[str]]:
+    """レコードのかたまりを検証し、(行番号, id, first_name, last_name) のリストとエラーメッセージのリストを返す
+    プロセスプールのワーカーで実行する。ワーカーとの受け渡しを軽くするため、Userではなくタプルを返す。
+    名前の検証はUserとUserNameのバリデーター (name_validator) をそのまま使い、
+    タプルには入力の値ではなく検証済みのUserの値を入れる (NDJSONの数値の名前などは文字列に変換される)。
+    """
+    valid: List[Tuple[int, int, str, str]] = []
+    errors: List[str] = []
+    for line, row in enumerate(rows, start_line):
+        try:
+            if format == "csv":
+                if len(row) != len(CSV_HEADER):
+                    raise ValueError(f"列の数が{len(CSV_HEADER)}ではありません")
+                id, first_name, last_name = row
+            else:
+                record = json.loads(row)
+                id = record["id"]
+                first_name = record["user_name"]["first_name"]
+                last_name = record["user_name"]["last_name"]
+            user = User(id=id, user_name=UserName(first_name=first_name, last_name=last_name))
+        except (ValueError, KeyError, TypeError) as e:
+            # pydanticのValidationErrorとJSONDecodeErrorはValueErrorのサブクラス
+            message = " ".join(str(e).split())
+            errors.append(f"{line}行目: 不正なレコードです ({message})")
+            continue
+        valid.append((line, user.id, user.user_name.first_name, user.user_name.last_name))
+    return valid, errors
+
+
+def _read_chunks(path: str, format: str, chunk_size: int) -> Iterator[Tuple[int, list]]:
+    """入力を (先頭の行番号, 行のリスト) のかたまりで1つずつ返す。ファイル全体をメモリに載せない
+    CSVは引用符の中の改行を正しく扱うためにここでcsv.readerで分割し、NDJSONは行のままワーカーに渡す
+    """
+    with open(path, encoding="utf-8", newline="") as reader:
+        if format == "csv":
+            rows = csv.reader(reader)
+            first = next(rows, None)
+            if first is None:
+                return
+            line = 2
+            if first != CSV_HEADER:
+                rows = itertools.chain([first], rows)
+                line = 1
+        else:
+            rows = (row for row in reader)
+            line = 1
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if len(chunk) == 0:
+                return
+            # 空行は行番号を数えるためにかたまりには残し、ワーカーに渡さない
+            if format == "csv":
+                chunk = [row if any(cell.strip() for cell in row) else None for row in chunk]
+            else:
+                chunk = [row if row.strip() else None for row in chunk]
+            yield line, chunk
+            line += len(chunk)
+
+
+def _validate_all(path: str, format: str, workers: int, chunk_size: int) -> Iterator[Tuple[List[Tuple[int, int, str, str]], List[str]]]:
+    """入力の順番どおりに検証結果を返す
+    workers > 1ならプロセスプールで並列に検証する。実行中のかたまりはworkers * 2個までにして、
+    読み込みが検証より先に進みすぎてメモリを使い切らないようにする
+    """
+    if workers <= 1:
+        for line, chunk in _read_chunks(path, format, chunk_size):
+            yield _validate_with_blanks(format, line, chunk)
+        return
+
+    # プロセスプールは並列にするときだけ読み込む
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for line, chunk in _read_chunks(path, format, chunk_size):
+            pending.append(executor.submit(_validate_with_blanks, format, line, chunk))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _validate_with_blanks(format: str, start_line: int, chunk: list) -> Tuple[List[Tuple[int, int, str, str]], List[str]]:
+    """空行 (None) を飛ばしながら、連続した行ごとにvalidate_chunkを呼ぶ"""
+    valid: List[Tuple[int, int, str, str]] = []
+    errors: List[str] = []
+    line = start_line
+    for blank, group in itertools.groupby(chunk, key=lambda row: row is None):
+        rows = list(group)
+        if not blank:
+            group_valid, group_errors = validate_chunk(format, line, rows)
+            valid.extend(group_valid)
+            errors.extend(group_errors)
+        line += len(rows)
+    return valid, errors
+
+
+def _check_store(repository: IUserRepository, candidates: List[Tuple[int, User]]) -> Tuple[List[User], List[str]]:
+    """(行番号, ユーザー) のうち、データストアにすでにあるidか名前と重複するものをエラーにする
+    保存できるユーザーのリストとエラーメッセージのリストを返す。問い合わせはidと名前で1回ずつ
+    """
+    if len(candidates) == 0:
+        return [], []
+    stored_ids = {user.id for user in repository.find_many([user.id for _, user in candidates])}
+    stored_names = {user.user_name for user in repository.find_many_by_name([user.user_name for _, user in candidates])}
+    users: List[User] = []
+    errors: List[str] = []
+    for line, user in candidates:
+        if user.id in stored_ids:
+            errors.append(f"{line}行目: idがデータストアのユーザーと重複しています (id={user.id})")
+        elif user.user_name in stored_names:
+            errors.append(f"{line}行目: 名前がデータストアのユーザーと重複しています ({user.user_name.first_name} {user.user_name.last_name})")
+        else:
+            users.append(user)
+    return users, errors
+
+
+def import_users(
+    path: str,
+    repository: IUserRepository,
+    format: Optional[str] = None,
+    workers: Optional[int] = None,
+    chunk_size: int = 10_000,
+    skip_invalid: bool = False,
+) -> TransferResult:
+    """CSVまたはNDJSONのユーザーを検証し、まとめてリポジトリに保存する
+    - CSV: id,first_name,last_name (1行目のヘッダーは省略できる)
+    - NDJSON: {"id": 1, "user_name": {"first_name": "...", "last_name": "..."}} (exportの出力と同じ形式)
+
+    検証はworkers個 (省略時はCPUのコア数) のプロセスでchunk_size件ずつ並列に行う。
+    入力全体でidか名前が重複しているレコードは、最初のもの以外をエラーにする。
+    データストアにすでにあるidか名前と重複したレコードもエラーにする (既存のユーザーを上書きしない)。
+    エラーがあれば何も保存しない。skip_invalid=Trueならエラーのレコードを除いて保存する。
+    保存はsave_manyの1回だけなので、UserRepositoryのようにファイル全体を書き直すバックエンドでも書き込みは1回で済む。
+    """
+    format = format or detect_format(path)
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+
+    records = 0
+    errors: List[str] = []
+    candidates: List[Tuple[int, User]] = []
+    # 重複の確認に使う、idと名前から最初に現れた行番号を引く辞書
+    lines_by_id: Dict[int, int] = {}
+    lines_by_name: Dict[Tuple[str, str], int] = {}
+    for valid, chunk_errors in _validate_all(path, format, workers, chunk_size):
+        records += len(valid) + len(chunk_errors)
+        errors.extend(chunk_errors)
+        for line, id, first_name, last_name in valid:
+            name = (first_name, last_name)
+            if id in lines_by_id:
+                errors.append(f"{line}行目: idが{lines_by_id[id]}行目と重複しています (id={id})")
+                continue
+            if name in lines_by_name:
+                errors.append(f"{line}行目: 名前が{lines_by_name[name]}行目と重複しています ({first_name} {last_name})")
+                continue
+            lines_by_id[id] = line
+            lines_by_name[name] = line
+            # ワーカーで検証済みなので、バリデーションを省いて作る
+            candidates.append((line, User.from_trusted({"id": id, "user_name": {"first_name": first_name, "last_name": last_name}})))
+
+    users, store_errors = _check_store(repository, candidates)
+    errors.extend(store_errors)
+    written = 0
+    if len(errors) == 0 or skip_invalid:
+        repository.save_many(users)
+        written = len(users)
+    return TransferResult(records=records, written=written, errors=errors, seconds=time.perf_counter() - start)
+
+
+def export_users(repository: IUserRepository, path: str, format: Optional[str] = None) -> TransferResult:
+    """リポジトリの全ユーザーをCSVまたはNDJSONに書き出す
+    iter_usersで1件ずつ読みながら書き出すので、iter_usersがストリーミングするバックエンドならメモリは一定
+    """
+    format = format or detect_format(path)
+    start = time.perf_counter()
+    records = 0
+    with open(path, "w", encoding="utf-8", newline="") as writer:
+        if format == "csv":
+            csv_writer = csv.writer(writer)
+            csv_writer.writerow(CSV_HEADER)
+            for user in repository.iter_users():
+                csv_writer.writerow([user.id, user.user_name.first_name, user.user_name.last_name])
+                records += 1
+        else:
+            for user in repository.iter_users():
+                user_name = {"first_name": user.user_name.first_name, "last_name": user.user_name.last_name}
+                writer.write(json.dumps({"id": user.id, "user_name": user_name}, ensure_ascii=False))
+                writer.write("\n")
+                records += 1
+    return TransferResult(records=records, written=records, seconds=time.perf_counter() - start)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="ユーザーをCSV・NDJSONからインポート・エクスポートする")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("path", help="入力・出力のファイル (拡張子が.csvならCSV、それ以外はNDJSON)")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="json")
+    parser.add_argument("--store", default="store.json", help="データストアのパス")
+    parser.add_argument("--format", choices=["csv", "ndjson"])
+    parser.add_argument("--workers", type=int, help="検証に使うプロセス数 (省略時はCPUのコア数)")
+    parser.add_argument("--chunk-size", type=int, default=10_000)
+    parser.add_argument("--skip-invalid", action="store_true", help="エラーのレコードを除いて保存する")
+    args = parser.parse_args(argv)
+
+    repository = BACKENDS[args.backend](args.store)
+    try:
+        if args.command == "import":
+            result = import_users(args.path, repository, args.format, args.workers, args.chunk_size, args.skip_invalid)
+        else:
+            result = export_users(repository, args.path, args.format)
+    finally:
+        close = getattr(repository, "close", None)
+        if close is not None:
+            close()
+
+    for error in result.errors:
+        print(error, file=sys.stderr)
+    print(f"{args.command}: records={result.records} written={result.written} errors={len(result.errors)} "
+          f"elapsed={result.seconds:.2f}s throughput={result.records_per_second():,.0f} records/s")
+    return 1 if len(result.errors) > 0 and not args.skip_invalid else 0
+
+
+if __name__ == "__main__":
+    # python user_transfer.py import users.csv --backend sqlite --store store.sqlite3
+    # python user_transfer.py export users.ndjson --backend json --store store.json
+    sys.exit(main())
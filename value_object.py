@@ -15,6 +15,26 @@ class UserName(BaseModel):
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
+    # 値オブジェクトは属性がすべて等しければ等しい。イミュータブルなのでハッシュ可能にして辞書のキーや集合の要素に使えるようにする
+    def __eq__(self, other):
+        if not isinstance(other, UserName):
+            return False
+        return self.first_name == other.first_name and self.last_name == other.last_name
+
+    def __hash__(self):
+        return hash((self.first_name, self.last_name))
+
+    @classmethod
+    def from_trusted(cls, first_name: str, last_name: str) -> "UserName":
+        """検証済みの値からバリデーションを省いて作る
+        データストアから読み込むときだけに使う。外部からの入力は通常のコンストラクタで検証すること
+        """
+        # construct()と同じく__dict__と__fields_set__を直接設定する (デフォルト値の処理がない分さらに速い)
+        user_name = cls.__new__(cls)
+        object.__setattr__(user_name, "__dict__", {"first_name": first_name, "last_name": last_name})
+        object.__setattr__(user_name, "__fields_set__", {"first_name", "last_name"})
+        return user_name
+
     class Config:
         # イミュータブルなオブジェクトにする
         # pydantic - ModelConfig - Options: https://pydantic-docs.helpmanual.io/usage/model_config/#options
@@ -26,4 +46,5 @@ if __name__ == "__main__":
     # user_name3 = UserName(first_name="", last_name="")    # バリデーションエラー
     # user_name1.first_name = "hoge"    # エラー
     print(user_name1)    # keita midorikawa
-    print(user_name1 == user_name2)    # True
\ No newline at end of file
+    print(user_name1 == user_name2)    # True
+    print(len({user_name1, user_name2}))    # 1
\ No newline at end of file